@@ -7,69 +7,4196 @@ import os
 import sys
 import sqlite3
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, unquote
 import base64
+import binascii
+import bisect
+import cProfile
+import calendar
+import codecs
+import gzip
+import hashlib
+import heapq
+import io
+import marshal
+import pstats
+import re
 import traceback
-import cgi
-import shutil
 import secrets
+import selectors
+import shutil
 import time
+import queue
+import signal
+import struct
+import threading
+import urllib.request
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from email.utils import formatdate
 from typing import Dict, Optional
 
-# 数据库路径
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
-DB_PATH = os.path.join(DATA_DIR, 'calendar.db')
+try:
+    import brotli  # 可选依赖，用于生成brotli压缩版本
+except ImportError:
+    brotli = None
+
+# 数据库路径
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.getenv('CALENDAR_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+DB_PATH = os.path.join(DATA_DIR, 'calendar.db')
+
+# 上传目录
+UPLOAD_DIR = os.getenv('CALENDAR_UPLOAD_DIR', os.path.join(BASE_DIR, 'uploads'))
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# 认证信息（与nginx保持一致）
+# 重要：在生产环境中，请通过环境变量设置这些值，不要硬编码在源代码中
+# 例如：export CALENDAR_USER=your_username，export CALENDAR_PASS=your_password
+AUTH_USER = os.getenv('CALENDAR_USER', 'admin')  # 默认用户名，建议通过环境变量覆盖
+AUTH_PASS = os.getenv('CALENDAR_PASS', '[YOUR_SECURE_PASSWORD_HERE]')  # 必须通过环境变量设置密码
+AUTH_STRING = base64.b64encode(f'{AUTH_USER}:{AUTH_PASS}'.encode()).decode()
+
+# Session管理配置
+SESSION_DB_PATH = os.path.join(DATA_DIR, 'sessions.db')
+SESSION_TIMEOUT = 24 * 3600  # 24小时
+SESSION_COOKIE_NAME = 'calendar_session'
+
+# 内存中的session存储（简单实现）
+_sessions: Dict[str, Dict] = {}
+
+# Session缓存配置
+SESSION_CACHE_SIZE = int(os.getenv('CALENDAR_SESSION_CACHE_SIZE', '10000'))  # 缓存的session数量上限
+SESSION_CACHE_TTL = int(os.getenv('CALENDAR_SESSION_CACHE_TTL', '60'))  # 缓存条目有效期（秒），多进程下登出最多延迟这么久生效
+SESSION_TOUCH_INTERVAL = int(os.getenv('CALENDAR_SESSION_TOUCH_INTERVAL', '30'))  # 批量写回last_activity的间隔（秒）
+SESSION_SWEEP_INTERVAL = int(os.getenv('CALENDAR_SESSION_SWEEP_INTERVAL', '600'))  # 清理过期session的间隔（秒）
+
+# 服务模式配置
+# single: 单线程HTTPServer（旧行为）
+# threaded: 固定大小的工作线程池 + 有界队列
+# prefork: 多个工作进程共享监听socket，每个进程内部同样使用线程池
+SERVER_HOST = os.getenv('CALENDAR_HOST', '')
+SERVER_PORT = int(os.getenv('CALENDAR_PORT', '8001'))
+SERVE_MODE = os.getenv('CALENDAR_SERVE_MODE', 'threaded')
+WORKER_THREADS = int(os.getenv('CALENDAR_WORKER_THREADS', '8'))  # 每个进程的工作线程数
+WORKER_PROCESSES = int(os.getenv('CALENDAR_WORKER_PROCESSES', '2'))  # prefork模式下的进程数
+REQUEST_QUEUE_SIZE = int(os.getenv('CALENDAR_QUEUE_SIZE', '64'))  # 等待处理的连接上限，超出返回503
+
+# 持久连接配置（HTTP/1.1 keep-alive，single模式下不复用连接）
+KEEPALIVE_TIMEOUT = float(os.getenv('CALENDAR_KEEPALIVE_TIMEOUT', '5'))  # 连接空闲多久后关闭（秒），0表示每个请求后关闭
+KEEPALIVE_MAX_REQUESTS = int(os.getenv('CALENDAR_KEEPALIVE_MAX_REQUESTS', '100'))  # 每个连接最多处理的请求数
+KEEPALIVE_POLL_INTERVAL = 0.5  # 空闲等待期间检查是否有排队连接的间隔（秒）
+KEEPALIVE_DRAIN_LIMIT = 64 * 1024  # 处理器没有读完的请求体不超过这么多时读掉后复用连接，否则关闭
+
+# 数据库连接池配置
+DB_POOL_SIZE = int(os.getenv('CALENDAR_DB_POOL_SIZE', str(WORKER_THREADS + 2)))  # 每个数据库每个进程的最大连接数
+DB_POOL_TIMEOUT = float(os.getenv('CALENDAR_DB_POOL_TIMEOUT', '5'))  # 等待空闲连接的秒数
+DB_BUSY_TIMEOUT_MS = int(os.getenv('CALENDAR_DB_BUSY_TIMEOUT_MS', '5000'))
+DB_MMAP_SIZE = int(os.getenv('CALENDAR_DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+
+# 查询统计配置
+SLOW_QUERY_MS = float(os.getenv('CALENDAR_SLOW_QUERY_MS', '100'))  # 超过这么多毫秒的语句连同查询计划写入日志，负数关闭
+QUERY_STATS_WINDOW = int(os.getenv('CALENDAR_QUERY_STATS_WINDOW', '300'))  # 语句耗时汇总的滚动窗口（秒）
+QUERY_STATS_MAX_SHAPES = 2000  # 每个进程记住的语句形态上限，超出后新形态归入"(其他)"
+SLOW_QUERY_RECENT = 100  # 内存中保留的最近慢查询条数
+
+# ==================== 数据库连接池 ====================
+
+class PoolTimeout(sqlite3.OperationalError):
+    """等待空闲连接超时"""
+
+
+# ==================== 查询统计 ====================
+
+_PLACEHOLDER_LIST_RE = re.compile(r'\?(?:\s*,\s*\?)+')
+_LIMIT_LITERAL_RE = re.compile(r'\b(LIMIT|OFFSET)\s+\d+', re.IGNORECASE)
+_EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_PARAM_TYPES = {str: 'text', int: 'int', float: 'real', bytes: 'blob', type(None): 'null', bool: 'int'}
+
+
+def statement_shape(sql: str) -> str:
+    """语句形态：合并空白，IN列表的占位符和LIMIT/OFFSET的数字字面量归一化"""
+    shape = ' '.join(sql.split())
+    shape = _PLACEHOLDER_LIST_RE.sub('?+', shape)
+    return _LIMIT_LITERAL_RE.sub(lambda m: m.group(1) + ' ?', shape)
+
+
+def parameter_shape(parameters) -> str:
+    """参数形态：只记录类型，不记录值（可能包含session令牌等敏感数据）"""
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {_PARAM_TYPES.get(type(value), type(value).__name__)}'
+                               for key, value in parameters.items()) + '}'
+    types = [_PARAM_TYPES.get(type(value), type(value).__name__) for value in parameters]
+    if len(types) > 8:
+        return '(' + ', '.join(types[:6]) + f', … 共{len(types)}个)'
+    return '(' + ', '.join(types) + ')'
+
+
+def explain_query_plan(conn, sql, parameters=()):
+    """EXPLAIN QUERY PLAN的输出，按父子关系缩进；使用普通游标，不计入统计"""
+    if not _EXPLAINABLE_RE.match(sql):
+        return []
+    depth = {0: -1}
+    lines = []
+    try:
+        for node_id, parent, _, detail in sqlite3.Cursor(conn).execute('EXPLAIN QUERY PLAN ' + sql, parameters):
+            depth[node_id] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node_id] + detail)
+    except sqlite3.Error as e:
+        return [f'(无法获取查询计划：{e})']
+    return lines
+
+
+def plan_has_full_scan(plan) -> bool:
+    """计划中是否有不使用索引的表扫描"""
+    for line in plan:
+        detail = line.strip()
+        if (detail.startswith('SCAN ') and ' USING ' not in detail
+                and 'VIRTUAL TABLE' not in detail and 'CONSTANT ROW' not in detail):
+            return True
+    return False
+
+
+class QueryStats:
+    """连接池连接上所有语句的耗时统计
+
+    按数据库和语句形态汇总次数、总耗时、最大耗时和行数，只保留最近一到两个QUERY_STATS_WINDOW窗口。
+    每个线程写自己的分片，记录时不加锁。超过SLOW_QUERY_MS的语句写入日志，
+    附带参数形态和EXPLAIN QUERY PLAN；查询计划按语句形态缓存，只在第一次需要时获取。
+    """
+
+    def __init__(self, window=QUERY_STATS_WINDOW, slow_ms=SLOW_QUERY_MS):
+        self.window = max(1, window)
+        self.slow_ms = slow_ms
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._shapes = {}    # 语句 -> 形态
+        self._examples = {}  # (数据库, 形态) -> (语句, 参数模板)，用于补取查询计划
+        self._plans = {}     # (数据库, 形态) -> 查询计划
+        self.recent_slow = deque(maxlen=SLOW_QUERY_RECENT)
+
+    def _shard(self, epoch):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {'epoch': epoch, 'current': {}, 'previous': {}}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        elif shard['epoch'] != epoch:
+            shard['previous'] = shard['current'] if shard['epoch'] == epoch - 1 else {}
+            shard['current'] = {}
+            shard['epoch'] = epoch
+        return shard
+
+    def shape(self, sql):
+        shape = self._shapes.get(sql)
+        if shape is None:
+            if len(self._shapes) >= QUERY_STATS_MAX_SHAPES:
+                self._shapes.clear()
+            shape = self._shapes[sql] = statement_shape(sql)
+        return shape
+
+    def record(self, conn, sql, parameters, seconds, rows, many=False):
+        pool = conn._pool
+        database = os.path.basename(pool.path) if pool is not None else 'unknown'
+        shape = self.shape(sql)
+        key = (database, shape)
+        if key not in self._examples:
+            if len(self._examples) >= QUERY_STATS_MAX_SHAPES:
+                key = (database, '(其他)')
+            else:
+                template = ({name: None for name in parameters} if isinstance(parameters, dict)
+                            else [None] * len(parameters)) if not many else None
+                self._examples[key] = (sql, template)
+        slow = 0 <= self.slow_ms <= seconds * 1000
+        shard = self._shard(int(time.monotonic() // self.window))
+        entry = shard['current'].get(key)
+        if entry is None:
+            entry = shard['current'][key] = [0, 0.0, 0.0, 0, 0]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += max(rows, 0)
+        entry[4] += slow
+        if slow:
+            self._log_slow(conn, key, sql, parameters, seconds, rows, many)
+
+    def _log_slow(self, conn, key, sql, parameters, seconds, rows, many):
+        plan = self._plans.get(key)
+        if plan is None:
+            # executemany的参数可能是已经耗尽的迭代器，只能按不带参数获取查询计划
+            plan = explain_query_plan(conn, sql, () if many else parameters)
+            if key[1] != '(其他)':
+                self._plans[key] = plan
+        params_shape = 'executemany' if many else parameter_shape(parameters)
+        self.recent_slow.append({
+            'time': datetime.now().isoformat(),
+            'database': key[0],
+            'sql': key[1],
+            'params': params_shape,
+            'ms': round(seconds * 1000, 2),
+            'rows': rows,
+            'plan': plan,
+        })
+        plan_text = ''.join(f'\n    {line}' for line in plan)
+        print(f"慢查询 {seconds * 1000:.1f}ms [{key[0]}] {key[1]} 参数{params_shape} 行数{rows}{plan_text}")
+
+    def plan(self, key):
+        """语句形态的查询计划，没有缓存时用参数模板在连接池连接上获取"""
+        plan = self._plans.get(key)
+        if plan is None:
+            example = self._examples.get(key)
+            pool = {os.path.basename(pool.path): pool for pool in (events_db_pool, session_db_pool)}.get(key[0])
+            if example is None or pool is None:
+                return []
+            sql, template = example
+            with pool.connection() as conn:
+                plan = self._plans[key] = explain_query_plan(conn, sql, template if template is not None else [])
+        return plan
+
+    def top(self, sort='total', limit=20, database=None):
+        """最近窗口内的语句汇总，按总耗时、最大耗时、次数或平均耗时取前N个"""
+        epoch = int(time.monotonic() // self.window)
+        merged = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            shard_epoch = shard['epoch']
+            if shard_epoch == epoch:
+                parts = (shard['current'], shard['previous'])
+            elif shard_epoch == epoch - 1:
+                parts = (shard['current'],)
+            else:
+                continue
+            for part in parts:
+                for key, entry in list(part.items()):
+                    if database and key[0] != database:
+                        continue
+                    total = merged.get(key)
+                    if total is None:
+                        merged[key] = list(entry)
+                    else:
+                        total[0] += entry[0]
+                        total[1] += entry[1]
+                        total[2] = max(total[2], entry[2])
+                        total[3] += entry[3]
+                        total[4] += entry[4]
+        sort_keys = {
+            'total': lambda item: item[1][1],
+            'max': lambda item: item[1][2],
+            'count': lambda item: item[1][0],
+            'mean': lambda item: item[1][1] / item[1][0],
+        }
+        ranked = heapq.nlargest(limit, merged.items(), key=sort_keys[sort])
+        statements = []
+        for key, (count, total, longest, rows, slow) in ranked:
+            plan = self.plan(key)
+            statements.append({
+                'database': key[0],
+                'sql': key[1],
+                'count': count,
+                'total_ms': round(total * 1000, 2),
+                'mean_ms': round(total * 1000 / count, 3),
+                'max_ms': round(longest * 1000, 2),
+                'rows': rows,
+                'slow': slow,
+                'full_scan': plan_has_full_scan(plan),
+                'plan': plan,
+            })
+        return statements
+
+
+query_stats = QueryStats()
+
+
+class PooledCursor(sqlite3.Cursor):
+    """记录语句执行和取数耗时的游标
+
+    耗时计入当前请求的db阶段，并在语句结束时交给query_stats：不返回行的语句在execute后结束，
+    查询在取完所有行、游标重新执行、关闭或被回收、连接归还连接池时结束。
+    """
+
+    _statement = None  # [语句, 参数, 累计耗时, 行数]
+
+    def execute(self, sql, parameters=()):
+        self.finish_statement()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            add_phase_time('db', elapsed)
+            self._statement = [sql, parameters, elapsed, 0]
+            if self.description is None:
+                self.finish_statement()
+            else:
+                self.connection.pending_cursors.add(self)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.finish_statement()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            add_phase_time('db', elapsed)
+            query_stats.record(self.connection, sql, (), elapsed, self.rowcount, many=True)
+
+    def finish_statement(self):
+        statement = self._statement
+        if statement is not None:
+            self._statement = None
+            self.connection.pending_cursors.discard(self)
+            if statement[3] == 0 and self.description is None:
+                statement[3] = self.rowcount
+            query_stats.record(self.connection, *statement)
+
+    def _fetched(self, started, rows, exhausted):
+        elapsed = time.perf_counter() - started
+        add_phase_time('db', elapsed)
+        statement = self._statement
+        if statement is not None:
+            statement[2] += elapsed
+            statement[3] += rows
+            if exhausted:
+                self.finish_statement()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self.finish_statement()
+        super().close()
+
+    def __del__(self):
+        try:
+            self.finish_statement()
+        except Exception:
+            pass
+
+
+class PooledConnection(sqlite3.Connection):
+    """连接池中的连接：close()归还到连接池而不是真正关闭；游标使用PooledCursor"""
+
+    _pool = None
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def finish_statements(self):
+        """结束还没取完结果的查询的统计"""
+        for cursor in list(self.pending_cursors):
+            cursor.finish_statement()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            self.finish_statements()
+            super().close()
+
+    def really_close(self):
+        super().close()
+
+
+class SQLitePool:
+    """SQLite连接池
+
+    连接在首次创建时统一设置WAL、synchronous、busy_timeout和mmap_size，
+    之后在线程间复用。fork后的子进程会自动丢弃从父进程继承的连接。
+    """
+
+    def __init__(self, path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, row_factory=None):
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.row_factory = row_factory
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._open = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            factory=PooledConnection
+        )
+        conn.pending_cursors = weakref.WeakSet()  # 不延长游标的生命周期，未取完的语句随游标回收而重置
+        conn._pool = self
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        return conn
+
+    def acquire(self):
+        """获取连接，连接数已达上限时等待空闲连接"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            if self._open >= self.max_size:
+                self.waits += 1
+                deadline = time.monotonic() + self.timeout
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"等待数据库连接超时（{os.path.basename(self.path)}）")
+                    self._available.wait(remaining)
+                if self._idle:
+                    return self._idle.pop()
+            self.misses += 1
+            self._open += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._available.notify()
+            raise
+
+    def release(self, conn):
+        """归还连接，未提交的事务会被回滚"""
+        conn.finish_statements()
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._idle.append(conn)
+            self._available.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.really_close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            if self._pid == os.getpid():
+                self._open -= 1
+                self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """with语句形式：结束时自动归还连接"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        """连接池统计信息"""
+        with self._lock:
+            return {
+                'path': os.path.basename(self.path),
+                'max_size': self.max_size,
+                'open': self._open if self._pid == os.getpid() else 0,
+                'idle': len(self._idle) if self._pid == os.getpid() else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'timeouts': self.timeouts
+            }
+
+
+events_db_pool = SQLitePool(DB_PATH, row_factory=sqlite3.Row)
+session_db_pool = SQLitePool(SESSION_DB_PATH)
+
+def init_session_db():
+    """初始化session数据库（如果需要）"""
+    if not os.path.exists(SESSION_DB_PATH):
+        conn = sqlite3.connect(SESSION_DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE sessions (
+                session_token TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                user_agent TEXT,
+                ip_address TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX idx_sessions_user_id ON sessions(user_id)')
+        cursor.execute('CREATE INDEX idx_sessions_expires ON sessions(expires_at)')
+        conn.commit()
+        conn.close()
+
+# 初始化session数据库
+init_session_db()
+
+# ==================== Session缓存 ====================
+
+class SessionCache:
+    """session token -> 用户信息 的LRU/TTL缓存
+
+    命中时只在内存中记录last_activity，由后台线程按固定间隔批量写回；
+    同一线程还负责按expires_at索引清理过期session。
+    """
+
+    def __init__(self, pool, max_size=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL):
+        self.pool = pool
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._touched = {}
+        self._worker_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, session_token: str) -> Optional[Dict]:
+        """将token解析为用户信息，无效或过期返回None（数据库错误时抛出sqlite3.Error）"""
+        now = time.time()
+        self._ensure_worker()
+        with self._lock:
+            entry = self._entries.get(session_token)
+            if entry is not None:
+                if entry['expires_at'] > now and entry['cached_at'] + self.ttl > now:
+                    self._entries.move_to_end(session_token)
+                    self._touched[session_token] = now
+                    self.hits += 1
+                    return entry['user']
+                del self._entries[session_token]
+            self.misses += 1
+
+        with self.pool.connection() as conn:
+            row = conn.execute('''
+                SELECT user_id, username, expires_at
+                FROM sessions
+                WHERE session_token = ? AND (expires_at IS NULL OR expires_at > ?)
+            ''', (session_token, datetime.fromtimestamp(now).isoformat())).fetchone()
+        if not row:
+            return None
+
+        user = {'user_id': row[0], 'username': row[1]}
+        self.put(session_token, user, row[2])
+        with self._lock:
+            self._touched[session_token] = now
+        return user
+
+    def put(self, session_token: str, user: Dict, expires_at):
+        """写入缓存，expires_at为ISO时间字符串或None"""
+        expires_ts = datetime.fromisoformat(expires_at).timestamp() if expires_at else float('inf')
+        self._ensure_worker()
+        with self._lock:
+            self._entries[session_token] = {
+                'user': user,
+                'expires_at': expires_ts,
+                'cached_at': time.time()
+            }
+            self._entries.move_to_end(session_token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_token: str):
+        """删除缓存条目（登出时调用）"""
+        with self._lock:
+            self._entries.pop(session_token, None)
+            self._touched.pop(session_token, None)
+
+    def flush_activity(self):
+        """将缓存中记录的last_activity批量写回数据库"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return 0
+        try:
+            with self.pool.connection() as conn:
+                conn.executemany(
+                    'UPDATE sessions SET last_activity = ? WHERE session_token = ?',
+                    [(datetime.fromtimestamp(ts).isoformat(), token) for token, ts in touched.items()]
+                )
+                conn.commit()
+        except sqlite3.Error:
+            # 写回失败时保留记录，下次再试
+            with self._lock:
+                for token, ts in touched.items():
+                    self._touched.setdefault(token, ts)
+            return 0
+        return len(touched)
+
+    def sweep_expired(self):
+        """删除已过期的session（走idx_sessions_expires索引）"""
+        now = time.time()
+        with self._lock:
+            for token in [t for t, e in self._entries.items() if e['expires_at'] <= now]:
+                del self._entries[token]
+        for token in [t for t, s in list(_sessions.items()) if s.get('expires_at', 0) <= now]:
+            _sessions.pop(token, None)
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.execute(
+                    'DELETE FROM sessions WHERE expires_at <= ?',
+                    (datetime.fromtimestamp(now).isoformat(),)
+                )
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error:
+            return 0
+
+    def _ensure_worker(self):
+        """按需启动后台线程（fork后的子进程会各自启动一个）"""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            # fork继承的缓存内容属于父进程，直接丢弃
+            self._entries.clear()
+            self._touched.clear()
+        threading.Thread(target=self._maintenance_loop, name='session-maintenance', daemon=True).start()
+
+    def _maintenance_loop(self):
+        """后台线程：定期写回活动时间、清理过期session"""
+        next_sweep = time.monotonic()
+        while True:
+            time.sleep(SESSION_TOUCH_INTERVAL)
+            self.flush_activity()
+            if time.monotonic() >= next_sweep:
+                self.sweep_expired()
+                next_sweep = time.monotonic() + SESSION_SWEEP_INTERVAL
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'pending_touches': len(self._touched)
+            }
+
+
+session_cache = SessionCache(session_db_pool)
+
+# ==================== 事件区间索引 ====================
+
+# 把库中的ISO时间转换为epoch秒：只取前19位（忽略毫秒和时区后缀），按墙上时间计算
+EVENT_EPOCH_SQL = "COALESCE(CAST(strftime('%s', substr({col}, 1, 19)) AS INTEGER), 0)"
+# 无结束日期的重复事件，区间上界取9999-12-31
+OPEN_ENDED_EPOCH = 253402300799
+
+
+def event_span_sql(alias: str):
+    """事件在时间轴上覆盖的区间(开始, 结束)的SQL表达式；重复事件覆盖到recurrence_end"""
+    start = EVENT_EPOCH_SQL.format(col=f'{alias}.start_time')
+    end = EVENT_EPOCH_SQL.format(col=f'{alias}.end_time')
+    span_end = (
+        f"CASE WHEN {alias}.recurrence_rule IS NULL THEN {end} "
+        f"WHEN {alias}.recurrence_end IS NULL THEN {OPEN_ENDED_EPOCH} "
+        f"ELSE {EVENT_EPOCH_SQL.format(col=f'{alias}.recurrence_end')} END"
+    )
+    return start, span_end
+
+
+_NEW_START, _NEW_END = event_span_sql('new')
+
+# 重复事件相关字段（增量迁移时逐个补齐）
+EVENTS_RECURRENCE_COLUMNS = [
+    ('recurrence_rule', 'TEXT'),     # RRULE，例如 FREQ=WEEKLY;BYDAY=MO,WE
+    ('recurrence_end', 'TEXT'),      # 最后一次发生的结束时间，NULL表示无限重复
+    ('recurrence_id', 'INTEGER'),    # 单次修改（override）所属的系列ID
+    ('recurrence_start', 'TEXT'),    # override对应的原始发生时间
+]
+
+EVENTS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS event_exdates (
+        event_id INTEGER NOT NULL,
+        original_start TEXT NOT NULL,
+        PRIMARY KEY (event_id, original_start),
+        FOREIGN KEY (event_id) REFERENCES events (id) ON DELETE CASCADE
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_events_recurrence ON events(recurrence_id, recurrence_start) WHERE recurrence_id IS NOT NULL',
+    # 日历版本号：events/event_exdates的每次写入都递增，用于响应缓存失效和ETag
+    '''
+    CREATE TABLE IF NOT EXISTS calendar_versions (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'DROP TRIGGER IF EXISTS events_version_ai',
+    'DROP TRIGGER IF EXISTS events_version_au',
+    'DROP TRIGGER IF EXISTS events_version_ad',
+    'DROP TRIGGER IF EXISTS event_exdates_version_ai',
+    'DROP TRIGGER IF EXISTS event_exdates_version_ad',
+    *[f'''
+    CREATE TRIGGER {name} AFTER {action} ON {table} BEGIN
+        INSERT OR IGNORE INTO calendar_versions (user_id, version) VALUES ({user_id}, 0);
+        UPDATE calendar_versions SET version = version + 1 WHERE user_id = {user_id};
+    END
+    ''' for name, action, table, user_id in [
+        ('events_version_ai', 'INSERT', 'events', 'new.user_id'),
+        ('events_version_au', 'UPDATE', 'events', 'new.user_id'),
+        ('events_version_ad', 'DELETE', 'events', 'old.user_id'),
+        ('event_exdates_version_ai', 'INSERT', 'event_exdates',
+         '(SELECT user_id FROM events WHERE id = new.event_id)'),
+        ('event_exdates_version_ad', 'DELETE', 'event_exdates',
+         '(SELECT user_id FROM events WHERE id = old.event_id)'),
+    ]],
+]
+
+EVENTS_RTREE_SCHEMA = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree(id, start_ts, end_ts)',
+    'DROP TRIGGER IF EXISTS events_rtree_ai',
+    'DROP TRIGGER IF EXISTS events_rtree_au',
+    'DROP TRIGGER IF EXISTS events_rtree_ad',
+    f'''
+    CREATE TRIGGER events_rtree_ai AFTER INSERT ON events BEGIN
+        INSERT INTO events_rtree (id, start_ts, end_ts)
+        VALUES (new.id, MIN({_NEW_START}, {_NEW_END}), MAX({_NEW_START}, {_NEW_END}));
+    END
+    ''',
+    f'''
+    CREATE TRIGGER events_rtree_au
+    AFTER UPDATE OF start_time, end_time, recurrence_rule, recurrence_end ON events BEGIN
+        UPDATE events_rtree
+        SET start_ts = MIN({_NEW_START}, {_NEW_END}), end_ts = MAX({_NEW_START}, {_NEW_END})
+        WHERE id = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER events_rtree_ad AFTER DELETE ON events BEGIN
+        DELETE FROM events_rtree WHERE id = old.id;
+    END
+    ''',
+]
+
+# R*Tree模块不可用时回退到普通索引扫描
+events_rtree_enabled = False
+
+
+def init_events_db():
+    """对已有的events表执行增量迁移：重复事件字段、R*Tree区间索引及同步触发器"""
+    global events_rtree_enabled
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='events'")
+        if not cursor.fetchone():
+            return
+        
+        existing = {row[1] for row in cursor.execute('PRAGMA table_info(events)')}
+        for column, column_type in EVENTS_RECURRENCE_COLUMNS:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE events ADD COLUMN {column} {column_type}')
+        for statement in EVENTS_SCHEMA:
+            cursor.execute(statement)
+        conn.commit()
+        
+        try:
+            for statement in EVENTS_RTREE_SCHEMA:
+                cursor.execute(statement)
+            # 回填索引中缺失的事件，并刷新重复事件的覆盖区间
+            start_ts, end_ts = event_span_sql('events')
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO events_rtree (id, start_ts, end_ts)
+                SELECT id, MIN({start_ts}, {end_ts}), MAX({start_ts}, {end_ts})
+                FROM events
+                WHERE id NOT IN (SELECT id FROM events_rtree) OR recurrence_rule IS NOT NULL
+            ''')
+            conn.commit()
+            events_rtree_enabled = True
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            print(f"R*Tree区间索引不可用，事件区间查询将使用普通索引：{e}")
+    finally:
+        conn.close()
+
+
+def event_wall_epoch(value: str) -> int:
+    """把请求中的ISO时间转换为epoch秒（与EVENT_EPOCH_SQL一致，按墙上时间计算）"""
+    return wall_epoch(parse_event_time(value))
+
+
+def wall_epoch(dt: datetime) -> int:
+    """datetime按墙上时间转换为epoch秒（忽略时区）"""
+    return calendar.timegm(dt.replace(tzinfo=None).timetuple())
+
+
+def parse_event_time(value: str) -> datetime:
+    """解析ISO时间（兼容Z后缀）"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def events_overlap_query(start: Optional[str], end: Optional[str]):
+    """构建与[start, end)相交的事件查询，返回(FROM子句, WHERE条件列表, 参数列表)
+
+    启用R*Tree时先用索引取候选（float坐标向外取整，只会多不会少），再按精确时间过滤。
+    重复事件按整个系列的覆盖区间匹配，需要调用方再展开。
+    """
+    if not start and not end:
+        return 'events e', [], []
+    start_ts = event_wall_epoch(start) if start else None
+    end_ts = event_wall_epoch(end) if end else None
+
+    conditions = []
+    params = []
+    if events_rtree_enabled:
+        from_clause = 'events_rtree r JOIN events e ON e.id = r.id'
+        if start_ts is not None:
+            conditions.append('r.end_ts >= ?')
+            params.append(start_ts)
+        if end_ts is not None:
+            conditions.append('r.start_ts <= ?')
+            params.append(end_ts)
+    else:
+        from_clause = 'events e'
+    span_start, span_end = event_span_sql('e')
+    if start_ts is not None:
+        conditions.append(f"{span_end} > ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        conditions.append(f"{span_start} < ?")
+        params.append(end_ts)
+    return from_clause, conditions, params
+
+
+# ==================== 重复事件 ====================
+
+RECURRENCE_CACHE_SIZE = int(os.getenv('CALENDAR_RECURRENCE_CACHE_SIZE', '2048'))  # 展开结果缓存条目数
+RECURRENCE_MAX_COUNT = 10000  # COUNT上限
+RECURRENCE_MAX_OCCURRENCES = 5000  # 单个系列在一个窗口内最多展开的次数
+
+RRULE_FREQS = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+RRULE_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+def _parse_rrule_until(value: str) -> datetime:
+    """解析UNTIL，支持20261231T235959Z、20261231和ISO格式"""
+    for fmt in ('%Y%m%dT%H%M%SZ', '%Y%m%dT%H%M%S', '%Y%m%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return parse_event_time(value).replace(tzinfo=None)
+
+
+def parse_rrule(rule: str) -> Dict:
+    """解析RRULE（支持FREQ、INTERVAL、COUNT、UNTIL和WEEKLY下的BYDAY），无效时抛出ValueError"""
+    rule = rule.strip()
+    if rule.upper().startswith('RRULE:'):
+        rule = rule[6:]
+    parts = {}
+    for item in rule.split(';'):
+        if not item:
+            continue
+        if '=' not in item:
+            raise ValueError(f"无法解析：{item}")
+        key, value = item.split('=', 1)
+        parts[key.strip().upper()] = value.strip()
+
+    unknown = set(parts) - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY', 'WKST'}
+    if unknown:
+        raise ValueError(f"不支持的字段：{', '.join(sorted(unknown))}")
+
+    freq = parts.get('FREQ', '').upper()
+    if freq not in RRULE_FREQS:
+        raise ValueError("FREQ必须为 DAILY, WEEKLY, MONTHLY, YEARLY 之一")
+
+    interval = int(parts.get('INTERVAL', 1))
+    if interval < 1:
+        raise ValueError("INTERVAL必须为正整数")
+
+    count = None
+    if 'COUNT' in parts:
+        count = int(parts['COUNT'])
+        if not 1 <= count <= RECURRENCE_MAX_COUNT:
+            raise ValueError(f"COUNT必须在1到{RECURRENCE_MAX_COUNT}之间")
+
+    until = _parse_rrule_until(parts['UNTIL']) if 'UNTIL' in parts else None
+    if count is not None and until is not None:
+        raise ValueError("COUNT和UNTIL不能同时使用")
+
+    byday = None
+    if 'BYDAY' in parts:
+        if freq != 'WEEKLY':
+            raise ValueError("BYDAY仅支持WEEKLY")
+        try:
+            byday = sorted({RRULE_WEEKDAYS.index(day.strip().upper()) for day in parts['BYDAY'].split(',')})
+        except ValueError:
+            raise ValueError("BYDAY必须为 MO,TU,WE,TH,FR,SA,SU 的组合")
+
+    return {'freq': freq, 'interval': interval, 'count': count, 'until': until, 'byday': byday}
+
+
+def _add_months(dt: datetime, months: int) -> Optional[datetime]:
+    """按月偏移，目标月份没有这一天时返回None（与RFC 5545一致，跳过）；超出datetime范围时抛出OverflowError"""
+    month_index = dt.month - 1 + months
+    if dt.year + month_index // 12 > datetime.max.year:
+        raise OverflowError("date value out of range")
+    try:
+        return dt.replace(year=dt.year + month_index // 12, month=month_index % 12 + 1)
+    except ValueError:
+        return None
+
+
+def iter_occurrences(dtstart: datetime, rule: Dict, not_before: Optional[datetime] = None):
+    """按顺序生成发生时间
+
+    没有COUNT时直接跳到not_before附近的周期，避免从系列开头逐个推算。
+    下一次发生超出datetime范围（接近9999年）时系列在此结束。
+    """
+    freq, interval = rule['freq'], rule['interval']
+    naive_start = dtstart.replace(tzinfo=None)
+
+    period = 0
+    if not_before is not None and rule['count'] is None and not_before > naive_start:
+        if freq == 'DAILY':
+            period = (not_before - naive_start).days // interval
+        elif freq == 'WEEKLY':
+            period = (not_before - naive_start).days // (7 * interval)
+        elif freq == 'MONTHLY':
+            period = ((not_before.year - naive_start.year) * 12 + not_before.month - naive_start.month) // interval
+        else:
+            period = (not_before.year - naive_start.year) // interval
+        period = max(0, period - 1)
+
+    if freq == 'WEEKLY':
+        week_start = dtstart - timedelta(days=dtstart.weekday())
+        weekdays = rule['byday'] or [dtstart.weekday()]
+
+    produced = 0
+    while True:
+        try:
+            if freq == 'DAILY':
+                candidates = [dtstart + timedelta(days=period * interval)]
+            elif freq == 'WEEKLY':
+                base = week_start + timedelta(weeks=period * interval)
+                candidates = [base + timedelta(days=day) for day in weekdays]
+            elif freq == 'MONTHLY':
+                candidates = [_add_months(dtstart, period * interval)]
+            else:
+                candidates = [_add_months(dtstart, period * interval * 12)]
+        except OverflowError:
+            return
+
+        for occurrence in candidates:
+            if occurrence is None or occurrence < dtstart:
+                continue
+            if rule['until'] is not None and occurrence.replace(tzinfo=None) > rule['until']:
+                return
+            yield occurrence
+            produced += 1
+            if rule['count'] is not None and produced >= rule['count']:
+                return
+        period += 1
+
+
+def recurrence_end_for(start_time: str, end_time: str, rule_text: str) -> Optional[str]:
+    """计算系列最后一次发生的结束时间，无限重复返回None
+
+    COUNT已限制在RECURRENCE_MAX_COUNT以内，逐个推算即可；UNTIL只从UNTIL之前的几个周期开始推算，
+    与UNTIL的远近无关（跳过的月份、2月29日等使这几个周期内没有发生时，向前加倍回溯）。
+    """
+    rule = parse_rrule(rule_text)
+    if rule['count'] is None and rule['until'] is None:
+        return None
+    dtstart = parse_event_time(start_time)
+    duration = parse_event_time(end_time) - dtstart
+    last = None
+    if rule['count'] is not None:
+        for last in iter_occurrences(dtstart, rule):
+            pass
+    else:
+        period_days = {'DAILY': 1, 'WEEKLY': 7, 'MONTHLY': 31, 'YEARLY': 366}[rule['freq']] * rule['interval']
+        lookback = 2 * period_days
+        naive_start = dtstart.replace(tzinfo=None)
+        while last is None:
+            not_before = rule['until'] - timedelta(days=lookback)
+            for last in iter_occurrences(dtstart, rule, not_before):
+                pass
+            if not_before <= naive_start:
+                break
+            lookback *= 2
+    try:
+        return ((last or dtstart) + duration).isoformat()
+    except OverflowError:
+        return None
+
+
+class RecurrenceCache:
+    """重复事件展开结果缓存
+
+    key包含系列的updated_at，系列（及其例外）被修改后旧条目自然失效；
+    本进程内的修改还会主动清理对应系列的条目。
+    """
+
+    def __init__(self, max_size=RECURRENCE_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, series_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == series_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+recurrence_cache = RecurrenceCache()
+
+
+def expand_series(conn, series_rows, window_start: datetime, window_end: datetime):
+    """在[window_start, window_end)内展开重复事件系列，返回{系列ID: [(开始, 结束), ...]}
+
+    已被单独修改（override）或删除（exdate）的发生时间会被跳过。
+    """
+    result = {}
+    missing = []
+    ws_epoch, we_epoch = wall_epoch(window_start), wall_epoch(window_end)
+    for row in series_rows:
+        key = (row['id'], row['updated_at'], ws_epoch, we_epoch)
+        cached = recurrence_cache.get(key)
+        if cached is not None:
+            result[row['id']] = cached
+        else:
+            missing.append((key, row))
+    if not missing:
+        return result
+
+    # 一次查询取出所有待展开系列的例外
+    ids = [row['id'] for _, row in missing]
+    placeholders = ', '.join(['?'] * len(ids))
+    skipped = {series_id: set() for series_id in ids}
+    for series_id, original_start in conn.execute(
+            f'SELECT event_id, original_start FROM event_exdates WHERE event_id IN ({placeholders})', ids):
+        skipped[series_id].add(original_start)
+    for series_id, original_start in conn.execute(
+            f'SELECT recurrence_id, recurrence_start FROM events WHERE recurrence_id IN ({placeholders})', ids):
+        skipped[series_id].add(original_start)
+
+    for key, row in missing:
+        dtstart = parse_event_time(row['start_time'])
+        duration = parse_event_time(row['end_time']) - dtstart
+        rule = parse_rrule(row['recurrence_rule'])
+        occurrences = []
+        try:
+            not_before = window_start - duration
+        except OverflowError:
+            not_before = None
+        for occurrence in iter_occurrences(dtstart, rule, not_before):
+            naive = occurrence.replace(tzinfo=None)
+            if naive >= window_end or len(occurrences) >= RECURRENCE_MAX_OCCURRENCES:
+                break
+            try:
+                occurrence_end = occurrence + duration
+            except OverflowError:
+                break  # 结束时间超出datetime范围，之后的发生也一样
+            if naive + duration <= window_start or occurrence.isoformat() in skipped[row['id']]:
+                continue
+            occurrences.append((occurrence, occurrence_end))
+        recurrence_cache.put(key, occurrences)
+        result[row['id']] = occurrences
+    return result
+
+
+init_events_db()
+
+
+# ==================== 事件提醒 ====================
+
+# 提醒发送方式：log（打印日志）、file:/路径（追加NDJSON）、http(s)://地址（POST JSON的webhook）、none（关闭）
+REMINDER_SINK = os.getenv('CALENDAR_REMINDER_SINK', 'log')
+REMINDER_HORIZON = int(os.getenv('CALENDAR_REMINDER_HORIZON', '3600'))  # 预先加载到内存的提醒时间范围（秒）
+REMINDER_POLL_INTERVAL = int(os.getenv('CALENDAR_REMINDER_POLL_INTERVAL', '60'))  # 没有待发提醒时的最长休眠时间（秒）
+REMINDER_MAX_LATE = int(os.getenv('CALENDAR_REMINDER_MAX_LATE', '3600'))  # 停机期间错过的提醒，超过这么久的不再补发（秒）
+REMINDER_WEBHOOK_TIMEOUT = 5
+
+REMINDER_ACTIVE_SQL = "{alias}.reminder_minutes > 0 AND {alias}.status NOT IN ('cancelled', 'completed')"
+_NEW_REMIND_AT = f"{EVENT_EPOCH_SQL.format(col='new.start_time')} - new.reminder_minutes * 60"
+_NEW_REMINDER_ACTIVE = f"new.recurrence_rule IS NULL AND {REMINDER_ACTIVE_SQL.format(alias='new')}"
+
+# event_reminders：非重复事件（含单次修改）的提醒时间（epoch秒，按墙上时间），由触发器维护
+# 重复事件系列数量少，通过部分索引取出后在窗口内展开
+REMINDERS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS event_reminders (
+        event_id INTEGER PRIMARY KEY,
+        remind_at INTEGER NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_event_reminders_at ON event_reminders(remind_at)',
+    'CREATE INDEX IF NOT EXISTS idx_events_series ON events(id) WHERE recurrence_rule IS NOT NULL',
+    # 调度器状态：reminder_watermark之前的提醒均已发送
+    '''
+    CREATE TABLE IF NOT EXISTS scheduler_state (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    ''',
+    'DROP TRIGGER IF EXISTS event_reminders_ai',
+    'DROP TRIGGER IF EXISTS event_reminders_au',
+    'DROP TRIGGER IF EXISTS event_reminders_ad',
+    f'''
+    CREATE TRIGGER event_reminders_ai AFTER INSERT ON events BEGIN
+        INSERT OR REPLACE INTO event_reminders (event_id, remind_at)
+        SELECT new.id, {_NEW_REMIND_AT} WHERE {_NEW_REMINDER_ACTIVE};
+    END
+    ''',
+    f'''
+    CREATE TRIGGER event_reminders_au
+    AFTER UPDATE OF start_time, reminder_minutes, status, recurrence_rule ON events BEGIN
+        DELETE FROM event_reminders WHERE event_id = new.id;
+        INSERT INTO event_reminders (event_id, remind_at)
+        SELECT new.id, {_NEW_REMIND_AT} WHERE {_NEW_REMINDER_ACTIVE};
+    END
+    ''',
+    '''
+    CREATE TRIGGER event_reminders_ad AFTER DELETE ON events BEGIN
+        DELETE FROM event_reminders WHERE event_id = old.id;
+    END
+    ''',
+]
+
+
+def init_reminders_db():
+    """创建提醒索引表和同步触发器，首次创建时回填已有事件"""
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('events', 'event_reminders')")
+        tables = {row[0] for row in cursor.fetchall()}
+        if 'events' not in tables:
+            return
+        for statement in REMINDERS_SCHEMA:
+            cursor.execute(statement)
+        if 'event_reminders' not in tables:
+            start_ts = EVENT_EPOCH_SQL.format(col='start_time')
+            cursor.execute(f'''
+                INSERT INTO event_reminders (event_id, remind_at)
+                SELECT id, {start_ts} - reminder_minutes * 60 FROM events e
+                WHERE recurrence_rule IS NULL AND {REMINDER_ACTIVE_SQL.format(alias='e')}
+            ''')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+init_reminders_db()
+
+
+def wall_now() -> float:
+    """当前时间的墙上epoch秒（与EVENT_EPOCH_SQL一致）"""
+    now = datetime.now()
+    return wall_epoch(now) + now.microsecond / 1e6
+
+
+def wall_datetime(epoch: int) -> datetime:
+    """wall_epoch的逆运算"""
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+# datetime能表示的墙上epoch秒范围，放宽查询窗口时不能超出
+WALL_EPOCH_MIN = wall_epoch(datetime.min)
+WALL_EPOCH_MAX = wall_epoch(datetime.max)
+
+
+def reminder_payload(row, remind_at: int, start=None, end=None) -> Dict:
+    """发送给提醒接收方的内容；重复事件的某次发生带series_id和occurrence_start"""
+    payload = {
+        'event_id': row['id'],
+        'title': row['title'],
+        'event_type': row['event_type'],
+        'start_time': start.isoformat() if start else row['start_time'],
+        'end_time': end.isoformat() if end else row['end_time'],
+        'location': row['location'],
+        'reminder_minutes': row['reminder_minutes'],
+        'remind_at': wall_datetime(remind_at).isoformat()
+    }
+    if start is not None:
+        payload['series_id'] = row['id']
+        payload['occurrence_start'] = start.isoformat()
+    return payload
+
+
+def due_reminders(conn, since: int, until: int, event_ids=None):
+    """返回提醒时间在(since, until]内的提醒 [(remind_at, payload), ...]，按时间排序
+
+    非重复事件走idx_event_reminders_at区间查询；重复事件系列走idx_events_series部分索引，
+    只在各自的提醒窗口内展开（已删除或单独修改的发生被跳过）。
+    """
+    id_filter, id_params = '', []
+    if event_ids:
+        event_ids = list(event_ids)
+        id_filter = f" AND e.id IN ({', '.join(['?'] * len(event_ids))})"
+        id_params = event_ids
+
+    due = [(row['remind_at'], reminder_payload(row, row['remind_at'])) for row in conn.execute(f'''
+        SELECT e.*, r.remind_at FROM event_reminders r JOIN events e ON e.id = r.event_id
+        WHERE r.remind_at > ? AND r.remind_at <= ?{id_filter}
+    ''', [since, until] + id_params)]
+
+    for row in conn.execute(f'''
+        SELECT * FROM events e
+        WHERE e.recurrence_rule IS NOT NULL AND {REMINDER_ACTIVE_SQL.format(alias='e')}{id_filter}
+    ''', id_params).fetchall():
+        offset = row['reminder_minutes'] * 60
+        occurrences = expand_series(conn, [row], wall_datetime(since + offset), wall_datetime(until + offset + 1))
+        for start, end in occurrences.get(row['id'], []):
+            remind_at = wall_epoch(start) - offset
+            if since < remind_at <= until:
+                due.append((remind_at, reminder_payload(row, remind_at, start, end)))
+    due.sort(key=lambda item: (item[0], item[1]['event_id']))
+    return due
+
+
+class LogReminderSink:
+    """把提醒打印到日志（stdout/journal）"""
+
+    def deliver(self, reminder: Dict):
+        print(f"[提醒] {reminder['title']}：{reminder['start_time']} 开始（提前{reminder['reminder_minutes']}分钟）")
+
+    def __str__(self):
+        return 'log'
+
+
+class FileReminderSink:
+    """把提醒以NDJSON追加到文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def deliver(self, reminder: Dict):
+        line = json.dumps(reminder, ensure_ascii=False) + '\n'
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def __str__(self):
+        return f'file:{self.path}'
+
+
+class WebhookReminderSink:
+    """把提醒POST到（本机）webhook"""
+
+    def __init__(self, url: str, timeout=REMINDER_WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, reminder: Dict):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(reminder, ensure_ascii=False).encode(),
+            headers={'Content-Type': 'application/json; charset=utf-8'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def __str__(self):
+        return self.url
+
+
+def create_reminder_sink(spec: str):
+    """按CALENDAR_REMINDER_SINK创建发送方式，none返回None"""
+    spec = (spec or '').strip()
+    if spec in ('', 'none'):
+        return None
+    if spec == 'log':
+        return LogReminderSink()
+    if spec.startswith('file:'):
+        return FileReminderSink(spec[5:])
+    if spec.startswith(('http://', 'https://')):
+        return WebhookReminderSink(spec)
+    raise ValueError(f"无效的CALENDAR_REMINDER_SINK：{spec}")
+
+
+class ReminderScheduler:
+    """事件提醒调度器
+
+    内存中的最小堆只保存未来REMINDER_HORIZON秒内的提醒（按remind_at索引区间加载），
+    用来精确计算下一次唤醒时间；事件创建、修改时通过notify()增量加入，
+    删除或改期留下的旧条目只会造成一次多余的唤醒。
+
+    发送前先在scheduler_state中把水位线推进到当前时间，然后发送(旧水位线, 当前时间]内的提醒：
+    prefork的多个进程中只有推进成功的一个会发送，重启后从持久化的水位线继续。
+    """
+
+    def __init__(self, pool, sink_spec=REMINDER_SINK, horizon=REMINDER_HORIZON):
+        self.pool = pool
+        self.sink_spec = sink_spec
+        self.horizon = max(60, horizon)
+        self.sink = None
+        self._cond = threading.Condition()
+        self._heap = []
+        self._pending = set()
+        self._reload = False
+        self._loaded_until = 0
+        self._worker_pid = None
+        self.fired = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def start(self):
+        """启动调度线程（每个服务进程调用一次；fork后的子进程各自启动）"""
+        if self._worker_pid == os.getpid():
+            return
+        try:
+            self.sink = create_reminder_sink(self.sink_spec)
+        except ValueError as e:
+            print(f"{e}，提醒改为输出到日志")
+            self.sink = LogReminderSink()
+        if self.sink is None:
+            return
+        with self._cond:
+            self._worker_pid = os.getpid()
+            self._heap = []
+            self._pending.clear()
+            self._loaded_until = 0
+        threading.Thread(target=self._run, name='reminder-scheduler', daemon=True).start()
+
+    def notify(self, event_id: int):
+        """事件被创建或修改后调用，由调度线程查询并加入堆"""
+        if self._worker_pid != os.getpid():
+            return
+        with self._cond:
+            self._pending.add(event_id)
+            self._cond.notify()
+
+    def reload(self):
+        """批量写入后调用，重新加载整个时间窗口"""
+        if self._worker_pid != os.getpid():
+            return
+        with self._cond:
+            self._reload = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            failed = False
+            try:
+                self._tick()
+            except Exception as e:
+                failed = True
+                print(f"提醒调度出错：{e}")
+            with self._cond:
+                if self._pending or self._reload:
+                    continue
+                next_at = self._heap[0][0] if self._heap else float('inf')
+                timeout = min(next_at - wall_now(), REMINDER_POLL_INTERVAL)
+                if failed:
+                    timeout = max(timeout, 1)
+                if timeout > 0:
+                    self._cond.wait(timeout)
+
+    def _tick(self):
+        now = int(wall_now())
+        with self._cond:
+            pending, self._pending = self._pending, set()
+            reload, self._reload = self._reload, False
+        with self.pool.connection() as conn:
+            if reload or now + self.horizon // 2 >= self._loaded_until:
+                until = now + self.horizon
+                heap = [(at, reminder['event_id']) for at, reminder in due_reminders(conn, now, until)]
+                heapq.heapify(heap)
+                with self._cond:
+                    self._heap = heap
+                    self._loaded_until = until
+            elif pending:
+                entries = due_reminders(conn, now, self._loaded_until, pending)
+                with self._cond:
+                    for at, reminder in entries:
+                        heapq.heappush(self._heap, (at, reminder['event_id']))
+            due = self._claim(conn, now)
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                heapq.heappop(self._heap)
+        for _, reminder in due:
+            try:
+                self.sink.deliver(reminder)
+                self.fired += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"提醒发送失败（事件 {reminder['event_id']}）：{e}")
+
+    def _claim(self, conn, now: int):
+        """推进水位线并返回本进程负责发送的提醒"""
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT value FROM scheduler_state WHERE name = 'reminder_watermark'").fetchone()
+            watermark = row[0] if row else now
+            if row is None or watermark < now:
+                conn.execute("INSERT OR REPLACE INTO scheduler_state (name, value) VALUES ('reminder_watermark', ?)",
+                             (now,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if watermark >= now:
+            return []
+        since = max(watermark, now - REMINDER_MAX_LATE)
+        if since > watermark:
+            missed = conn.execute('SELECT COUNT(*) FROM event_reminders WHERE remind_at > ? AND remind_at <= ?',
+                                  (watermark, since)).fetchone()[0]
+            if missed:
+                self.skipped += missed
+                print(f"跳过 {missed} 条过期超过{REMINDER_MAX_LATE}秒的提醒")
+        return due_reminders(conn, since, now)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'sink': str(self.sink) if self._worker_pid == os.getpid() else None,
+                'queued': len(self._heap),
+                'loaded_until': wall_datetime(self._loaded_until).isoformat() if self._loaded_until else None,
+                'fired': self.fired,
+                'failed': self.failed,
+                'skipped': self.skipped
+            }
+
+
+reminder_scheduler = ReminderScheduler(events_db_pool)
+
+
+# ==================== 空闲时间 ====================
+
+FREEBUSY_MAX_DAYS = int(os.getenv('CALENDAR_FREEBUSY_MAX_DAYS', '366'))  # 单次查询的最大时间窗口（天）
+SLOTS_DEFAULT_DAYS = 7  # /api/slots未指定within时从现在起查找的天数
+SLOTS_MAX_LIMIT = 500
+
+
+def busy_interval(event: Dict):
+    """事件占用的区间（墙上epoch秒）；全天事件占满所在的每一天"""
+    start = parse_event_time(event['start_time']).replace(tzinfo=None)
+    end = parse_event_time(event['end_time']).replace(tzinfo=None)
+    if event.get('is_all_day'):
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        day_end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = day_end if day_end == end and end > start else day_end + timedelta(days=1)
+    return wall_epoch(start), wall_epoch(end)
+
+
+def merge_intervals(intervals, window_start: int, window_end: int):
+    """排序后一次扫描合并重叠/相邻的区间，并裁剪到[window_start, window_end)"""
+    merged = []
+    for start, end in sorted(intervals):
+        start, end = max(start, window_start), min(end, window_end)
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def free_gaps(busy, window_start: int, window_end: int, min_length: int):
+    """已合并的忙碌区间之间长度不小于min_length的空闲区间"""
+    gaps = []
+    cursor = window_start
+    for start, end in busy + [[window_end, window_end]]:
+        if start - cursor >= min_length:
+            gaps.append([cursor, start])
+        cursor = max(cursor, end)
+    return gaps
+
+
+def format_interval(interval):
+    """[开始, 结束]的紧凑表示（ISO时间，按墙上时间）"""
+    return [wall_datetime(interval[0]).isoformat(), wall_datetime(interval[1]).isoformat()]
+
+
+# ==================== 全文搜索 ====================
+
+SEARCH_COLUMNS = ('title', 'description', 'location', 'participants')
+SEARCH_WEIGHTS = '10.0, 2.0, 3.0, 3.0'  # bm25列权重：标题最重要
+SEARCH_MAX_TERMS = 10
+SEARCH_MAX_LIMIT = 100
+SEARCH_SNIPPET_TOKENS = 16
+SEARCH_MIN_TERM = 3  # trigram分词，短于3个字符的词无法走索引，改用events_fts_chars
+SEARCH_CHARS_SYNC_BATCH = 500  # 每个事务同步到events_fts_chars的事件数
+SEARCH_CHARS_SYNC_INTERVAL = 1.0  # 没有待同步事件时的检查间隔（秒）
+
+# 外部内容FTS5表（内容仍在events中），trigram分词支持中文子串和前缀匹配
+EVENTS_FTS_SCHEMA = [
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+        {', '.join(SEARCH_COLUMNS)}, content='events', content_rowid='id', tokenize='trigram'
+    )
+    ''',
+    'DROP TRIGGER IF EXISTS events_fts_ai',
+    'DROP TRIGGER IF EXISTS events_fts_au',
+    'DROP TRIGGER IF EXISTS events_fts_ad',
+    f'''
+    CREATE TRIGGER events_fts_ai AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts (rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in SEARCH_COLUMNS)});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER events_fts_au AFTER UPDATE OF {', '.join(SEARCH_COLUMNS)} ON events BEGIN
+        INSERT INTO events_fts (events_fts, rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in SEARCH_COLUMNS)});
+        INSERT INTO events_fts (rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in SEARCH_COLUMNS)});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER events_fts_ad AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts (events_fts, rowid, {', '.join(SEARCH_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in SEARCH_COLUMNS)});
+    END
+    ''',
+]
+
+# 短词索引：中日韩文字逐字切分后用unicode61分词，1～2个字的词按相邻字的短语匹配。
+# 切分在Python中完成，触发器只把变化的事件ID记入events_fts_chars_pending，由SearchCharsIndexer同步；
+# 其他程序（init_db.py、sqlite3命令行）写入events不需要注册任何SQL函数。
+EVENTS_FTS_CHARS_SCHEMA = [
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS events_fts_chars USING fts5(
+        {', '.join(SEARCH_COLUMNS)}, tokenize='unicode61'
+    )
+    ''',
+    'CREATE TABLE IF NOT EXISTS events_fts_chars_pending (event_id INTEGER PRIMARY KEY)',
+    'DROP TRIGGER IF EXISTS events_fts_chars_ai',
+    'DROP TRIGGER IF EXISTS events_fts_chars_au',
+    'DROP TRIGGER IF EXISTS events_fts_chars_ad',
+    '''
+    CREATE TRIGGER events_fts_chars_ai AFTER INSERT ON events BEGIN
+        INSERT OR IGNORE INTO events_fts_chars_pending (event_id) VALUES (new.id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER events_fts_chars_au AFTER UPDATE OF {', '.join(SEARCH_COLUMNS)} ON events BEGIN
+        INSERT OR IGNORE INTO events_fts_chars_pending (event_id) VALUES (new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER events_fts_chars_ad AFTER DELETE ON events BEGIN
+        INSERT OR IGNORE INTO events_fts_chars_pending (event_id) VALUES (old.id);
+    END
+    ''',
+]
+
+# FTS5或trigram分词不可用（SQLite < 3.34）时回退到LIKE扫描
+events_fts_enabled = False
+
+
+def init_events_fts():
+    """创建events_fts、events_fts_chars及同步触发器，首次创建时从events重建索引"""
+    global events_fts_enabled
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('events', 'events_fts')")
+        tables = {row[0] for row in cursor.fetchall()}
+        if 'events' not in tables:
+            return
+        try:
+            for statement in EVENTS_FTS_SCHEMA:
+                cursor.execute(statement)
+            if 'events_fts' not in tables:
+                cursor.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = 'events_fts_chars'")
+            chars_exists = cursor.fetchone() is not None
+            for statement in EVENTS_FTS_CHARS_SCHEMA:
+                cursor.execute(statement)
+            if not chars_exists:
+                # 已有事件由SearchCharsIndexer在后台分批建立短词索引
+                cursor.execute("INSERT OR IGNORE INTO events_fts_chars_pending (event_id) SELECT id FROM events")
+            conn.commit()
+            events_fts_enabled = True
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            print(f"FTS5全文索引不可用，搜索将使用LIKE扫描：{e}")
+    finally:
+        conn.close()
+
+
+init_events_fts()
+
+
+def parse_search_terms(query: str):
+    """把搜索词拆成词条：支持"带空格的短语"，结尾的*（前缀）按子串匹配处理"""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query):
+        term = (phrase or word).strip().rstrip('*')
+        if term and term not in terms:
+            terms.append(term)
+    return terms[:SEARCH_MAX_TERMS]
+
+
+def fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+_CJK_CHAR_RE = re.compile('([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])')
+
+
+def search_chars_text(text):
+    """events_fts_chars中存储的文本：每个中日韩文字前后加空格，unicode61按单字切分"""
+    return _CJK_CHAR_RE.sub(r' \1 ', text) if text else text
+
+
+def search_chars_phrase(term: str) -> str:
+    """短词在events_fts_chars中的查询：中日韩文字按相邻单字的短语匹配，以其他字符结尾时按词前缀匹配"""
+    phrase = fts_phrase(' '.join(search_chars_text(term).split()))
+    return phrase if _CJK_CHAR_RE.fullmatch(term[-1]) else phrase + ' *'
+
+
+class SearchCharsIndexer:
+    """把events_fts_chars_pending中的事件同步到events_fts_chars
+
+    每个服务进程一个线程，每批在一个写事务中读取事件当前内容并替换索引行；
+    prefork的多个进程同时同步也不会重复。还没同步的事件在搜索时用LIKE匹配。
+    """
+
+    def __init__(self, pool, batch_size=SEARCH_CHARS_SYNC_BATCH):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self._worker_pid = None
+
+    def start(self):
+        """启动同步线程（每个服务进程调用一次）"""
+        if self._worker_pid == os.getpid() or not events_fts_enabled:
+            return
+        self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='search-chars-indexer', daemon=True).start()
+
+    def step(self) -> int:
+        """同步一批事件，返回处理的数量"""
+        with self.pool.connection() as conn:
+            if conn.execute('SELECT 1 FROM events_fts_chars_pending LIMIT 1').fetchone() is None:
+                return 0
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                ids = [row[0] for row in conn.execute(
+                    'SELECT event_id FROM events_fts_chars_pending LIMIT ?', (self.batch_size,))]
+                placeholders = ', '.join(['?'] * len(ids))
+                rows = conn.execute(
+                    f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM events WHERE id IN ({placeholders})", ids).fetchall()
+                conn.executemany('DELETE FROM events_fts_chars WHERE rowid = ?', [(event_id,) for event_id in ids])
+                conn.executemany(
+                    f"INSERT INTO events_fts_chars (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                    [[row[0]] + [search_chars_text(value) for value in row[1:]] for row in rows])
+                conn.execute(f'DELETE FROM events_fts_chars_pending WHERE event_id IN ({placeholders})', ids)
+                conn.commit()
+                return len(ids)
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _run(self):
+        while True:
+            try:
+                if not self.step():
+                    time.sleep(SEARCH_CHARS_SYNC_INTERVAL)
+            except sqlite3.Error as e:
+                print(f"短词搜索索引同步出错：{e}")
+                time.sleep(SEARCH_CHARS_SYNC_INTERVAL)
+
+
+search_chars_indexer = SearchCharsIndexer(events_db_pool)
+
+
+def like_pattern(term: str) -> str:
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+_SNIPPET_OPEN, _SNIPPET_CLOSE = '\x02', '\x03'  # 与SQL中snippet()的char(2)、char(3)对应
+
+
+def render_snippet(text: str) -> str:
+    """HTML转义片段，再把高亮标记换成<mark>"""
+    escaped = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return escaped.replace(_SNIPPET_OPEN, '<mark>').replace(_SNIPPET_CLOSE, '</mark>')
+
+
+def fallback_snippet(row, terms, width=SEARCH_SNIPPET_TOKENS * 2) -> str:
+    """没有FTS匹配（只有短词或FTS不可用）时，在Python中截取第一个命中词附近的片段"""
+    for column in SEARCH_COLUMNS:
+        text = row[column] or ''
+        lowered = text.lower()
+        for term in terms:
+            pos = lowered.find(term.lower())
+            if pos < 0:
+                continue
+            start = max(0, pos - width // 2)
+            end = min(len(text), pos + len(term) + width // 2)
+            return ('…' if start else '') + text[start:pos] + _SNIPPET_OPEN + text[pos:pos + len(term)] \
+                + _SNIPPET_CLOSE + text[pos + len(term):end] + ('…' if end < len(text) else '')
+    return (row['title'] or '')[:width]
+
+
+# ==================== 参与者索引 ====================
+
+PARTICIPANTS_MIGRATION_BATCH = int(os.getenv('CALENDAR_PARTICIPANTS_MIGRATION_BATCH', '2000'))  # 在线迁移每个事务处理的事件ID范围
+PARTICIPANTS_MIGRATION_PAUSE = 0.05  # 迁移批次之间的间隔（秒），给请求让出写锁
+
+
+PARTICIPANTS_INDEX_VERSION = 2  # event_participants的拆分规则变化时递增，启动时按新规则重新回填
+
+
+def participants_json_sql(column: str) -> str:
+    """把逗号分隔的参与者转换为JSON数组的SQL表达式
+
+    json_quote转义引号、反斜杠和控制字符，转义结果中不会出现逗号，
+    所以在它的结果上按逗号切分总能得到合法的JSON数组。
+    """
+    return f"""'[' || replace(json_quote(COALESCE({column}, '')), ',', '","') || ']'"""
+
+
+def participant_trim_sql(value: str) -> str:
+    """去掉参与者名称两端空白的SQL表达式（与Python的str.strip使用相同的空白字符）"""
+    return f"trim({value}, char({', '.join(str(c) for c in range(0x3001) if chr(c).isspace())}))"
+
+
+# event_participants：每个事件的每个参与者一行（按名称建索引，不区分大小写），由触发器维护
+# position保留原来的顺序；已有数据由ParticipantsMigration分批在线迁移
+PARTICIPANTS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS event_participants (
+        event_id INTEGER NOT NULL,
+        participant TEXT NOT NULL COLLATE NOCASE,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (event_id, position)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_event_participants_name ON event_participants(participant, event_id)',
+    'DROP TRIGGER IF EXISTS event_participants_ai',
+    'DROP TRIGGER IF EXISTS event_participants_au',
+    'DROP TRIGGER IF EXISTS event_participants_ad',
+    f'''
+    CREATE TRIGGER event_participants_ai AFTER INSERT ON events BEGIN
+        INSERT OR IGNORE INTO event_participants (event_id, participant, position)
+        SELECT new.id, {participant_trim_sql('value')}, key FROM json_each({participants_json_sql('new.participants')})
+        WHERE {participant_trim_sql('value')} != '';
+    END
+    ''',
+    f'''
+    CREATE TRIGGER event_participants_au AFTER UPDATE OF participants ON events BEGIN
+        DELETE FROM event_participants WHERE event_id = new.id;
+        INSERT OR IGNORE INTO event_participants (event_id, participant, position)
+        SELECT new.id, {participant_trim_sql('value')}, key FROM json_each({participants_json_sql('new.participants')})
+        WHERE {participant_trim_sql('value')} != '';
+    END
+    ''',
+    '''
+    CREATE TRIGGER event_participants_ad AFTER DELETE ON events BEGIN
+        DELETE FROM event_participants WHERE event_id = old.id;
+    END
+    ''',
+]
+
+
+def init_participants_db():
+    """创建参与者表和触发器；首次创建或拆分规则变化时记录需要回填的事件ID范围，由后台线程在线迁移"""
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('events', 'event_participants')")
+        tables = {row[0] for row in cursor.fetchall()}
+        if 'events' not in tables:
+            return
+        cursor.execute('BEGIN IMMEDIATE')
+        for statement in PARTICIPANTS_SCHEMA:
+            cursor.execute(statement)
+        cursor.execute("SELECT value FROM scheduler_state WHERE name = 'participants_index_version'")
+        row = cursor.fetchone()
+        if 'event_participants' not in tables or row is None or row[0] < PARTICIPANTS_INDEX_VERSION:
+            # 触发器建立之后的写入由触发器维护，之前的事件（ID不超过当前最大值）需要回填；
+            # 拆分规则变化时按新规则重新回填（旧规则会丢掉含制表符、换行等控制字符的整个参与者列表）
+            cursor.execute("INSERT OR REPLACE INTO scheduler_state (name, value) VALUES ('participants_index_version', ?)",
+                           (PARTICIPANTS_INDEX_VERSION,))
+            cursor.execute("INSERT OR REPLACE INTO scheduler_state (name, value) VALUES ('participants_backfill_from', 0)")
+            cursor.execute('''
+                INSERT OR REPLACE INTO scheduler_state (name, value)
+                SELECT 'participants_backfill_to', COALESCE(MAX(id), 0) FROM events
+            ''')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+init_participants_db()
+
+
+class ParticipantsMigration:
+    """participants列到event_participants表的在线迁移
+
+    每个批次在一个短事务中处理一段事件ID，进度记录在scheduler_state中：
+    重启后从断点继续，prefork的多个进程可以同时推进而不会重复。
+    迁移完成前按参与者查询回退到participants列的LIKE匹配。
+    """
+
+    def __init__(self, pool, batch_size=PARTICIPANTS_MIGRATION_BATCH):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self._ready = False
+        self._worker_pid = None
+
+    def start(self):
+        """启动迁移线程（每个服务进程调用一次）"""
+        if self._worker_pid == os.getpid() or self._ready:
+            return
+        self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, name='participants-migration', daemon=True).start()
+
+    def ready(self, conn) -> bool:
+        """event_participants是否已包含所有事件"""
+        if not self._ready:
+            state = dict(conn.execute(
+                "SELECT name, value FROM scheduler_state WHERE name LIKE 'participants_backfill_%'").fetchall())
+            if state and state.get('participants_backfill_from', 0) >= state.get('participants_backfill_to', 0):
+                self._ready = True
+        return self._ready
+
+    def step(self) -> bool:
+        """迁移一个批次，全部完成后返回False"""
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                state = dict(conn.execute(
+                    "SELECT name, value FROM scheduler_state WHERE name LIKE 'participants_backfill_%'").fetchall())
+                start = state.get('participants_backfill_from', 0)
+                end = state.get('participants_backfill_to', 0)
+                if start >= end:
+                    conn.commit()
+                    self._ready = True
+                    return False
+                upto = min(end, start + self.batch_size)
+                # 按新规则重新回填时替换这段事件已有的行
+                conn.execute('DELETE FROM event_participants WHERE event_id > ? AND event_id <= ?', (start, upto))
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO event_participants (event_id, participant, position)
+                    SELECT e.id, {participant_trim_sql('j.value')}, j.key
+                    FROM events e, json_each({participants_json_sql('e.participants')}) j
+                    WHERE e.id > ? AND e.id <= ? AND e.participants IS NOT NULL AND {participant_trim_sql('j.value')} != ''
+                ''', (start, upto))
+                conn.execute("UPDATE scheduler_state SET value = ? WHERE name = 'participants_backfill_from'", (upto,))
+                conn.commit()
+                return True
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _run(self):
+        try:
+            while self.step():
+                time.sleep(PARTICIPANTS_MIGRATION_PAUSE)
+        except sqlite3.Error as e:
+            print(f"参与者索引迁移中断（下次启动时继续）：{e}")
+
+
+participants_migration = ParticipantsMigration(events_db_pool)
+
+
+def participant_condition(conn, names):
+    """包含任一参与者的事件的WHERE条件和参数；迁移未完成时回退到participants列的匹配"""
+    if participants_migration.ready(conn):
+        placeholders = ', '.join(['?'] * len(names))
+        return f'e.id IN (SELECT event_id FROM event_participants WHERE participant IN ({placeholders}))', list(names)
+    # participants以", "连接存储，首尾补上分隔符后做精确匹配
+    return '(' + ' OR '.join(["(', ' || e.participants || ', ') LIKE ? ESCAPE '\\'"] * len(names)) + ')', \
+        [like_pattern(f', {name}, ') for name in names]
+
+
+# ==================== 批量导入导出 ====================
+
+BULK_BATCH_SIZE = int(os.getenv('CALENDAR_BULK_BATCH_SIZE', '500'))  # 每个事务插入的事件数
+BULK_MAX_ERRORS = 1000  # 响应中最多返回的错误行数
+BULK_MAX_LINE = 1024 * 1024  # 单行最大字节数
+
+ICS_STATUS_MAP = {'CANCELLED': 'cancelled', 'COMPLETED': 'completed', 'IN-PROCESS': 'in_progress'}
+EVENT_TYPES = ('meeting', 'work', 'personal', 'other')
+
+
+def iter_ndjson_events(lines):
+    """逐行解析NDJSON，生成(行号, 事件数据或None, 错误信息)；lines中的None表示过长的行"""
+    for line_no, line in enumerate(lines, 1):
+        if line is None:
+            yield line_no, None, f"行过长（超过{BULK_MAX_LINE}字节）"
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"JSON解析失败：{e}"
+            continue
+        if not isinstance(data, dict):
+            yield line_no, None, "每行必须是一个JSON对象"
+            continue
+        yield line_no, data, None
+
+
+def ics_unescape(value: str) -> str:
+    """还原iCalendar TEXT转义"""
+    return (value.replace('\\n', '\n').replace('\\N', '\n')
+            .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\'))
+
+
+def ics_escape(value: str) -> str:
+    """iCalendar TEXT转义"""
+    return (value.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def ics_parse_time(value: str, params: Dict):
+    """解析DTSTART/DTEND，返回(ISO时间字符串, 是否全天)
+
+    UTC时间转换为服务器本地时间，TZID按墙上时间处理，与库中存储方式一致。
+    """
+    value = value.strip()
+    if params.get('VALUE') == 'DATE' or (len(value) == 8 and value.isdigit()):
+        return datetime.strptime(value[:8], '%Y%m%d').isoformat(), True
+    if value.endswith('Z'):
+        dt = datetime.strptime(value[:-1], '%Y%m%dT%H%M%S').replace(tzinfo=timezone.utc)
+        return dt.astimezone().replace(tzinfo=None).isoformat(), False
+    return datetime.strptime(value, '%Y%m%dT%H%M%S').isoformat(), False
+
+
+def ics_parse_duration(value: str) -> timedelta:
+    """解析DURATION（如PT1H30M、P1D、P2W）"""
+    match = re.fullmatch(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?', value.strip())
+    if not match:
+        raise ValueError(f"DURATION格式无效：{value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == '-' else delta
+
+
+def ics_format_time(value: str) -> str:
+    """ISO时间转换为iCalendar格式：无时区为浮动时间，有时区转为UTC"""
+    dt = parse_event_time(value)
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return dt.strftime('%Y%m%dT%H%M%S')
+
+
+def _ics_unfold(lines):
+    """合并iCalendar折行，生成(起始行号, 逻辑行)；过长的行生成(行号, None)"""
+    current = None
+    start_no = 0
+    for line_no, line in enumerate(lines, 1):
+        if line is None:
+            if current is not None:
+                yield start_no, current
+            current = None
+            yield line_no, None
+            continue
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start_no, current
+        current, start_no = line, line_no
+    if current is not None:
+        yield start_no, current
+
+
+def _ics_vevent_to_event(props: Dict) -> Dict:
+    """把VEVENT属性转换为事件数据"""
+    event = {'event_type': 'other'}
+    if 'SUMMARY' in props:
+        event['title'] = ics_unescape(props['SUMMARY'][0][1])
+    if 'DESCRIPTION' in props:
+        event['description'] = ics_unescape(props['DESCRIPTION'][0][1])
+    if 'LOCATION' in props:
+        event['location'] = ics_unescape(props['LOCATION'][0][1])
+    if 'DTSTART' not in props:
+        raise ValueError("缺少DTSTART")
+    params, value = props['DTSTART'][0]
+    event['start_time'], all_day = ics_parse_time(value, params)
+    if 'DTEND' in props:
+        params, value = props['DTEND'][0]
+        event['end_time'], _ = ics_parse_time(value, params)
+    else:
+        start = datetime.fromisoformat(event['start_time'])
+        if 'DURATION' in props:
+            end = start + ics_parse_duration(props['DURATION'][0][1])
+        else:
+            end = start + (timedelta(days=1) if all_day else timedelta(hours=1))
+        event['end_time'] = end.isoformat()
+    event['is_all_day'] = all_day
+    if 'RRULE' in props:
+        event['recurrence_rule'] = props['RRULE'][0][1]
+    if 'STATUS' in props:
+        event['status'] = ICS_STATUS_MAP.get(props['STATUS'][0][1].upper(), 'scheduled')
+    if 'CATEGORIES' in props:
+        category = props['CATEGORIES'][0][1].split(',')[0].strip().lower()
+        if category in EVENT_TYPES:
+            event['event_type'] = category
+    participants = []
+    for params, value in props.get('ATTENDEE', []):
+        name = params.get('CN') or re.sub(r'^mailto:', '', value, flags=re.I)
+        if name:
+            participants.append(name.strip('"'))
+    if participants:
+        event['participants'] = participants
+    return event
+
+
+def iter_ics_events(lines):
+    """流式解析iCalendar，逐个VEVENT生成(行号, 事件数据或None, 错误信息)"""
+    props = None
+    start_no = 0
+    for line_no, line in _ics_unfold(lines):
+        if line is None:
+            # 过长的行所在的VEVENT不再导入
+            yield line_no, None, f"行过长（超过{BULK_MAX_LINE}字节）"
+            props = None
+            continue
+        if ':' not in line:
+            continue
+        head, value = line.split(':', 1)
+        name, *raw_params = head.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            props, start_no = {}, line_no
+        elif name == 'END' and value.upper() == 'VEVENT' and props is not None:
+            try:
+                yield start_no, _ics_vevent_to_event(props), None
+            except ValueError as e:
+                yield start_no, None, str(e)
+            props = None
+        elif props is not None:
+            params = {}
+            for param in raw_params:
+                if '=' in param:
+                    key, param_value = param.split('=', 1)
+                    params[key.upper()] = param_value
+            props.setdefault(name, []).append((params, value))
+
+
+def event_to_ics(event: Dict) -> str:
+    """把事件格式化为VEVENT文本（含CRLF）"""
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:event-{event['id']}@calendar",
+    ]
+    if event.get('is_all_day'):
+        lines.append(f"DTSTART;VALUE=DATE:{parse_event_time(event['start_time']).strftime('%Y%m%d')}")
+        lines.append(f"DTEND;VALUE=DATE:{parse_event_time(event['end_time']).strftime('%Y%m%d')}")
+    else:
+        lines.append(f"DTSTART:{ics_format_time(event['start_time'])}")
+        lines.append(f"DTEND:{ics_format_time(event['end_time'])}")
+    lines.append(f"SUMMARY:{ics_escape(event.get('title') or '')}")
+    if event.get('description'):
+        lines.append(f"DESCRIPTION:{ics_escape(event['description'])}")
+    if event.get('location'):
+        lines.append(f"LOCATION:{ics_escape(event['location'])}")
+    lines.append(f"CATEGORIES:{event.get('event_type', 'other').upper()}")
+    if event.get('status') == 'cancelled':
+        lines.append('STATUS:CANCELLED')
+    for participant in event.get('participants') or []:
+        address = f"mailto:{participant}" if '@' in participant else 'invalid:nomail'
+        name = participant.replace('"', '')
+        lines.append(f'ATTENDEE;CN="{name}":{address}')
+    if event.get('recurrence_rule'):
+        lines.append(f"RRULE:{event['recurrence_rule']}")
+    lines.append('END:VEVENT')
+    return ''.join(_ics_fold(line) + '\r\n' for line in lines)
+
+
+def _ics_fold(line: str) -> str:
+    """按75字节折行"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        chunk = encoded[:limit]
+        # 避免截断UTF-8多字节字符
+        while chunk and (encoded[len(chunk):len(chunk) + 1] or b'\x00')[0] & 0xC0 == 0x80:
+            chunk = chunk[:-1]
+        parts.append(chunk.decode('utf-8'))
+        encoded = encoded[len(chunk):]
+    return '\r\n '.join(parts)
+
+
+# ==================== 流式响应 ====================
+
+STREAM_BATCH_SIZE = int(os.getenv('CALENDAR_STREAM_BATCH_SIZE', '200'))  # 每次从游标取出的行数
+STREAM_CHUNK_SIZE = int(os.getenv('CALENDAR_STREAM_CHUNK_SIZE', str(16 * 1024)))  # 攒够多少字节写出一个分块
+
+
+class ChunkedWriter:
+    """HTTP/1.1分块传输编码写出器
+
+    写入的数据先攒在缓冲区，达到STREAM_CHUNK_SIZE再作为一个分块写出；
+    chunked=False时（HTTP/1.0客户端）直接写出，以关闭连接结束响应。
+    """
+
+    def __init__(self, wfile, chunked=True, chunk_size=STREAM_CHUNK_SIZE):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+        self._buffer = []
+        self._buffered = 0
+        self.bytes_written = 0
+
+    def write(self, data: bytes):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        else:
+            self.wfile.write(data)
+        self.wfile.flush()
+        self.bytes_written += len(data)
+
+    def close(self):
+        """写出剩余数据和结束分块"""
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+
+
+def iter_rows(cursor, batch_size=STREAM_BATCH_SIZE):
+    """分批从游标读取行，避免fetchall把整个结果集读入内存"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+# ==================== 响应缓存 ====================
+
+RESPONSE_CACHE_SIZE = int(os.getenv('CALENDAR_RESPONSE_CACHE_SIZE', '256'))  # 缓存的响应数量上限
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('CALENDAR_RESPONSE_CACHE_MAX_BYTES', str(1024 * 1024)))  # 单个响应体超过此大小不缓存
+
+
+def calendar_version(conn, user_id=1) -> int:
+    """读取日历版本号（由触发器在每次写入时递增）"""
+    row = conn.execute('SELECT version FROM calendar_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def response_etag(key, version) -> str:
+    """由规范化查询和日历版本号生成强ETag，各进程对同一版本得到相同的值"""
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    return f'"{version}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match是否命中（弱比较，按RFC 7232处理列表和*）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """事件查询响应缓存
+
+    按规范化查询缓存序列化好的响应体，每个条目记录生成时的日历版本号；
+    版本号变化（任何事件写入）后旧条目在下次访问时被丢弃。
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_size = max(1, max_size)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                return
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'bytes': sum(len(entry[1]) for entry in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+response_cache = ResponseCache()
+
+
+# ==================== 静态文件 ====================
+
+STATIC_CACHE_BYTES = int(os.getenv('CALENDAR_STATIC_CACHE_BYTES', str(8 * 1024 * 1024)))  # 内存缓存总大小
+STATIC_CACHE_MAX_FILE = int(os.getenv('CALENDAR_STATIC_CACHE_MAX_FILE', str(256 * 1024)))  # 超过此大小的文件用sendfile发送
+STATIC_MAX_AGE = int(os.getenv('CALENDAR_STATIC_MAX_AGE', '3600'))  # 非HTML资源的Cache-Control max-age（秒）
+
+# 预先生成gzip/brotli版本的页面
+STATIC_PRECOMPRESS = {'index.html', 'login.html', 'upload.html'}
+
+STATIC_CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.ico': 'image/x-icon',
+    '.pdf': 'application/pdf',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.xls': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.txt': 'text/plain; charset=utf-8',
+    '.md': 'text/plain; charset=utf-8',
+    '.log': 'text/plain; charset=utf-8',
+    '.csv': 'text/plain; charset=utf-8',
+}
+
+
+def static_content_type(filename: str) -> str:
+    """按扩展名确定Content-Type，未知类型按二进制流处理"""
+    return STATIC_CONTENT_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+
+
+def accepted_encodings(header: Optional[str]) -> set:
+    """解析Accept-Encoding，返回客户端接受的编码（忽略q=0）"""
+    encodings = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if not name or params in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def parse_range(header: Optional[str], size: int):
+    """解析单个字节范围，返回(start, end)（含end）；不支持的格式返回None，无法满足时返回False"""
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec:
+        # 多段范围按完整响应处理
+        return None
+    first, sep, last = spec.partition('-')
+    if not sep:
+        return None
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+class StaticFile:
+    """静态文件的元数据和（小文件的）内容及压缩版本"""
+
+    __slots__ = ('path', 'size', 'mtime_ns', 'etag', 'last_modified', 'content_type', 'body', 'variants')
+
+    def __init__(self, path, st, content_type):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.content_type = content_type
+        self.body = None
+        self.variants = {}
+
+    def cost(self):
+        return (len(self.body) if self.body else 0) + sum(len(v) for v in self.variants.values())
+
+
+class StaticFileCache:
+    """按文件大小计费的LRU缓存
+
+    每次请求都会stat文件，mtime或大小变化时重新读取，修改页面后无需重启。
+    """
+
+    def __init__(self, max_bytes=STATIC_CACHE_BYTES, max_file=STATIC_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, path, st) -> StaticFile:
+        """返回与当前文件状态一致的StaticFile；小文件附带内容"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        entry = StaticFile(path, st, static_content_type(path))
+        if st.st_size > self.max_file:
+            return entry
+        with open(path, 'rb') as f:
+            entry.body = f.read()
+        if len(entry.body) != st.st_size:
+            # 读取期间文件被修改，本次不缓存
+            entry.size = len(entry.body)
+            return entry
+        if os.path.basename(path) in STATIC_PRECOMPRESS:
+            entry.variants['gzip'] = gzip.compress(entry.body, compresslevel=9)
+            if brotli is not None:
+                entry.variants['br'] = brotli.compress(entry.body)
+        
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old.cost()
+            self._entries[path] = entry
+            self._bytes += entry.cost()
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.cost()
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+static_cache = StaticFileCache()
+
+
+# ==================== 文件上传 ====================
+
+UPLOAD_MAX_SIZE = int(os.getenv('CALENDAR_UPLOAD_MAX_SIZE', str(30 * 1024 * 1024)))  # 单个文件大小上限
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv('CALENDAR_UPLOAD_MAX_REQUEST_SIZE', str(4 * UPLOAD_MAX_SIZE)))  # 单次上传请求体上限
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 从请求体读取、写入文件的块大小
+UPLOAD_MAX_PART_HEADERS = 16 * 1024  # multipart单个part头部的大小上限
+UPLOAD_DEDUP = os.getenv('CALENDAR_UPLOAD_DEDUP', '0') == '1'  # 按内容去重存储上传文件
+UPLOAD_BLOB_DIR = os.path.join(UPLOAD_DIR, '.blobs')  # 去重存储的内容文件（按SHA-256分目录）
+
+# 断点续传
+UPLOAD_RESUMABLE_MAX_SIZE = int(os.getenv('CALENDAR_UPLOAD_RESUMABLE_MAX_SIZE', str(1024 * 1024 * 1024)))  # 断点续传的文件大小上限
+UPLOAD_RESUMABLE_CHUNK_SIZE = int(os.getenv('CALENDAR_UPLOAD_RESUMABLE_CHUNK_SIZE', str(8 * 1024 * 1024)))  # 单个PATCH请求体上限
+UPLOAD_SESSION_TTL = int(os.getenv('CALENDAR_UPLOAD_SESSION_TTL', str(24 * 3600)))  # 上传会话无活动多久后过期（秒）
+UPLOAD_SESSION_DIR = os.path.join(UPLOAD_DIR, '.sessions')  # 断点续传的稀疏临时文件
+
+
+class UploadTooLarge(Exception):
+    """上传内容超过大小限制"""
+
+
+class BlobStore:
+    """内容寻址的上传文件存储
+
+    每份内容只在 .blobs/ab/cd/<sha256> 保存一次，上传文件名是指向它的硬链接
+    （不支持硬链接时退回符号链接），静态文件服务和nginx的访问方式不变。
+    引用计数记录在upload_blobs表中，最后一个文件名被删除时删除内容文件。
+    建立链接与增加引用、检查引用与删除内容文件都在同一个数据库写事务中完成，
+    写事务在进程间互斥，删除内容文件时不会有其他进程（或线程）正在链接它。
+    """
+
+    def __init__(self, root=UPLOAD_BLOB_DIR):
+        self.root = root
+
+    @contextmanager
+    def _transaction(self):
+        """events数据库上的写事务（BEGIN IMMEDIATE），文件操作失败时回滚"""
+        conn = events_db_pool.acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            conn.close()
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def temp_path(self) -> str:
+        """上传过程中写入的临时文件（与内容文件在同一文件系统，可以直接改名）"""
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{secrets.token_hex(8)}.part")
+
+    def store(self, temp_path: str, sha256: str, alias_path: str, size: int) -> bool:
+        """把写完的临时文件存为内容文件（已存在则丢弃临时文件），让alias_path指向它并增加一个引用
+
+        返回内容文件是否已经存在（即这次上传被去重）。之后登记失败时调用方需要用unref()归还这个引用。
+        """
+        blob = self.blob_path(sha256)
+        with self._transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO upload_blobs (sha256, size, refs) VALUES (?, ?, 0)', (sha256, size))
+            conn.execute('UPDATE upload_blobs SET refs = refs + 1 WHERE sha256 = ?', (sha256,))
+            existed = os.path.exists(blob)
+            if existed:
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(temp_path, blob)
+            link_tmp = f"{alias_path}.{secrets.token_hex(4)}.link"
+            try:
+                os.link(blob, link_tmp)
+            except OSError:
+                os.symlink(blob, link_tmp)
+            os.replace(link_tmp, alias_path)
+        return existed
+
+    def release(self, conn, sha256: str) -> bool:
+        """引用计数减一（在调用方的事务中）；返回内容文件是否已无引用"""
+        conn.execute('UPDATE upload_blobs SET refs = refs - 1 WHERE sha256 = ?', (sha256,))
+        row = conn.execute('SELECT refs FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        if row is None or row[0] <= 0:
+            conn.execute('DELETE FROM upload_blobs WHERE sha256 = ?', (sha256,))
+            return True
+        return False
+
+    def remove(self, sha256: str):
+        """删除已无引用的内容文件（release()之后调用；事务中重新检查，期间被重新引用时保留）"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT refs FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            if row is None or row[0] <= 0:
+                conn.execute('DELETE FROM upload_blobs WHERE sha256 = ?', (sha256,))
+                try:
+                    os.remove(self.blob_path(sha256))
+                except OSError:
+                    pass
+
+    def unref(self, sha256: str):
+        """归还store()增加的引用（上传失败时），没有其他引用时删除内容文件"""
+        with self._transaction() as conn:
+            if self.release(conn, sha256):
+                try:
+                    os.remove(self.blob_path(sha256))
+                except OSError:
+                    pass
+
+    def collect_garbage(self, conn) -> int:
+        """删除没有引用的内容文件和遗留的临时文件（启动时调用）"""
+        if not os.path.isdir(self.root):
+            return 0
+        referenced = {row[0] for row in conn.execute('SELECT sha256 FROM upload_blobs WHERE refs > 0')}
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename not in referenced:
+                    try:
+                        os.remove(os.path.join(dirpath, filename))
+                        removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+
+blob_store = BlobStore()
+
+
+class UploadWriter:
+    """把上传内容分块写入文件，同时统计大小、计算SHA-256并检查大小上限
+
+    dedup=True时先写入BlobStore的临时文件，close()时按内容哈希存储，filepath成为指向内容的链接。
+    """
+
+    def __init__(self, filepath, max_size=UPLOAD_MAX_SIZE, dedup=UPLOAD_DEDUP):
+        self.filepath = filepath
+        self.max_size = max_size
+        self.size = 0
+        self.blob = None
+        self.deduplicated = False  # 内容在去重存储中已经存在
+        self._hash = hashlib.sha256()
+        self._path = blob_store.temp_path() if dedup else filepath
+        self._file = open(self._path, 'wb')
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadTooLarge(f"文件大小超过{self.max_size // (1024 * 1024)}MB限制")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        if self._path != self.filepath:
+            self.deduplicated = blob_store.store(self._path, self.sha256, self.filepath, self.size)
+            self.blob = self.sha256
+
+    def abort(self):
+        """关闭并删除未完成的文件；已存入去重存储时归还引用"""
+        self._file.close()
+        for path in {self._path, self.filepath}:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if self.blob:
+            blob_store.unref(self.blob)
+            self.blob = None
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+
+def reserve_upload_path(original_filename: str):
+    """生成带时间戳的安全文件名并占位创建，同名时追加序号；返回(文件名, 路径)"""
+    name = os.path.basename(original_filename.replace('\\', '/')).strip()
+    if not name or name in ('.', '..'):
+        raise ValueError("文件名不能为空")
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base, ext = os.path.splitext(name)
+    for attempt in range(1000):
+        safe_filename = f"{timestamp}_{name}" if attempt == 0 else f"{timestamp}_{base}_{attempt}{ext}"
+        filepath = os.path.join(UPLOAD_DIR, safe_filename)
+        try:
+            os.close(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            continue
+        return safe_filename, filepath
+    raise ValueError("同名文件过多")
+
+
+def parse_header_params(value: str) -> Dict[str, str]:
+    """解析形如 form-data; name="file"; filename="a.txt" 的头部参数（支持RFC 5987的filename*）"""
+    params = {}
+    for match in re.finditer(r';\s*([\w*-]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)', value):
+        key, raw = match.group(1).lower(), match.group(2).strip()
+        if raw.startswith('"'):
+            raw = raw[1:-1].replace('\\"', '"')
+        if key.endswith('*'):
+            charset, _, encoded = raw.partition("''")
+            try:
+                raw = unquote(encoded, encoding=charset or 'utf-8', errors='strict')
+            except (LookupError, UnicodeDecodeError):
+                continue
+            key = key[:-1]
+        elif key in params:
+            # filename*优先于filename
+            continue
+        params[key] = raw
+    return params
+
+
+class MultipartReader:
+    """流式multipart/form-data解析器
+
+    按UPLOAD_CHUNK_SIZE从rfile读取（不超过Content-Length），逐个产出(头部, 内容迭代器)；
+    内容按块产出，缓冲区只保留可能是分隔符前缀的尾部，请求体不会整体进入内存或临时文件。
+    """
+
+    def __init__(self, rfile, boundary: bytes, length: int, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.rfile = rfile
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.delimiter = b'\r\n--' + boundary
+        # 补上前导CRLF，使第一个分隔符与后续分隔符格式一致
+        self.buffer = b'\r\n'
+
+    def _read(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not data:
+            self.remaining = 0
+            return False
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    def _ensure(self, size) -> bool:
+        while len(self.buffer) < size:
+            if not self._read():
+                return False
+        return True
+
+    def _iter_data(self):
+        """产出当前part的内容，直到下一个分隔符（分隔符被消费）"""
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                data, self.buffer = self.buffer[:index], self.buffer[index + len(self.delimiter):]
+                if data:
+                    yield data
+                return
+            if len(self.buffer) > keep:
+                data, self.buffer = self.buffer[:-keep], self.buffer[-keep:]
+                yield data
+            if not self._read():
+                raise ValueError("multipart数据不完整")
+
+    def _read_headers(self) -> Dict[str, str]:
+        if self._ensure(2) and self.buffer.startswith(b'\r\n'):
+            self.buffer = self.buffer[2:]
+            return {}
+        while True:
+            index = self.buffer.find(b'\r\n\r\n')
+            if index >= 0:
+                break
+            if len(self.buffer) > UPLOAD_MAX_PART_HEADERS:
+                raise ValueError("multipart头部过长")
+            if not self._read():
+                raise ValueError("multipart数据不完整")
+        block, self.buffer = self.buffer[:index], self.buffer[index + 4:]
+        headers = {}
+        for line in block.decode('utf-8', errors='replace').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def parts(self):
+        """逐个产出(头部字典, 内容迭代器)；调用方未读完的内容会被跳过"""
+        for _ in self._iter_data():
+            pass  # 丢弃preamble
+        while True:
+            if not self._ensure(2):
+                raise ValueError("multipart数据不完整")
+            if self.buffer.startswith(b'--'):
+                return
+            if not self.buffer.startswith(b'\r\n'):
+                raise ValueError("multipart分隔符格式错误")
+            self.buffer = self.buffer[2:]
+            data = self._iter_data()
+            yield self._read_headers(), data
+            for _ in data:
+                pass
+
+
+# 上传文件通过nginx直接提供下载的目录（上传时在其中创建符号链接）
+PUBLIC_UPLOAD_DIR = os.getenv('CALENDAR_PUBLIC_UPLOAD_DIR', '/var/www/switchyomega/files/uploads')
+UPLOAD_LIST_MAX_LIMIT = 1000  # /api/uploads单页最多返回的条数
+
+UPLOADS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS uploads (
+        name TEXT PRIMARY KEY,
+        original_name TEXT,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        mtime REAL NOT NULL,
+        type TEXT NOT NULL,
+        url TEXT NOT NULL,
+        sha256 TEXT,
+        blob TEXT  -- 去重存储时引用的内容（upload_blobs.sha256），否则为NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS upload_blobs (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refs INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    # 断点续传会话：received为已收到的字节区间 [[start, end), ...]
+    '''
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT,
+        received TEXT NOT NULL DEFAULT '[]',
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions(expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_uploads_mtime ON uploads(mtime, name)',
+    'CREATE INDEX IF NOT EXISTS idx_uploads_size ON uploads(size, name)',
+    'CREATE INDEX IF NOT EXISTS idx_uploads_type_mtime ON uploads(type, mtime, name)',
+]
+
+# /api/uploads 的排序字段 -> 列
+UPLOAD_SORT_COLUMNS = {'modified': 'mtime', 'name': 'name', 'size': 'size'}
+
+
+def file_type_for(filename: str) -> str:
+    """按扩展名对文件分类：text / image / document / other"""
+    ext = filename.split('.')[-1].lower() if '.' in filename else ''
+    if ext in ['txt', 'md', 'json', 'js', 'py', 'html', 'css', 'xml']:
+        return 'text'
+    elif ext in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'svg']:
+        return 'image'
+    elif ext in ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx']:
+        return 'document'
+    return 'other'
+
+
+def link_public_upload(filename: str) -> str:
+    """在PUBLIC_UPLOAD_DIR中为上传文件创建符号链接，返回文件的访问URL
+
+    优先使用nginx直接服务的/files/uploads/，无法创建链接时使用/calendar/uploads/。
+    """
+    public_path = os.path.join(PUBLIC_UPLOAD_DIR, filename)
+    if os.path.lexists(public_path):
+        return f"/files/uploads/{filename}"
+    try:
+        os.symlink(os.path.join(UPLOAD_DIR, filename), public_path)
+        return f"/files/uploads/{filename}"
+    except OSError:
+        return f"/calendar/uploads/{filename}"
+
+
+def unlink_public_upload(filename: str):
+    """删除指向上传文件的符号链接（不是符号链接则保留）"""
+    public_path = os.path.join(PUBLIC_UPLOAD_DIR, filename)
+    try:
+        if os.path.islink(public_path):
+            os.remove(public_path)
+    except OSError:
+        pass
+
+
+def upload_catalog_entry(filename: str, original_name=None, sha256=None, blob=None) -> Dict:
+    """为已写入UPLOAD_DIR的文件生成uploads表记录（stat一次并创建公开链接）"""
+    st = os.stat(os.path.join(UPLOAD_DIR, filename))
+    return {
+        'name': filename,
+        'original_name': original_name,
+        'size': st.st_size,
+        'created': st.st_ctime,
+        'mtime': st.st_mtime,
+        'type': file_type_for(filename),
+        'url': link_public_upload(filename),
+        'sha256': sha256,
+        'blob': blob
+    }
+
+
+def record_uploads(conn, entries):
+    """写入uploads表（调用方负责事务）；去重内容的引用已在BlobStore.store()中增加"""
+    conn.executemany('''
+        INSERT OR REPLACE INTO uploads (name, original_name, size, created, mtime, type, url, sha256, blob)
+        VALUES (:name, :original_name, :size, :created, :mtime, :type, :url, :sha256, :blob)
+    ''', entries)
+
+
+def remove_upload_record(conn, name: str):
+    """删除uploads表记录并释放内容引用（调用方负责事务）；返回已无引用、应删除的内容哈希"""
+    row = conn.execute('SELECT blob FROM uploads WHERE name = ?', (name,)).fetchone()
+    conn.execute('DELETE FROM uploads WHERE name = ?', (name,))
+    if row and row[0] and blob_store.release(conn, row[0]):
+        return row[0]
+    return None
+
+
+def format_upload(row) -> Dict:
+    """uploads表记录 -> /api/uploads返回的文件信息"""
+    return {
+        'name': row['name'],
+        'size': row['size'],
+        'created': datetime.fromtimestamp(row['created']).isoformat(),
+        'modified': datetime.fromtimestamp(row['mtime']).isoformat(),
+        'type': row['type'],
+        'url': row['url'],
+        'sha256': row['sha256']
+    }
+
+
+def encode_cursor(values) -> str:
+    """keyset分页游标（不透明的base64url字符串）"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """解析encode_cursor生成的cursor：两个标量值（排序列、唯一列）的列表，格式不对时抛出ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise ValueError("无效的cursor")
+    if (not isinstance(values, list) or len(values) != 2
+            or not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in values)):
+        raise ValueError("无效的cursor")
+    return values
+
+
+def merge_ranges(ranges, start: int, end: int):
+    """把[start, end)并入已排序、互不重叠的区间列表"""
+    merged = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if merged and a <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+
+def contiguous_offset(ranges) -> int:
+    """从0开始连续收到的字节数（tus的Upload-Offset）"""
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+
+def upload_session_path(session_id: str) -> str:
+    return os.path.join(UPLOAD_SESSION_DIR, f"{session_id}.part")
+
+
+def expire_upload_sessions(conn) -> int:
+    """删除过期的断点续传会话及其临时文件（调用方负责事务）"""
+    expired = [row[0] for row in conn.execute('SELECT id FROM upload_sessions WHERE expires_at < ?', (time.time(),))]
+    for session_id in expired:
+        conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+        for path in (upload_session_path(session_id), upload_session_path(session_id) + '.finalizing'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return len(expired)
+
+
+def init_uploads_db():
+    """创建uploads表，并与UPLOAD_DIR对账：补录目录中有而表中没有的文件，删除文件已不存在的记录
+
+    只在启动时扫描一次目录，之后由上传和删除接口在事务中维护。
+    """
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        for statement in UPLOADS_SCHEMA:
+            conn.execute(statement)
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(uploads)')}
+        if 'blob' not in existing:
+            conn.execute('ALTER TABLE uploads ADD COLUMN blob TEXT')
+        known = {row['name'] for row in conn.execute('SELECT name FROM uploads')}
+        on_disk = set()
+        for entry in os.scandir(UPLOAD_DIR):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            on_disk.add(entry.name)
+        missing = [upload_catalog_entry(name) for name in sorted(on_disk - known)]
+        record_uploads(conn, missing)
+        for name in known - on_disk:
+            remove_upload_record(conn, name)
+        conn.commit()
+        if missing:
+            print(f"uploads表补录 {len(missing)} 个文件")
+        expire_upload_sessions(conn)
+        # 引用计数以uploads表为准（上次运行中链接后、登记前中断的上传不再占用引用）
+        conn.execute('''
+            UPDATE upload_blobs SET refs = (SELECT COUNT(*) FROM uploads WHERE uploads.blob = upload_blobs.sha256)
+        ''')
+        conn.execute('DELETE FROM upload_blobs WHERE refs <= 0')
+        conn.commit()
+        removed = blob_store.collect_garbage(conn)
+        if removed:
+            print(f"清理 {removed} 个未被引用的去重内容文件")
+    finally:
+        conn.close()
+
+
+init_uploads_db()
+
+
+class Base64StreamDecoder:
+    """增量base64解码：按4字符对齐分批解码写入目标，与b64decode(validate=False)一样忽略非字母表字符"""
+
+    _INVALID = re.compile(rb'[^A-Za-z0-9+/=]')
+
+    def __init__(self, write):
+        self.write = write
+        self._pending = b''
+
+    def feed(self, data: bytes):
+        data = self._pending + self._INVALID.sub(b'', data)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            self.write(binascii.a2b_base64(data[:usable]))
+
+    def close(self):
+        if self._pending:
+            raise binascii.Error("base64数据长度不正确")
+
+
+class JSONUploadReader:
+    """流式解析base64上传的JSON对象 {"filename": ..., "content": "<base64>", ...}
+
+    content字符串按块交给回调（只含base64字符，无需整体解码）；
+    其他字段体积很小，逐个读出后用json.loads解析。格式错误抛出json.JSONDecodeError。
+    """
+
+    MAX_FIELD_SIZE = 64 * 1024
+
+    def __init__(self, rfile, length: int, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.rfile = rfile
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.pos = 0
+        self.consumed = 0
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, '', self.consumed + self.pos)
+
+    def _read(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not data:
+            self.remaining = 0
+            return False
+        self.remaining -= len(data)
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self) -> bytes:
+        while self.pos >= len(self.buffer):
+            if not self._read():
+                raise self._error("JSON数据不完整")
+        return self.buffer[self.pos:self.pos + 1]
+
+    def _skip_ws(self) -> bytes:
+        while True:
+            ch = self._peek()
+            if ch not in b' \t\r\n':
+                return ch
+            self.pos += 1
+
+    def _expect(self, expected: bytes):
+        if self._skip_ws() != expected:
+            raise self._error(f"缺少 {expected.decode()}")
+        self.pos += 1
+
+    def _read_raw_value(self) -> bytes:
+        """读出一个完整JSON值的原始字节（字符串、数字、字面量或嵌套对象/数组）"""
+        raw = bytearray()
+        depth = 0
+        in_string = escaped = False
+        while True:
+            ch = self._peek()
+            if not in_string and depth == 0 and raw and ch in b',}] \t\r\n':
+                return bytes(raw)
+            raw += ch
+            self.pos += 1
+            if len(raw) > self.MAX_FIELD_SIZE:
+                raise self._error("JSON字段过长")
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == b'\\':
+                    escaped = True
+                elif ch == b'"':
+                    in_string = False
+                    if depth == 0:
+                        return bytes(raw)
+            elif ch == b'"':
+                in_string = True
+            elif ch in b'{[':
+                depth += 1
+            elif ch in b'}]':
+                depth -= 1
+                if depth == 0:
+                    return bytes(raw)
+                if depth < 0:
+                    raise self._error("JSON括号不匹配")
+
+    _ESCAPE = re.compile(rb'\\(u[0-9a-fA-F]{4}|[^u])')
+    _PARTIAL_ESCAPE = re.compile(rb'(\\+)(u[0-9a-fA-F]{0,3})?$')
+    _ESCAPES = {b'"': b'"', b'\\': b'\\', b'/': b'/', b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t'}
+
+    @classmethod
+    def _unescape(cls, match):
+        code = match.group(1)
+        if code.startswith(b'u'):
+            return chr(int(code[1:], 16)).encode('utf-8')
+        return cls._ESCAPES.get(code, b'')
+
+    def _stream_string(self, callback):
+        """把字符串内容按块交给callback（已处理转义，块边界上被截断的转义留到下一块）"""
+        self.pos += 1  # 开头的引号
+        carry = b''
+        while True:
+            if self.pos >= len(self.buffer) and not self._read():
+                raise self._error("JSON字符串未结束")
+            segment = carry + self.buffer[self.pos:]
+            
+            # 找到第一个未被转义的引号
+            search = len(carry)
+            while True:
+                end = segment.find(b'"', search)
+                if end < 0:
+                    break
+                backslashes = len(segment[:end]) - len(segment[:end].rstrip(b'\\'))
+                if backslashes % 2 == 0:
+                    break
+                search = end + 1
+            
+            body = segment if end < 0 else segment[:end]
+            self.pos = len(self.buffer) if end < 0 else self.pos + end + 1 - len(carry)
+            carry = b''
+            if b'\\' in body:
+                partial = self._PARTIAL_ESCAPE.search(body)
+                if partial and len(partial.group(1)) % 2 == 1:
+                    if end >= 0:
+                        raise self._error("JSON转义序列不完整")
+                    cut = partial.start() + len(partial.group(1)) - 1
+                    body, carry = body[:cut], body[cut:]
+                body = self._ESCAPE.sub(self._unescape, body)
+            if body:
+                callback(body)
+            if end >= 0:
+                return
+
+    def parse(self, stream_key: str, on_stream_start, on_chunk) -> Dict:
+        """解析对象；遇到stream_key时先调用on_stream_start(已解析字段)，再把内容分块交给on_chunk"""
+        fields = {}
+        self._expect(b'{')
+        if self._skip_ws() == b'}':
+            self.pos += 1
+            return fields
+        while True:
+            if self._skip_ws() != b'"':
+                raise self._error("字段名必须是字符串")
+            key = json.loads(self._read_raw_value())
+            self._expect(b':')
+            if key == stream_key and self._skip_ws() == b'"':
+                on_stream_start(fields)
+                self._stream_string(on_chunk)
+                fields[key] = True
+            else:
+                self._skip_ws()
+                try:
+                    fields[key] = json.loads(self._read_raw_value())
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    raise self._error(f"字段{key}格式错误")
+            ch = self._skip_ws()
+            self.pos += 1
+            if ch == b'}':
+                return fields
+            if ch != b',':
+                raise self._error("缺少 , 或 }")
+
+
+# ==================== 文件预览 ====================
+
+PREVIEW_HEAD_BYTES = int(os.getenv('CALENDAR_PREVIEW_HEAD_BYTES', '4096'))  # 默认预览开头的字节数
+PREVIEW_TAIL_BYTES = int(os.getenv('CALENDAR_PREVIEW_TAIL_BYTES', '1024'))  # 默认预览结尾的字节数
+PREVIEW_MAX_BYTES = 64 * 1024  # head/tail参数上限
+PREVIEW_EXACT_LINES_MAX = int(os.getenv('CALENDAR_PREVIEW_EXACT_LINES_MAX', str(8 * 1024 * 1024)))  # 不超过此大小的文件精确统计行数
+PREVIEW_SAMPLE_BLOCKS = 16  # 大文件估算行数时均匀采样的块数
+PREVIEW_SAMPLE_BLOCK_SIZE = 64 * 1024
+PREVIEW_CACHE_SIZE = 256
+
+_BOMS = [
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xff\xfe', 'utf-16-le'),
+    (b'\xfe\xff', 'utf-16-be'),
+]
+
+
+def read_at(fd: int, offset: int, count: int) -> bytes:
+    """os.pread读取一段内容，不移动文件位置，多个线程可以共用同一个文件"""
+    chunks = []
+    while count > 0:
+        chunk = os.pread(fd, min(count, 1024 * 1024), offset)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        offset += len(chunk)
+        count -= len(chunk)
+    return b''.join(chunks)
+
+
+def detect_encoding(sample: bytes, truncated: bool) -> Optional[str]:
+    """根据BOM和试解码判断文本编码，二进制文件返回None
+
+    sample可能在多字节字符中间截断，truncated为True时允许结尾不完整。
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if b'\x00' in sample:
+        return None
+    for encoding in ('utf-8', 'gb18030'):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=not truncated)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def decode_head(data: bytes, encoding: str) -> str:
+    """解码开头部分，丢弃结尾被截断的半个字符"""
+    return codecs.getincrementaldecoder(encoding)(errors='replace').decode(data, final=False)
+
+
+def decode_tail(data: bytes, encoding: str) -> str:
+    """解码结尾部分，跳过开头被截断的半个字符"""
+    if encoding in ('utf-8', 'utf-8-sig'):
+        skip = 0
+        while skip < min(3, len(data)) and 0x80 <= data[skip] < 0xC0:
+            skip += 1
+        data = data[skip:]
+    elif encoding.startswith('utf-16') and len(data) % 2:
+        data = data[1:]
+    if encoding == 'utf-8-sig':
+        encoding = 'utf-8'
+    return data.decode(encoding, errors='replace')
+
+
+def count_lines(fd: int, size: int):
+    """返回 (行数, 是否精确)
+
+    小文件用pread顺序统计换行符；大文件均匀采样若干块，按换行符密度估算。
+    """
+    if size <= PREVIEW_EXACT_LINES_MAX:
+        newlines = 0
+        last = b''
+        offset = 0
+        while offset < size:
+            chunk = os.pread(fd, 1024 * 1024, offset)
+            if not chunk:
+                break
+            newlines += chunk.count(b'\n')
+            last = chunk
+            offset += len(chunk)
+        return newlines + (1 if last and not last.endswith(b'\n') else 0), True
+    
+    step = (size - PREVIEW_SAMPLE_BLOCK_SIZE) // (PREVIEW_SAMPLE_BLOCKS - 1)
+    sampled = newlines = 0
+    for i in range(PREVIEW_SAMPLE_BLOCKS):
+        chunk = os.pread(fd, PREVIEW_SAMPLE_BLOCK_SIZE, i * step)
+        sampled += len(chunk)
+        newlines += chunk.count(b'\n')
+    return max(1, round(newlines * size / sampled)) if sampled else 0, False
+
+
+class PreviewCache:
+    """上传文件的预览元数据（编码、行数、默认大小的开头和结尾）
+
+    按 (文件名, 大小, mtime) 缓存，文件被替换后自动失效；
+    同一文件的后续预览只需一次stat，不再读取文件。
+    """
+
+    def __init__(self, max_size=PREVIEW_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filepath: str, st) -> Dict:
+        key = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(filepath)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            head = read_at(fd, 0, PREVIEW_HEAD_BYTES)
+            tail_start = max(len(head), st.st_size - PREVIEW_TAIL_BYTES)
+            tail = read_at(fd, tail_start, st.st_size - tail_start)
+            encoding = detect_encoding(head, st.st_size > len(head))
+            if encoding is not None:
+                line_count, exact = count_lines(fd, st.st_size)
+            else:
+                line_count, exact = None, False
+        finally:
+            os.close(fd)
+        
+        meta = {
+            'size': st.st_size,
+            'content_type': static_content_type(filepath),
+            'is_text': encoding is not None,
+            'encoding': encoding,
+            'line_count': line_count,
+            'line_count_exact': exact,
+            'head': head,
+            'tail': tail,
+        }
+        with self._lock:
+            self._entries[filepath] = (key, meta)
+            self._entries.move_to_end(filepath)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return meta
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+preview_cache = PreviewCache()
+
+
+def upload_file_path(name: str) -> Optional[str]:
+    """把URL中的上传文件名解析为uploads/下的路径，名称无效或文件不存在时返回None"""
+    name = unquote(name)
+    if not name or '/' in name or '\\' in name or name.startswith('.'):
+        return None
+    filepath = os.path.join(UPLOAD_DIR, name)
+    return filepath if os.path.isfile(filepath) else None
+
+
+# ==================== 生成文件列表 ====================
+
+GENERATED_DIR = os.getenv('CALENDAR_GENERATED_DIR', '/var/www/switchyomega/files')
+GENERATED_POLL_INTERVAL = float(os.getenv('CALENDAR_GENERATED_POLL_INTERVAL', '2'))  # 无inotify时检查目录mtime的间隔（秒）
+GENERATED_PAGE_CACHE_SIZE = 32  # 缓存的分页响应数量
+
+# inotify事件掩码（见 <sys/inotify.h>）
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x002, 0x004, 0x008
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x040, 0x080, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_IGNORED = 0x400, 0x800, 0x8000
+INOTIFY_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+
+def inotify_watch(directory: str) -> int:
+    """用inotify监视目录，返回inotify文件描述符；不支持时抛出OSError"""
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("当前平台不支持inotify")
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1失败")
+    if libc.inotify_add_watch(fd, os.fsencode(directory), INOTIFY_MASK) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, f"无法监视目录 {directory}")
+    return fd
+
+
+class GeneratedFilesCache:
+    """生成文件目录的列表缓存
+
+    Linux上由inotify线程在目录变化时递增generation，请求只需比较一次整数；
+    inotify不可用（或目录被删除）时退回到定期检查目录mtime。
+    缓存序列化好的响应体（按分页参数），ETag由列表内容计算，各进程一致。
+    """
+
+    def __init__(self, directory=GENERATED_DIR, poll_interval=GENERATED_POLL_INTERVAL):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._built_generation = -1
+        self._watcher_pid = None
+        self._inotify = False
+        self._dir_mtime = None
+        self._checked_at = 0.0
+        self._files = []
+        self._digest = ''
+        self._pages = OrderedDict()
+        self.rebuilds = 0
+
+    def _ensure_watcher(self):
+        """按需启动inotify线程（fork后的子进程各自启动）"""
+        if self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+            self._inotify = False
+            self._built_generation = -1
+            try:
+                fd = inotify_watch(self.directory)
+            except (OSError, AttributeError):
+                return
+            self._inotify = True
+        threading.Thread(target=self._watch_loop, args=(fd,), name='generated-files-watch', daemon=True).start()
+
+    def _watch_loop(self, fd):
+        try:
+            while True:
+                data = os.read(fd, 64 * 1024)
+                if not data:
+                    break
+                with self._lock:
+                    self._generation += 1
+                # 目录被删除或移走后watch失效，改为轮询
+                offset = 0
+                lost = False
+                while offset + 16 <= len(data):
+                    _, mask, _, name_len = struct.unpack_from('iIII', data, offset)
+                    lost = lost or bool(mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF))
+                    offset += 16 + name_len
+                if lost:
+                    break
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+            with self._lock:
+                self._inotify = False
+                self._generation += 1
+
+    def _directory_mtime(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            files.append({
+                'name': entry.name,
+                'size': stat.st_size,
+                'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
+                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+                'type': file_type_for(entry.name),
+                'url': f"/files/{entry.name}"  # 注意：这是nginx直接服务的路径
+            })
+        # 按修改时间倒序排列（最新文件在前）
+        files.sort(key=lambda x: x['modified'], reverse=True)
+        return files
+
+    def _refresh(self):
+        """目录有变化时重新扫描"""
+        self._ensure_watcher()
+        with self._lock:
+            generation = self._generation
+            if self._inotify:
+                if self._built_generation == generation:
+                    return
+                dir_mtime = None
+            else:
+                now = time.monotonic()
+                if self._built_generation == generation and now - self._checked_at < self.poll_interval:
+                    return
+                self._checked_at = now
+                dir_mtime = self._directory_mtime()
+                if self._built_generation == generation and dir_mtime == self._dir_mtime:
+                    return
+        
+        files = self._scan()
+        digest = hashlib.sha1(json.dumps(files, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            self._files = files
+            self._digest = digest
+            self._dir_mtime = dir_mtime
+            self._built_generation = generation
+            self._pages.clear()
+            self.rebuilds += 1
+
+    def page(self, offset=0, limit=None):
+        """返回(ETag, 序列化好的响应体, 文件总数)"""
+        self._refresh()
+        key = (offset, limit)
+        with self._lock:
+            etag = f'"{self._digest}-{offset}-{limit or 0}"'
+            cached = self._pages.get(key)
+            if cached is not None:
+                self._pages.move_to_end(key)
+                return etag, cached, len(self._files)
+            files = self._files[offset:offset + limit if limit else None]
+            body = json.dumps({
+                "success": True,
+                "message": "获取生成文件列表成功",
+                "data": files,
+                "timestamp": datetime.now().isoformat()
+            }, ensure_ascii=False).encode()
+            self._pages[key] = body
+            while len(self._pages) > GENERATED_PAGE_CACHE_SIZE:
+                self._pages.popitem(last=False)
+            return etag, body, len(self._files)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'inotify': self._inotify,
+                'rebuilds': self.rebuilds,
+                'cached_pages': len(self._pages)
+            }
+
+
+generated_files_cache = GeneratedFilesCache()
+
+
+# ==================== 持久连接 ====================
+
+class RequestBodyReader:
+    """包装rfile，统计当前请求已读取的请求体字节数
+
+    持久连接上处理器没有读完的请求体会被当成下一个请求解析，
+    请求结束后据此读掉剩余部分或关闭连接。
+    """
+
+    def __init__(self, rfile):
+        self.rfile = rfile
+        self.consumed = 0
+
+    def read(self, size=-1):
+        data = self.rfile.read(size)
+        self.consumed += len(data)
+        return data
+
+    def readline(self, size=-1):
+        line = self.rfile.readline(size)
+        self.consumed += len(line)
+        return line
+
+    def readinto(self, buffer):
+        count = self.rfile.readinto(buffer) or 0
+        self.consumed += count
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self.rfile, name)
 
-# 上传目录
-UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads')
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# 认证信息（与nginx保持一致）
-# 重要：在生产环境中，请通过环境变量设置这些值，不要硬编码在源代码中
-# 例如：export CALENDAR_USER=your_username，export CALENDAR_PASS=your_password
-AUTH_USER = os.getenv('CALENDAR_USER', 'admin')  # 默认用户名，建议通过环境变量覆盖
-AUTH_PASS = os.getenv('CALENDAR_PASS', '[YOUR_SECURE_PASSWORD_HERE]')  # 必须通过环境变量设置密码
-AUTH_STRING = base64.b64encode(f'{AUTH_USER}:{AUTH_PASS}'.encode()).decode()
+# ==================== 请求指标 ====================
 
-# Session管理配置
-SESSION_DB_PATH = os.path.join(DATA_DIR, 'sessions.db')
-SESSION_TIMEOUT = 24 * 3600  # 24小时
-SESSION_COOKIE_NAME = 'calendar_session'
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 直方图区间上界（秒）
+METRICS_FLUSH_INTERVAL = float(os.getenv('CALENDAR_METRICS_FLUSH_INTERVAL', '5'))  # prefork模式下各进程写出指标快照的间隔（秒）
+METRICS_DIR = os.path.join(DATA_DIR, 'metrics')  # prefork模式下各进程的指标快照
 
-# 内存中的session存储（简单实现）
-_sessions: Dict[str, Dict] = {}
+# 路由标签：事件ID、文件名等归并为占位符，避免产生无限多的时间序列
+METRICS_ROUTES = {
+    '/api/events', '/api/events/today', '/api/events/upcoming', '/api/events/export', '/api/events/search',
+    '/api/events/bulk', '/api/uploads', '/api/upload', '/api/upload_base64', '/api/upload/resumable',
+    '/api/generated-files', '/api/freebusy', '/api/slots', '/api/stats', '/api/metrics', '/api/profile', '/api/queries',
+    '/api/login', '/api/logout', '/api/check_session',
+}
+METRICS_ROUTE_PATTERNS = [
+    (re.compile(r'^/api/events/\d+$'), '/api/events/{id}'),
+    (re.compile(r'^/api/uploads/[^/]+/preview$'), '/api/uploads/{name}/preview'),
+    (re.compile(r'^/api/uploads/[^/]+$'), '/api/uploads/{name}'),
+    (re.compile(r'^/api/upload/resumable/[^/]+/complete$'), '/api/upload/resumable/{id}/complete'),
+    (re.compile(r'^/api/upload/resumable/[^/]+$'), '/api/upload/resumable/{id}'),
+]
 
-def init_session_db():
-    """初始化session数据库（如果需要）"""
-    if not os.path.exists(SESSION_DB_PATH):
-        conn = sqlite3.connect(SESSION_DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE sessions (
-                session_token TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                username TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                user_agent TEXT,
-                ip_address TEXT
-            )
-        ''')
-        cursor.execute('CREATE INDEX idx_sessions_user_id ON sessions(user_id)')
-        cursor.execute('CREATE INDEX idx_sessions_expires ON sessions(expires_at)')
-        conn.commit()
-        conn.close()
 
-# 初始化session数据库
-init_session_db()
+def metrics_route(path: str) -> str:
+    """把请求路径归并为有限的路由标签，API以外的路径统一为static"""
+    path = path.split('?', 1)[0].rstrip('/') or '/'
+    if path in METRICS_ROUTES:
+        return path
+    for pattern, route in METRICS_ROUTE_PATTERNS:
+        if pattern.match(path):
+            return route
+    return '/api/other' if path.startswith('/api/') else 'static'
+
+
+_request_phases = threading.local()
+
+
+def add_phase_time(phase: str, seconds: float):
+    """把耗时计入当前线程正在处理的请求的某个阶段（db、auth、serialize），不在请求中时忽略"""
+    phases = getattr(_request_phases, 'times', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def new_histogram():
+    """直方图：各区间的计数（最后一个区间为+Inf）和总和"""
+    return [0] * (len(METRICS_BUCKETS) + 1) + [0.0]
+
+
+class ResponseBodyWriter:
+    """包装wfile，统计写出的字节数（含响应头）"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.wfile.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
+
+class RequestMetrics:
+    """按路由统计请求数、状态码、流量和耗时直方图
+
+    每个线程写自己的分片，记录时不加锁；读取时合并所有分片。
+    prefork模式下各进程定期把快照写到METRICS_DIR，读取时合并所有进程的快照；
+    已退出进程的快照保留，计数器不会因工作进程重启而回退。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._share_dir = None
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {'requests': {}, 'transfer': {}, 'latency': {}, 'phases': {}, 'rejected': {}}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def record(self, method, route, status, seconds, bytes_in, bytes_out, phases):
+        shard = self._shard()
+        key = (method, route)
+        status_key = (method, route, str(status))
+        requests = shard['requests']
+        requests[status_key] = requests.get(status_key, 0) + 1
+        transfer = shard['transfer'].get(key)
+        if transfer is None:
+            transfer = shard['transfer'][key] = [0, 0]
+        transfer[0] += bytes_in
+        transfer[1] += bytes_out
+        histogram = shard['latency'].get(key)
+        if histogram is None:
+            histogram = shard['latency'][key] = new_histogram()
+        histogram[bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+        for phase, phase_seconds in phases.items():
+            phase_key = (route, phase)
+            histogram = shard['phases'].get(phase_key)
+            if histogram is None:
+                histogram = shard['phases'][phase_key] = new_histogram()
+            histogram[bisect.bisect_left(METRICS_BUCKETS, phase_seconds)] += 1
+            histogram[-1] += phase_seconds
+
+    def record_rejected(self, reason='queue_full'):
+        """没有进入请求处理就被拒绝的连接（在accept线程中直接返回503）"""
+        rejected = self._shard()['rejected']
+        rejected[(reason,)] = rejected.get((reason,), 0) + 1
+
+    def snapshot(self):
+        """合并本进程所有线程的分片"""
+        merged = {'requests': {}, 'transfer': {}, 'latency': {}, 'phases': {}, 'rejected': {}}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            merge_metrics(merged, {name: list(values.items()) for name, values in shard.items()})
+        return merged
+
+    def share(self, directory, interval=METRICS_FLUSH_INTERVAL):
+        """prefork子进程：启动定期写出快照的线程"""
+        self._share_dir = directory
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self._flush_loop, args=(interval,), name='calendar-metrics', daemon=True).start()
+
+    def _flush_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"写出指标快照失败：{e}")
+
+    def flush(self):
+        snapshot = {name: [[list(key), value] for key, value in values.items()]
+                    for name, values in self.snapshot().items()}
+        path = os.path.join(self._share_dir, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """本进程的实时指标，prefork模式下再合并其他进程最近写出的快照"""
+        merged = self.snapshot()
+        if self._share_dir:
+            own = f'{os.getpid()}.json'
+            for name in os.listdir(self._share_dir):
+                if not name.endswith('.json') or name == own:
+                    continue
+                try:
+                    with open(os.path.join(self._share_dir, name)) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                merge_metrics(merged, {metric: [(tuple(key), value) for key, value in values]
+                                       for metric, values in snapshot.items()})
+        return merged
+
+
+def merge_metrics(target, source):
+    """把source（指标名 -> [(标签, 值), ...]）累加到target（指标名 -> {标签: 值}）"""
+    for name, items in source.items():
+        values = target.setdefault(name, {})
+        for key, value in items:
+            if isinstance(value, list):
+                current = values.get(key)
+                if current is None:
+                    values[key] = list(value)
+                else:
+                    for i, item in enumerate(value):
+                        current[i] += item
+            else:
+                values[key] = values.get(key, 0) + value
+
+
+def prometheus_labels(names, values, **extra) -> str:
+    """生成Prometheus标签集合，转义标签值中的反斜杠、引号和换行"""
+    pairs = list(zip(names, values)) + list(extra.items())
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_metrics(metrics) -> str:
+    """按Prometheus文本格式输出指标"""
+    lines = []
+
+    def counter(name, help_text, label_names, values, index=None):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for key, value in sorted(values.items()):
+            lines.append(f'{name}{prometheus_labels(label_names, key)} {value if index is None else value[index]}')
+
+    def histogram(name, help_text, label_names, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{prometheus_labels(label_names, key, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{prometheus_labels(label_names, key)} {counts[-1]:.6f}')
+            lines.append(f'{name}_count{prometheus_labels(label_names, key)} {cumulative}')
+
+    counter('calendar_http_requests_total', '请求数（按方法、路由、状态码）',
+            ('method', 'route', 'status'), metrics['requests'])
+    counter('calendar_http_rejected_total', '队列已满时直接返回503、未进入请求处理的连接数',
+            ('reason',), metrics.get('rejected') or {('queue_full',): 0})
+    counter('calendar_http_request_bytes_total', '接收的字节数（含请求行和请求头）',
+            ('method', 'route'), metrics['transfer'], 0)
+    counter('calendar_http_response_bytes_total', '发送的字节数（含响应头）',
+            ('method', 'route'), metrics['transfer'], 1)
+    histogram('calendar_http_request_duration_seconds', '请求处理耗时（从读取请求到响应写完）',
+              ('method', 'route'), metrics['latency'])
+    histogram('calendar_http_request_phase_seconds', '请求中各阶段的耗时：db（执行语句和取数）、auth（认证）、serialize（JSON序列化）',
+              ('route', 'phase'), metrics['phases'])
+    return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+# ==================== 请求剖析 ====================
+
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')  # 每次剖析结束后写出的结果文件
+PROFILE_SIGNAL_SECONDS = float(os.getenv('CALENDAR_PROFILE_SIGNAL_SECONDS', '30'))  # SIGUSR2触发的剖析时长（秒）
+PROFILE_MAX_SECONDS = 600  # 单次剖析的最长时间（秒）
+PROFILE_DEFAULT_INTERVAL = 0.005  # 栈采样间隔（秒）
+
+
+class ProfileSession:
+    """一次剖析：按路由汇总的cProfile统计或折叠栈采样计数"""
+
+    def __init__(self, mode, requests, seconds, route, interval, source):
+        self.mode = mode
+        self.requests_limit = requests
+        self.seconds = seconds
+        self.route = route
+        self.interval = interval
+        self.source = source
+        self.started_at = datetime.now().isoformat()
+        self.ended_at = None
+        self.deadline = time.monotonic() + seconds
+        self.requests_profiled = 0
+        self.skipped = 0
+        self.samples = 0
+        self.stacks = {}   # 折叠栈 -> 采样次数
+        self.stats = {}    # 路由 -> pstats.Stats
+        self.threads = {}  # 线程ID -> 正在处理的路由
+        self.files = []
+
+
+class RequestProfiler:
+    """按需开启的请求剖析
+
+    sample模式由后台线程定期读取sys._current_frames()，只记录正在处理请求的线程，
+    输出可直接生成火焰图的折叠栈；cprofile模式在处理请求的线程上启用cProfile，按路由汇总为pstats。
+    达到请求数或时长后自动结束，结果保留在内存中并写到PROFILE_DIR。
+    未开启时请求处理只多一次属性判断。
+    """
+
+    def __init__(self):
+        self.active = False
+        self.session = None
+        self._lock = threading.Lock()
+
+    def start(self, mode='sample', requests=None, seconds=PROFILE_SIGNAL_SECONDS, route=None,
+              interval=PROFILE_DEFAULT_INTERVAL, source='api'):
+        if mode not in ('sample', 'cprofile'):
+            raise ValueError("mode 只支持 sample 或 cprofile")
+        with self._lock:
+            if self.active:
+                raise RuntimeError("已有剖析正在进行")
+            session = ProfileSession(mode, requests, min(seconds, PROFILE_MAX_SECONDS), route, interval, source)
+            self.session = session
+            self.active = True
+        threading.Thread(target=self._run, args=(session,), name='calendar-profiler', daemon=True).start()
+        return session
+
+    def stop(self):
+        with self._lock:
+            if self.active:
+                self._finish(self.session)
+
+    def enter(self, route):
+        """请求开始处理时调用，返回leave()需要的令牌；不在剖析范围内时返回None"""
+        session = self.session
+        if not self.active or session is None or (session.route and route != session.route):
+            return None
+        if session.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12起同一时间只能有一个cProfile处于启用状态
+                session.skipped += 1
+                return None
+            return session, route, profile
+        with self._lock:
+            session.threads[threading.get_ident()] = route
+        return session, route, None
+
+    def leave(self, token):
+        session, route, profile = token
+        if profile is not None:
+            profile.disable()
+            stats = pstats.Stats(profile)
+        with self._lock:
+            if profile is not None:
+                if route in session.stats:
+                    session.stats[route].add(stats)
+                else:
+                    session.stats[route] = stats
+            else:
+                session.threads.pop(threading.get_ident(), None)
+            session.requests_profiled += 1
+            if session.requests_limit and session.requests_profiled >= session.requests_limit and session is self.session:
+                self._finish(session)
+
+    def _run(self, session):
+        while self.active and session is self.session:
+            remaining = session.deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    if session is self.session:
+                        self._finish(session)
+                return
+            if session.mode == 'sample':
+                self._sample(session)
+                time.sleep(min(session.interval, remaining))
+            else:
+                time.sleep(min(0.5, remaining))
+
+    def _sample(self, session):
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(session.threads.items())
+        for ident, route in threads:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if not stack:
+                continue
+            key = ';'.join([route] + stack[::-1])
+            with self._lock:
+                session.stacks[key] = session.stacks.get(key, 0) + 1
+                session.samples += 1
+
+    def _finish(self, session):
+        """结束剖析并写出结果文件（调用方持有锁）"""
+        self.active = False
+        session.ended_at = datetime.now().isoformat()
+        session.threads.clear()
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{os.getpid()}"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if session.mode == 'sample':
+                path = os.path.join(PROFILE_DIR, f'{name}.collapsed')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(self.collapsed(session))
+            else:
+                path = os.path.join(PROFILE_DIR, f'{name}.pstats')
+                with open(path, 'wb') as f:
+                    f.write(self.pstats_data(session))
+            session.files.append(path)
+            print(f"剖析结束（{session.mode}，{session.requests_profiled} 个请求），结果已写入 {path}")
+        except OSError as e:
+            print(f"写出剖析结果失败：{e}")
+
+    def merged_stats(self, session, route=None):
+        stats = pstats.Stats()
+        for name, route_stats in session.stats.items():
+            if route is None or name == route:
+                stats.add(route_stats)
+        return stats
+
+    def collapsed(self, session, route=None) -> str:
+        """折叠栈格式（每行"路由;帧;帧... 次数"），可直接交给flamegraph.pl或speedscope"""
+        lines = [f'{stack} {count}' for stack, count in sorted(session.stacks.items(), key=lambda item: -item[1])
+                 if route is None or stack.split(';', 1)[0] == route]
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def pstats_data(self, session, route=None) -> bytes:
+        """与pstats.Stats.dump_stats()相同的二进制格式，可用pstats或snakeviz打开"""
+        return marshal.dumps(self.merged_stats(session, route).stats)
+
+    def stats_text(self, session, route=None, limit=40) -> str:
+        stream = io.StringIO()
+        stats = self.merged_stats(session, route)
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def status(self):
+        session = self.session
+        if session is None:
+            return {'active': False, 'pid': os.getpid()}
+        with self._lock:
+            if session.mode == 'cprofile':
+                routes = sorted(session.stats)
+            else:
+                routes = sorted({stack.split(';', 1)[0] for stack in session.stacks})
+        return {
+            'active': self.active,
+            'pid': os.getpid(),
+            'mode': session.mode,
+            'source': session.source,
+            'route': session.route,
+            'started_at': session.started_at,
+            'ended_at': session.ended_at,
+            'requests_limit': session.requests_limit,
+            'seconds': session.seconds,
+            'remaining_seconds': round(max(0.0, session.deadline - time.monotonic()), 1) if self.active else 0,
+            'requests_profiled': session.requests_profiled,
+            'skipped': session.skipped,
+            'samples': session.samples,
+            'routes': routes,
+            'files': session.files,
+        }
+
+
+request_profiler = RequestProfiler()
+
+
+_profile_signal_fd = None  # profile-signal线程等待的管道写端
+
+
+def install_profile_signal():
+    """安装SIGUSR2处理并启动profile-signal线程（每个服务进程调用一次）
+
+    信号处理函数在主线程中执行，而主线程可能正持有request_profiler的锁
+    （single模式下请求就在主线程处理），所以处理函数只向管道写一个字节，
+    由profile-signal线程读到后再开始剖析。
+    """
+    global _profile_signal_fd
+    if not hasattr(signal, 'SIGUSR2'):
+        return
+    read_fd, _profile_signal_fd = os.pipe()
+    os.set_blocking(_profile_signal_fd, False)
+    threading.Thread(target=_profile_signal_loop, args=(read_fd,), name='profile-signal', daemon=True).start()
+    signal.signal(signal.SIGUSR2, handle_profile_signal)
+
+
+def handle_profile_signal(signum, frame):
+    """SIGUSR2：通知profile-signal线程开始剖析（不获取任何锁）"""
+    try:
+        os.write(_profile_signal_fd, b'\0')
+    except OSError:
+        pass  # 管道已满说明已有未处理的通知
+
+
+def _profile_signal_loop(read_fd):
+    """对本进程的请求做PROFILE_SIGNAL_SECONDS秒栈采样（已在剖析时忽略）"""
+    while os.read(read_fd, 1):
+        try:
+            request_profiler.start('sample', seconds=PROFILE_SIGNAL_SECONDS, source='signal')
+            print(f"收到SIGUSR2，开始 {PROFILE_SIGNAL_SECONDS:g} 秒栈采样（进程 {os.getpid()}）")
+        except RuntimeError:
+            pass
+
 
 class CalendarRequestHandler(BaseHTTPRequestHandler):
     """HTTP请求处理器"""
     
+    # 所有响应都带Content-Length或分块编码，可以复用连接
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，关闭Nagle避免与客户端的延迟ACK互相等待
+    disable_nagle_algorithm = True
+    
+    # ==================== 持久连接 ====================
+    
+    def setup(self):
+        super().setup()
+        self.rfile = RequestBodyReader(self.rfile)
+        self.wfile = ResponseBodyWriter(self.wfile)
+        self.requests_handled = 0
+    
+    def handle(self):
+        """在同一连接上依次处理请求，直到客户端关闭、空闲超时或不再允许复用"""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.requests_handled += 1
+            self.finish_request_body()
+            if self.close_connection or not self.wait_for_request():
+                break
+            self.handle_one_request()
+    
+    def parse_request(self):
+        result = super().parse_request()
+        # 请求行和请求头已读完，之后读取的都是请求体
+        self.request_head_bytes = self.rfile.consumed
+        self.rfile.consumed = 0
+        if result and request_profiler.active:
+            self.profile_token = request_profiler.enter(metrics_route(self.path))
+        return result
+    
+    def handle_one_request(self):
+        """处理一个请求，记录路由、状态码、流量和各阶段耗时"""
+        self.command = None
+        self.response_status = None
+        self.request_head_bytes = 0
+        self.profile_token = None
+        self.rfile.consumed = 0
+        written = self.wfile.bytes_written
+        _request_phases.times = phases = {}
+        started = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            _request_phases.times = None
+            if self.profile_token is not None:
+                request_profiler.leave(self.profile_token)
+            if self.command and self.response_status is not None:
+                request_metrics.record(self.command, metrics_route(self.path), self.response_status,
+                                       time.perf_counter() - started,
+                                       self.request_head_bytes + self.rfile.consumed,
+                                       self.wfile.bytes_written - written, phases)
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def handle_expect_100(self):
+        """100 Continue是中间响应，不经过end_headers的连接管理"""
+        self.send_response_only(100)
+        super().end_headers()
+        return True
+    
+    def unread_body_length(self):
+        """当前请求还没有读取的请求体字节数"""
+        if getattr(self, 'headers', None) is None:
+            return 0
+        try:
+            length = int(self.headers.get('Content-Length', 0) or 0)
+        except ValueError:
+            return 0
+        return max(0, length - self.rfile.consumed)
+    
+    def keep_alive_allowed(self):
+        """响应结束后是否保持连接"""
+        if KEEPALIVE_TIMEOUT <= 0 or not isinstance(self.server, PooledHTTPServer):
+            return False
+        if self.requests_handled + 1 >= KEEPALIVE_MAX_REQUESTS:
+            return False
+        if 'chunked' in (self.headers.get('Transfer-Encoding') or '').lower():
+            return False
+        if self.unread_body_length() > KEEPALIVE_DRAIN_LIMIT:
+            return False
+        # 有连接在排队时把工作线程让出来
+        return self.server.queue_depth() == 0
+    
+    def end_headers(self):
+        """写出响应头前决定连接是否复用，并告知客户端"""
+        if not self.close_connection and not self.keep_alive_allowed():
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        else:
+            if self.request_version == 'HTTP/1.0':
+                self.send_header('Connection', 'keep-alive')
+            self.send_header('Keep-Alive', f'timeout={int(KEEPALIVE_TIMEOUT)}, '
+                                           f'max={KEEPALIVE_MAX_REQUESTS - self.requests_handled - 1}')
+        super().end_headers()
+    
+    def finish_request_body(self):
+        """读掉处理器没有读取的请求体，使连接停在下一个请求的开头"""
+        remaining = self.unread_body_length()
+        try:
+            while remaining > 0:
+                data = self.rfile.read(min(remaining, UPLOAD_CHUNK_SIZE))
+                if not data:
+                    self.close_connection = True
+                    break
+                remaining -= len(data)
+        except OSError:
+            self.close_connection = True
+    
+    def wait_for_request(self):
+        """等待同一连接上的下一个请求
+
+        空闲超过KEEPALIVE_TIMEOUT、服务器有排队连接或客户端关闭连接时返回False。
+        """
+        try:
+            # 缓冲区中已有数据（客户端流水线发送）时不用等待
+            self.connection.settimeout(0)
+            try:
+                if self.rfile.peek(1):
+                    return True
+            finally:
+                self.connection.settimeout(self.timeout)
+            deadline = time.monotonic() + KEEPALIVE_TIMEOUT
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.connection, selectors.EVENT_READ)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.server.queue_depth() > 0:
+                        return False
+                    if selector.select(min(remaining, KEEPALIVE_POLL_INTERVAL)):
+                        break
+            return bool(self.rfile.peek(1))
+        except (OSError, ValueError):
+            return False
+    
     # ==================== Session管理方法 ====================
     
     def get_session_token(self) -> Optional[str]:
@@ -92,41 +4219,26 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         
         return None
     
-    def validate_session(self, session_token: str) -> bool:
-        """验证session token是否有效"""
+    def resolve_session(self, session_token: str) -> Optional[Dict]:
+        """一次查找将session token解析为用户信息（优先走内存缓存）"""
         if not session_token:
-            return False
+            return None
         
         try:
-            conn = sqlite3.connect(SESSION_DB_PATH)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT session_token, expires_at 
-                FROM sessions 
-                WHERE session_token = ? AND (expires_at IS NULL OR expires_at > ?)
-            ''', (session_token, datetime.now().isoformat()))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                # 更新最后活动时间
-                conn = sqlite3.connect(SESSION_DB_PATH)
-                cursor = conn.cursor()
-                cursor.execute('''
-                    UPDATE sessions 
-                    SET last_activity = ? 
-                    WHERE session_token = ?
-                ''', (datetime.now().isoformat(), session_token))
-                conn.commit()
-                conn.close()
-                return True
-            
-            return False
+            return session_cache.resolve(session_token)
         except sqlite3.Error:
             # 数据库错误，回退到内存存储
-            return session_token in _sessions and _sessions[session_token].get('expires_at', 0) > time.time()
+            session = _sessions.get(session_token)
+            if session and session.get('expires_at', 0) > time.time():
+                return {
+                    'user_id': session['user_id'],
+                    'username': session['username']
+                }
+            return None
+    
+    def validate_session(self, session_token: str) -> bool:
+        """验证session token是否有效"""
+        return self.resolve_session(session_token) is not None
     
     def create_session(self, username: str, user_id: str = None) -> str:
         """创建新的session"""
@@ -138,24 +4250,24 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         expires_at = created_at + timedelta(seconds=SESSION_TIMEOUT)
         
         try:
-            conn = sqlite3.connect(SESSION_DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO sessions 
-                (session_token, user_id, username, created_at, last_activity, expires_at, user_agent, ip_address)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                session_token,
-                user_id,
-                username,
-                created_at.isoformat(),
-                created_at.isoformat(),
-                expires_at.isoformat(),
-                self.headers.get('User-Agent', ''),
-                self.headers.get('X-Real-IP', self.client_address[0])
-            ))
-            conn.commit()
-            conn.close()
+            with session_db_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO sessions 
+                    (session_token, user_id, username, created_at, last_activity, expires_at, user_agent, ip_address)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    session_token,
+                    user_id,
+                    username,
+                    created_at.isoformat(),
+                    created_at.isoformat(),
+                    expires_at.isoformat(),
+                    self.headers.get('User-Agent', ''),
+                    self.headers.get('X-Real-IP', self.client_address[0])
+                ))
+                conn.commit()
+            session_cache.put(session_token, {'user_id': user_id, 'username': username}, expires_at.isoformat())
         except sqlite3.Error as e:
             # 回退到内存存储
             _sessions[session_token] = {
@@ -171,12 +4283,11 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
     
     def delete_session(self, session_token: str):
         """删除session"""
+        session_cache.invalidate(session_token)
         try:
-            conn = sqlite3.connect(SESSION_DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM sessions WHERE session_token = ?', (session_token,))
-            conn.commit()
-            conn.close()
+            with session_db_pool.connection() as conn:
+                conn.execute('DELETE FROM sessions WHERE session_token = ?', (session_token,))
+                conn.commit()
         except sqlite3.Error:
             # 回退到内存存储
             if session_token in _sessions:
@@ -184,53 +4295,29 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
     
     def get_current_user(self) -> Optional[Dict]:
         """获取当前登录用户信息"""
-        session_token = self.get_session_token()
-        if not session_token or not self.validate_session(session_token):
-            return None
-        
-        try:
-            conn = sqlite3.connect(SESSION_DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT user_id, username 
-                FROM sessions 
-                WHERE session_token = ?
-            ''', (session_token,))
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                return {
-                    'user_id': result[0],
-                    'username': result[1]
-                }
-        except sqlite3.Error:
-            # 回退到内存存储
-            if session_token in _sessions:
-                return {
-                    'user_id': _sessions[session_token]['user_id'],
-                    'username': _sessions[session_token]['username']
-                }
-        
-        return None
+        return self.resolve_session(self.get_session_token())
     
     def check_auth(self):
-        """检查认证（兼容Basic Auth和Session）"""
-        # 首先检查session
-        if self.get_current_user() is not None:
-            return True
-        
-        # 向后兼容：检查Basic Auth（主要用于Nginx传递的认证）
-        auth_header = self.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Basic '):
-            encoded = auth_header.split(' ')[1]
-            try:
-                decoded = base64.b64decode(encoded).decode()
-                return decoded == f'{AUTH_USER}:{AUTH_PASS}'
-            except:
-                return False
-        
-        return False
+        """检查认证（兼容Basic Auth和Session），耗时计入auth阶段"""
+        started = time.perf_counter()
+        try:
+            # 首先检查session
+            if self.get_current_user() is not None:
+                return True
+            
+            # 向后兼容：检查Basic Auth（主要用于Nginx传递的认证）
+            auth_header = self.headers.get('Authorization')
+            if auth_header and auth_header.startswith('Basic '):
+                encoded = auth_header.split(' ')[1]
+                try:
+                    decoded = base64.b64decode(encoded).decode()
+                    return decoded == f'{AUTH_USER}:{AUTH_PASS}'
+                except:
+                    return False
+            
+            return False
+        finally:
+            add_phase_time('auth', time.perf_counter() - started)
     
     def require_auth(self):
         """要求认证"""
@@ -239,31 +4326,28 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         
         # API请求返回JSON错误
         if path.startswith('/api/'):
-            self.send_response(401)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            body = json.dumps({
                 'success': False,
                 'message': '需要登录',
                 'data': None,
                 'redirect': '/calendar/login.html'
-            }).encode())
+            }).encode()
+            self.send_response(401)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
             return False
         else:
             # HTML页面重定向到登录页面
             self.send_response(302)
             self.send_header('Location', '/calendar/login.html')
+            self.send_header('Content-Length', '0')
             self.end_headers()
             return False
     
-    def send_json_response(self, data, status_code=200, message="成功", success=None):
-        """发送JSON响应"""
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
-        
+    def send_json_response(self, data, status_code=200, message="成功", success=None, headers=None):
+        """发送JSON响应（headers为额外的响应头，如Set-Cookie）"""
         if success is None:
             success = status_code in [200, 201]
         
@@ -273,18 +4357,139 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             "data": data,
             "timestamp": datetime.now().isoformat()
         }
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+        started = time.perf_counter()
+        body = json.dumps(response, ensure_ascii=False).encode()
+        add_phase_time('serialize', time.perf_counter() - started)
+        
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_error_response(self, message, status_code=400):
+        """发送错误响应"""
+        self.send_json_response(None, status_code, message)
+    
+    def send_json_bytes(self, body: bytes, headers=None):
+        """发送已序列化好的JSON响应体"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_not_modified(self, headers):
+        """条件请求命中，返回304（不带响应体）；CORS头与200响应相同，跨域的条件请求才能使用缓存"""
+        self.send_response(304)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+    
+    def send_cached_json(self, conn, key, build, message="成功"):
+        """带ETag的事件列表响应
+
+        If-None-Match与当前版本的ETag一致时返回304；缓存中有当前版本的响应体时直接发送；
+        否则调用build()取得事件迭代器流式生成响应并写入缓存。
+        """
+        version = calendar_version(conn)
+        etag = response_etag(key, version)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_not_modified(headers)
+            return
+        
+        body = response_cache.get(key, version)
+        if body is not None:
+            self.send_json_bytes(body, headers)
+            return
+        
+        self.send_json_stream(build(), message, headers, cache_key=(key, version))
+    
+    def start_stream_response(self, content_type, headers=None):
+        """发送流式响应头，返回ChunkedWriter；HTTP/1.0客户端以关闭连接结束响应"""
+        chunked = self.request_version == 'HTTP/1.1'
+        if not chunked:
+            self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked)
     
-    def send_error_response(self, message, status_code=400):
-        """发送错误响应"""
-        self.send_json_response(None, status_code, message)
+    def send_json_stream(self, items, message="成功", headers=None, cache_key=None):
+        """流式发送列表响应：信封和每一项边序列化边写出，格式与send_json_response一致
+
+        第一项取出后立即发送响应头和首个分块；之后出错只能中断连接。
+        cache_key为(key, version)时，同时收集不超过缓存上限的响应体写入response_cache。
+        """
+        items = iter(items)
+        first = next(items, None)
+        
+        writer = self.start_stream_response('application/json; charset=utf-8', headers)
+        captured = [] if cache_key else None
+        captured_bytes = 0
+        serialize_time = 0.0
+        
+        def encode(item):
+            nonlocal serialize_time
+            started = time.perf_counter()
+            data = json.dumps(item, ensure_ascii=False).encode()
+            serialize_time += time.perf_counter() - started
+            return data
+        
+        def emit(data):
+            nonlocal captured, captured_bytes
+            writer.write(data)
+            if captured is not None:
+                captured.append(data)
+                captured_bytes += len(data)
+                if captured_bytes > response_cache.max_bytes:
+                    captured = None
+        
+        try:
+            emit(f'{{"success": true, "message": {json.dumps(message, ensure_ascii=False)}, "data": ['.encode())
+            if first is not None:
+                emit(encode(first))
+                writer.flush()
+                for item in items:
+                    emit(b', ' + encode(item))
+            emit(f'], "timestamp": "{datetime.now().isoformat()}"}}'.encode())
+            writer.close()
+            if captured is not None:
+                response_cache.put(cache_key[0], cache_key[1], b''.join(captured))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            # 不写结束分块并关闭连接，客户端会把响应视为不完整
+            self.close_connection = True
+            print(f"流式响应中断：{e}")
+        finally:
+            add_phase_time('serialize', serialize_time)
     
     def get_db_connection(self):
-        """获取数据库连接"""
+        """获取数据库连接（来自连接池，close()即归还）"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row  # 返回字典格式
-            return conn
+            return events_db_pool.acquire()
+        except PoolTimeout as e:
+            self.send_error_response(f"服务器繁忙：{str(e)}", 503)
+            return None
         except sqlite3.Error as e:
             self.send_error_response(f"数据库连接失败：{str(e)}", 500)
             return None
@@ -300,12 +4505,37 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
                 return {}
         return {}
     
-    def format_event(self, row):
-        """格式化事件数据"""
+    def iter_request_lines(self):
+        """按行流式读取请求体（受Content-Length限制），不把整个请求体读入内存
+
+        超过BULK_MAX_LINE的行读到行尾后丢弃，生成None，保持后续行号不变。
+        """
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            line = self.rfile.readline(min(remaining, BULK_MAX_LINE))
+            if not line:
+                break
+            remaining -= len(line)
+            if not line.endswith(b'\n') and remaining > 0:
+                while remaining > 0:
+                    fragment = self.rfile.readline(min(remaining, BULK_MAX_LINE))
+                    if not fragment:
+                        break
+                    remaining -= len(fragment)
+                    if fragment.endswith(b'\n'):
+                        break
+                yield None
+                continue
+            yield line.decode('utf-8', errors='replace')
+    
+    def format_event(self, row, participants=None):
+        """格式化事件数据（participants为已从event_participants取出的列表时直接使用）"""
         event = dict(row)
         
         # 处理参与者列表
-        if event.get('participants'):
+        if participants is not None:
+            event['participants'] = participants
+        elif event.get('participants'):
             event['participants'] = [p.strip() for p in event['participants'].split(',') if p.strip()]
         else:
             event['participants'] = []
@@ -315,6 +4545,79 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         
         return event
     
+    def load_participants(self, conn, rows):
+        """一次查询取出一批事件的参与者 {事件ID: [参与者, ...]}；迁移未完成时返回None"""
+        if not rows or not participants_migration.ready(conn):
+            return None
+        ids = [row['id'] for row in rows]
+        result = {event_id: [] for event_id in ids}
+        for event_id, participant in conn.execute(f'''
+            SELECT event_id, participant FROM event_participants
+            WHERE event_id IN ({', '.join(['?'] * len(ids))})
+            ORDER BY event_id, position
+        ''', ids):
+            result[event_id].append(participant)
+        return result
+    
+    def format_events(self, conn, rows):
+        """批量格式化事件，参与者通过一次查询取出"""
+        participants = self.load_participants(conn, rows)
+        if participants is None:
+            return [self.format_event(row) for row in rows]
+        return [self.format_event(row, participants[row['id']]) for row in rows]
+    
+    def iter_formatted_events(self, conn, cursor, batch_size=STREAM_BATCH_SIZE):
+        """分批读取游标并格式化事件"""
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from self.format_events(conn, rows)
+    
+    def format_occurrence(self, row, start, end, participants=None):
+        """格式化重复事件的一次发生（id仍为系列ID）"""
+        event = self.format_event(row, participants)
+        event['start_time'] = start.isoformat()
+        event['end_time'] = end.isoformat()
+        event['series_id'] = row['id']
+        event['occurrence_start'] = start.isoformat()
+        return event
+    
+    def iter_events_in_window(self, conn, start, end, conditions=(), params=()):
+        """按开始时间顺序生成与[start, end)相交的事件
+
+        普通事件从游标分批读取；重复事件（数量有限）先在窗口内展开，再与游标结果归并。
+        查询在调用时立即执行，错误可以在发送响应头之前抛出。
+        """
+        from_clause, where, where_params = events_overlap_query(start, end)
+        where = ["e.user_id = 1"] + where + list(conditions)
+        where_params = where_params + list(params)
+        
+        occurrences = []
+        if start and end:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT e.* FROM {from_clause} WHERE {' AND '.join(where + ['e.recurrence_rule IS NOT NULL'])}", where_params)
+            series = cursor.fetchall()
+            if series:
+                window_start = parse_event_time(start).replace(tzinfo=None)
+                window_end = parse_event_time(end).replace(tzinfo=None)
+                expanded = expand_series(conn, series, window_start, window_end)
+                participants = self.load_participants(conn, series) or {}
+                occurrences = sorted(
+                    (self.format_occurrence(row, s, e, participants.get(row['id']))
+                     for row in series for s, e in expanded[row['id']]),
+                    key=lambda event: event['start_time']
+                )
+            where = where + ['e.recurrence_rule IS NULL']
+        # 没有完整窗口时无法展开，返回系列本身
+        
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT e.* FROM {from_clause} WHERE {' AND '.join(where)} ORDER BY e.start_time ASC", where_params)
+        events = self.iter_formatted_events(conn, cursor)
+        if occurrences:
+            return heapq.merge(events, occurrences, key=lambda event: event['start_time'])
+        return events
+    
     def validate_event_data(self, data, is_update=False):
         """验证事件数据"""
         errors = []
@@ -353,6 +4656,13 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         if data.get('status') and data['status'] not in ['scheduled', 'in_progress', 'completed', 'cancelled']:
             errors.append("状态无效")
         
+        # 重复规则验证
+        if data.get('recurrence_rule'):
+            try:
+                parse_rrule(data['recurrence_rule'])
+            except ValueError as e:
+                errors.append(f"重复规则无效：{str(e)}")
+        
         return errors
     
     def do_GET(self):
@@ -380,10 +4690,32 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             self.handle_get_today_events()
         elif path == '/api/events/upcoming':
             self.handle_get_upcoming_events()
+        elif path == '/api/events/export':
+            self.handle_export_events(parsed_path)
+        elif path == '/api/events/search':
+            self.handle_search_events(parsed_path)
         elif path == '/api/uploads' or path == '/api/uploads/':
-            self.handle_get_file_list()
+            self.handle_get_file_list(parsed_path)
         elif path == '/api/generated-files' or path == '/api/generated-files/':
-            self.handle_get_generated_files()
+            self.handle_get_generated_files(parsed_path)
+        elif path.startswith('/api/upload/resumable/'):
+            self.handle_get_resumable_upload(path.split('/')[4])
+        elif path.startswith('/api/uploads/') and path.endswith('/preview'):
+            self.handle_get_file_preview(path.split('/')[3], parsed_path)
+        elif path.startswith('/api/uploads/'):
+            self.handle_download_file(path.split('/')[3])
+        elif path == '/api/freebusy' or path == '/api/freebusy/':
+            self.handle_get_freebusy(parsed_path)
+        elif path == '/api/slots' or path == '/api/slots/':
+            self.handle_get_slots(parsed_path)
+        elif path == '/api/stats' or path == '/api/stats/':
+            self.handle_get_stats()
+        elif path == '/api/metrics' or path == '/api/metrics/':
+            self.handle_get_metrics()
+        elif path == '/api/profile' or path == '/api/profile/':
+            self.handle_get_profile(parsed_path)
+        elif path == '/api/queries' or path == '/api/queries/':
+            self.handle_get_queries(parsed_path)
         elif path.startswith('/api/events/'):
             try:
                 event_id = int(path.split('/')[-1])
@@ -402,10 +4734,12 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         """处理OPTIONS请求，用于CORS预检"""
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, Upload-Offset, Upload-Checksum')
+        self.send_header('Access-Control-Expose-Headers', 'Upload-Offset, Upload-Length')
         self.send_header('Access-Control-Allow-Credentials', 'true')
         self.send_header('Access-Control-Max-Age', '86400')  # 24小时
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def do_POST(self):
@@ -430,10 +4764,18 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         
         if self.path == '/api/events' or self.path == '/api/events/':
             self.handle_create_event()
+        elif self.path == '/api/events/bulk' or self.path == '/api/events/bulk/':
+            self.handle_bulk_import()
         elif self.path == '/api/upload' or self.path == '/api/upload/':
             self.handle_file_upload()
         elif self.path == '/api/upload_base64' or self.path == '/api/upload_base64/':
             self.handle_base64_upload()
+        elif self.path == '/api/upload/resumable' or self.path == '/api/upload/resumable/':
+            self.handle_create_resumable_upload()
+        elif self.path.startswith('/api/upload/resumable/') and self.path.rstrip('/').endswith('/complete'):
+            self.handle_complete_resumable_upload(self.path.split('/')[4])
+        elif self.path == '/api/profile' or self.path == '/api/profile/':
+            self.handle_start_profile()
         else:
             self.send_error_response("请求路径无效", 404)
     
@@ -443,12 +4785,19 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             self.require_auth()
             return
         
-        if self.path.startswith('/api/events/'):
+        parsed_path = urlparse(self.path)
+        if parsed_path.path.startswith('/api/events/'):
             try:
-                event_id = int(self.path.split('/')[-1])
-                self.handle_update_event(event_id)
+                event_id = int(parsed_path.path.split('/')[-1])
             except ValueError:
                 self.send_error_response("无效的事件ID", 400)
+                return
+            # ?occurrence= 只修改重复事件中的某一次
+            occurrence = parse_qs(parsed_path.query).get('occurrence', [None])[0]
+            if occurrence:
+                self.handle_update_occurrence(event_id, occurrence)
+            else:
+                self.handle_update_event(event_id)
         else:
             self.send_error_response("请求路径无效", 404)
     
@@ -458,12 +4807,24 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             self.require_auth()
             return
         
-        if self.path.startswith('/api/events/'):
+        parsed_path = urlparse(self.path)
+        if parsed_path.path.startswith('/api/events/'):
             try:
-                event_id = int(self.path.split('/')[-1])
-                self.handle_delete_event(event_id)
+                event_id = int(parsed_path.path.split('/')[-1])
             except ValueError:
                 self.send_error_response("无效的事件ID", 400)
+                return
+            # ?occurrence= 只删除重复事件中的某一次
+            occurrence = parse_qs(parsed_path.query).get('occurrence', [None])[0]
+            if occurrence:
+                self.handle_delete_occurrence(event_id, occurrence)
+            else:
+                self.handle_delete_event(event_id)
+        elif parsed_path.path.startswith('/api/upload/resumable/'):
+            self.handle_cancel_resumable_upload(parsed_path.path.split('/')[4])
+        elif parsed_path.path == '/api/profile' or parsed_path.path == '/api/profile/':
+            request_profiler.stop()
+            self.send_json_response(request_profiler.status(), message="剖析已停止")
         elif self.path.startswith('/api/uploads/'):
             # 删除文件
             filename = self.path.split('/')[-1]
@@ -474,45 +4835,127 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         else:
             self.send_error_response("请求路径无效", 404)
     
-    def serve_static_file(self, filename):
-        """服务静态文件"""
+    def do_PATCH(self):
+        """处理PATCH请求（断点续传分块）"""
+        if not self.check_auth():
+            self.require_auth()
+            return
+        
+        path = urlparse(self.path).path
+        if path.startswith('/api/upload/resumable/'):
+            self.handle_patch_resumable_upload(path.split('/')[4])
+        else:
+            self.send_error_response("请求路径无效", 404)
+    
+    def serve_static_file(self, filename, root=BASE_DIR):
+        """服务静态文件（filename相对于root）
+
+        支持ETag/Last-Modified条件请求、单段Range、预压缩的gzip/brotli页面；
+        小文件从内存缓存发送，大文件用os.sendfile零拷贝发送。
+        """
         try:
-            filepath = os.path.join(BASE_DIR, filename)
+            filepath = os.path.realpath(os.path.join(root, filename))
             
-            if not os.path.exists(filepath):
+            # 防止路径遍历：只允许root下的文件
+            if not filepath.startswith(os.path.realpath(root) + os.sep) or not os.path.isfile(filepath):
                 self.send_error_response("文件不存在", 404)
                 return
             
-            # 根据文件类型设置Content-Type
-            if filename.endswith('.html'):
-                content_type = 'text/html; charset=utf-8'
-            elif filename.endswith('.css'):
-                content_type = 'text/css'
-            elif filename.endswith('.js'):
-                content_type = 'application/javascript'
-            elif filename.endswith('.png'):
-                content_type = 'image/png'
-            elif filename.endswith('.jpg') or filename.endswith('.jpeg'):
-                content_type = 'image/jpeg'
-            elif filename.endswith('.xlsx') or filename.endswith('.xls'):
-                content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            elif filename.endswith('.txt') or filename.endswith('.md') or filename.endswith('.log') or filename.endswith('.csv'):
-                content_type = 'text/plain; charset=utf-8'
+            entry = static_cache.lookup(filepath, os.stat(filepath))
+            cache_control = 'private, no-cache' if filepath.endswith('.html') else f'private, max-age={STATIC_MAX_AGE}'
+            
+            # 条件请求：If-None-Match优先于If-Modified-Since
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match:
+                not_modified = etag_matches(if_none_match.replace('-gzip"', '"').replace('-br"', '"'), entry.etag)
             else:
-                content_type = 'application/octet-stream'  # 二进制流，适合未知文件类型
+                not_modified = self.headers.get('If-Modified-Since') == entry.last_modified
+            if not_modified:
+                self.send_response(304)
+                self.send_header('ETag', entry.etag)
+                self.send_header('Last-Modified', entry.last_modified)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+            
+            byte_range = None
+            if_range = self.headers.get('If-Range')
+            if not if_range or if_range in (entry.etag, entry.last_modified):
+                byte_range = parse_range(self.headers.get('Range'), entry.size)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{entry.size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
             
-            with open(filepath, 'rb') as f:
-                content = f.read()
+            # 压缩版本只用于完整响应
+            encoding = None
+            if entry.variants and byte_range is None:
+                accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+                encoding = next((name for name in ('br', 'gzip') if name in entry.variants and name in accepted), None)
+            
+            if byte_range:
+                start, end = byte_range
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{entry.size}')
+            else:
+                start, end = 0, entry.size - 1
+                self.send_response(200)
+            self.send_header('Content-Type', entry.content_type)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Last-Modified', entry.last_modified)
+            self.send_header('Cache-Control', cache_control)
+            if entry.variants:
+                self.send_header('Vary', 'Accept-Encoding')
+            if encoding:
+                body = entry.variants[encoding]
+                self.send_header('Content-Encoding', encoding)
+                self.send_header('ETag', entry.etag[:-1] + f'-{encoding}"')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
             
-            self.send_response(200)
-            self.send_header('Content-Type', content_type)
-            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', entry.etag)
+            self.send_header('Content-Length', str(end - start + 1))
             self.end_headers()
-            self.wfile.write(content)
+            if entry.body is not None:
+                self.wfile.write(entry.body[start:end + 1])
+            else:
+                self.send_file_range(filepath, start, end - start + 1)
             
+        except (BrokenPipeError, ConnectionResetError):
+            pass
         except Exception as e:
             self.send_error_response(f"读取文件失败：{str(e)}", 500)
     
+    def send_file_range(self, filepath, offset, count):
+        """用os.sendfile把文件的一段直接写入socket，不可用时回退到分块读写"""
+        with open(filepath, 'rb') as f:
+            if hasattr(os, 'sendfile'):
+                try:
+                    sock_fd = self.connection.fileno()
+                    while count > 0:
+                        sent = os.sendfile(sock_fd, f.fileno(), offset, count)
+                        if sent == 0:
+                            break
+                        self.wfile.bytes_written += sent
+                        offset += sent
+                        count -= sent
+                    return
+                except (AttributeError, OSError) as e:
+                    if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                        raise
+            # pread不依赖文件位置，线程池中的并发Range请求互不影响
+            while count > 0:
+                chunk = os.pread(f.fileno(), min(count, 64 * 1024), offset)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                offset += len(chunk)
+                count -= len(chunk)
+    
     # ==================== Session处理相关方法 ====================
     
     def handle_login(self):
@@ -531,25 +4974,11 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
                 expires = datetime.now() + timedelta(seconds=SESSION_TIMEOUT)
                 cookie = f'{SESSION_COOKIE_NAME}={session_token}; Path=/; HttpOnly; SameSite=Lax; Expires={expires.strftime("%a, %d %b %Y %H:%M:%S GMT")}'
                 
-                # 手动发送响应，以便设置cookie
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json; charset=utf-8')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-                self.send_header('Set-Cookie', cookie)
-                self.end_headers()
-                
-                response = {
-                    "success": True,
-                    "message": "登录成功",
-                    "data": {
-                        'session_token': session_token,
-                        'username': username,
-                        'expires_at': expires.isoformat()
-                    },
-                    "timestamp": datetime.now().isoformat()
-                }
-                self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+                self.send_json_response({
+                    'session_token': session_token,
+                    'username': username,
+                    'expires_at': expires.isoformat()
+                }, 200, "登录成功", headers={'Set-Cookie': cookie})
             else:
                 self.send_error_response("用户名或密码错误", 401)
                 
@@ -566,20 +4995,7 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         if session_token:
             self.delete_session(session_token)
         
-        # 手动发送响应，以便设置cookie
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Set-Cookie', cookie)
-        self.end_headers()
-        
-        response = {
-            "success": True,
-            "message": "已登出",
-            "data": None,
-            "timestamp": datetime.now().isoformat()
-        }
-        self.wfile.write(json.dumps(response, ensure_ascii=False).encode())
+        self.send_json_response(None, 200, "已登出", headers={'Set-Cookie': cookie})
     
     def handle_check_session(self):
         """检查session状态"""
@@ -608,31 +5024,167 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             start_date = query_params.get('start', [None])[0]
             end_date = query_params.get('end', [None])[0]
             event_type = query_params.get('type', [None])[0]
+            participant = (query_params.get('participant', [''])[0]).strip() or None
             
-            # 构建查询
-            query = "SELECT * FROM events WHERE user_id = 1"
-            params = []
+            # 返回与[start, end)有交集的事件，重复事件展开为窗口内的每一次发生
+            for value in (start_date, end_date):
+                if value:
+                    try:
+                        parse_event_time(value)
+                    except ValueError:
+                        self.send_error_response("start/end 时间格式无效", 400)
+                        return
             
-            if start_date:
-                query += " AND start_time >= ?"
-                params.append(start_date)
-            if end_date:
-                query += " AND end_time <= ?"
-                params.append(end_date)
+            conditions = []
+            params = []
             if event_type:
-                query += " AND event_type = ?"
+                conditions.append("e.event_type = ?")
                 params.append(event_type)
+            if participant:
+                # 迁移完成后走idx_event_participants_name索引
+                condition, condition_params = participant_condition(conn, [participant])
+                conditions.append(condition)
+                params.extend(condition_params)
+            
+            key = ('events', 1,
+                   parse_event_time(start_date).isoformat() if start_date else None,
+                   parse_event_time(end_date).isoformat() if end_date else None,
+                   event_type, participant.lower() if participant else None)
+            self.send_cached_json(conn, key, lambda: self.iter_events_in_window(
+                conn, start_date, end_date, conditions, params))
+            
+        except Exception as e:
+            self.send_error_response(f"查询事件失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_bulk_import(self):
+        """批量导入事件（NDJSON或iCalendar，按批次事务插入）"""
+        content_type = self.headers.get('Content-Type', '')
+        if 'text/calendar' in content_type:
+            records = iter_ics_events(self.iter_request_lines())
+        elif 'ndjson' in content_type or 'jsonlines' in content_type or 'application/json' in content_type:
+            records = iter_ndjson_events(self.iter_request_lines())
+        else:
+            self.send_error_response("不支持的Content-Type，请使用application/x-ndjson或text/calendar", 400)
+            return
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        total = 0
+        imported = 0
+        failed = 0
+        errors = []
+        columns = None
+        batch = []
+        
+        def flush():
+            nonlocal imported
+            if batch:
+                conn.executemany(
+                    f"INSERT INTO events ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+                    batch
+                )
+                conn.commit()
+                imported += len(batch)
+                batch.clear()
+        
+        try:
+            for line_no, event_data, error in records:
+                total += 1
+                if error is None:
+                    try:
+                        validation_errors = self.validate_event_data(event_data)
+                        if validation_errors:
+                            error = "; ".join(validation_errors)
+                        else:
+                            insert_data = self.event_insert_data(event_data)
+                    except Exception as e:
+                        error = f"数据无效：{str(e)}"
+                if error is not None:
+                    failed += 1
+                    if len(errors) < BULK_MAX_ERRORS:
+                        errors.append({'line': line_no, 'error': error})
+                    continue
+                
+                if columns is None:
+                    columns = list(insert_data.keys())
+                batch.append([insert_data[column] for column in columns])
+                if len(batch) >= BULK_BATCH_SIZE:
+                    flush()
+            flush()
             
-            query += " ORDER BY start_time ASC"
+            self.send_json_response({
+                'total': total,
+                'imported': imported,
+                'failed': failed,
+                'errors': errors
+            }, message="批量导入完成")
             
+        except Exception as e:
+            conn.rollback()
+            self.send_error_response(f"批量导入失败（已导入{imported}条）：{str(e)}", 500)
+        finally:
+            conn.close()
+            if imported:
+                reminder_scheduler.reload()
+    
+    def handle_export_events(self, parsed_path):
+        """导出事件（NDJSON或iCalendar），边读游标边输出"""
+        query_params = parse_qs(parsed_path.query)
+        export_format = query_params.get('format', ['ndjson'])[0]
+        start_date = query_params.get('start', [None])[0]
+        end_date = query_params.get('end', [None])[0]
+        
+        if export_format not in ('ndjson', 'ics'):
+            self.send_error_response("format 只支持 ndjson 或 ics", 400)
+            return
+        try:
+            # 导出系列本身，不展开重复事件
+            from_clause, conditions, params = events_overlap_query(start_date, end_date)
+        except ValueError:
+            self.send_error_response("start/end 时间格式无效", 400)
+            return
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        headers_sent = False
+        try:
+            conditions.insert(0, "e.user_id = 1")
             cursor = conn.cursor()
-            cursor.execute(query, params)
-            events = [self.format_event(row) for row in cursor.fetchall()]
+            cursor.execute(f"SELECT e.* FROM {from_clause} WHERE {' AND '.join(conditions)} ORDER BY e.start_time ASC", params)
+            
+            if export_format == 'ics':
+                writer = self.start_stream_response('text/calendar; charset=utf-8', {
+                    'Content-Disposition': 'attachment; filename="calendar.ics"'})
+            else:
+                writer = self.start_stream_response('application/x-ndjson; charset=utf-8', {
+                    'Content-Disposition': 'attachment; filename="events.ndjson"'})
+            headers_sent = True
             
-            self.send_json_response(events)
+            if export_format == 'ics':
+                writer.write(b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//calendar-management-system//CN\r\n')
+            for event in self.iter_formatted_events(conn, cursor):
+                if export_format == 'ics':
+                    writer.write(event_to_ics(event).encode('utf-8'))
+                else:
+                    writer.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+            if export_format == 'ics':
+                writer.write(b'END:VCALENDAR\r\n')
+            writer.close()
             
+        except (BrokenPipeError, ConnectionResetError):
+            pass
         except Exception as e:
-            self.send_error_response(f"查询事件失败：{str(e)}", 500)
+            if not headers_sent:
+                self.send_error_response(f"导出事件失败：{str(e)}", 500)
+            else:
+                # 响应头已发出时只能中断连接
+                self.close_connection = True
         finally:
             conn.close()
     
@@ -658,6 +5210,26 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         finally:
             conn.close()
     
+    def event_insert_data(self, event_data):
+        """根据请求数据生成INSERT的字段（未提供的字段使用默认值）"""
+        recurrence_rule = event_data.get('recurrence_rule') or None
+        return {
+            'user_id': 1,
+            'title': event_data.get('title', ''),
+            'description': event_data.get('description', ''),
+            'event_type': event_data.get('event_type', 'work'),
+            'start_time': event_data.get('start_time'),
+            'end_time': event_data.get('end_time'),
+            'location': event_data.get('location', ''),
+            'participants': ', '.join(event_data.get('participants', [])) if isinstance(event_data.get('participants'), list) else event_data.get('participants', ''),
+            'status': event_data.get('status', 'scheduled'),
+            'reminder_minutes': event_data.get('reminder_minutes', 15),
+            'is_all_day': 1 if event_data.get('is_all_day') else 0,
+            'recurrence_rule': recurrence_rule,
+            'recurrence_end': recurrence_end_for(event_data['start_time'], event_data['end_time'], recurrence_rule) if recurrence_rule else None,
+            'updated_at': datetime.now().isoformat()
+        }
+    
     def handle_create_event(self):
         """创建新事件"""
         conn = self.get_db_connection()
@@ -674,20 +5246,7 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
                 return
             
             # 准备插入数据
-            insert_data = {
-                'user_id': 1,
-                'title': event_data.get('title', ''),
-                'description': event_data.get('description', ''),
-                'event_type': event_data.get('event_type', 'work'),
-                'start_time': event_data.get('start_time'),
-                'end_time': event_data.get('end_time'),
-                'location': event_data.get('location', ''),
-                'participants': ', '.join(event_data.get('participants', [])) if isinstance(event_data.get('participants'), list) else event_data.get('participants', ''),
-                'status': event_data.get('status', 'scheduled'),
-                'reminder_minutes': event_data.get('reminder_minutes', 15),
-                'is_all_day': 1 if event_data.get('is_all_day') else 0,
-                'updated_at': datetime.now().isoformat()
-            }
+            insert_data = self.event_insert_data(event_data)
             
             # 执行插入
             columns = ', '.join(insert_data.keys())
@@ -699,6 +5258,7 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             event_id = cursor.lastrowid
             
             conn.commit()
+            reminder_scheduler.notify(event_id)
             
             # 返回创建的事件
             cursor.execute("SELECT * FROM events WHERE id = ?", (event_id,))
@@ -722,7 +5282,8 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             # 检查事件是否存在
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM events WHERE id = ? AND user_id = 1", (event_id,))
-            if not cursor.fetchone():
+            existing = cursor.fetchone()
+            if not existing:
                 self.send_error_response(f"事件ID {event_id} 不存在", 404)
                 return
             
@@ -734,28 +5295,14 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
                 self.send_error_response("; ".join(errors), 400)
                 return
             
-            # 准备更新数据
-            update_fields = []
-            update_values = []
-            
-            allowed_fields = ['title', 'description', 'event_type', 'start_time', 'end_time', 
-                             'location', 'participants', 'status', 'reminder_minutes', 'is_all_day']
-            
-            for field in allowed_fields:
-                if field in event_data:
-                    if field == 'participants' and isinstance(event_data[field], list):
-                        update_fields.append(f"{field} = ?")
-                        update_values.append(', '.join(event_data[field]))
-                    elif field == 'is_all_day':
-                        update_fields.append(f"{field} = ?")
-                        update_values.append(1 if event_data[field] else 0)
-                    else:
-                        update_fields.append(f"{field} = ?")
-                        update_values.append(event_data[field])
+            update_fields, update_values = self.event_update_fields(event_data)
             
-            # 添加更新时间
-            update_fields.append("updated_at = ?")
-            update_values.append(datetime.now().isoformat())
+            # 时间或重复规则变化后重新计算系列的结束时间（在开始写事务之前）
+            if {'start_time', 'end_time', 'recurrence_rule'} & set(event_data):
+                merged = {field: event_data.get(field, existing[field]) for field in ('start_time', 'end_time', 'recurrence_rule')}
+                update_fields.append("recurrence_end = ?")
+                update_values.append(recurrence_end_for(merged['start_time'], merged['end_time'], merged['recurrence_rule'])
+                                     if merged['recurrence_rule'] else None)
             
             # 执行更新
             update_values.append(event_id)
@@ -763,6 +5310,8 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             
             cursor.execute(update_query, update_values)
             conn.commit()
+            recurrence_cache.invalidate(event_id)
+            reminder_scheduler.notify(event_id)
             
             # 返回更新后的事件
             cursor.execute("SELECT * FROM events WHERE id = ? AND user_id = 1", (event_id,))
@@ -776,6 +5325,162 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         finally:
             conn.close()
     
+    def event_update_fields(self, event_data):
+        """根据请求数据生成UPDATE的字段列表和参数"""
+        update_fields = []
+        update_values = []
+        
+        allowed_fields = ['title', 'description', 'event_type', 'start_time', 'end_time', 
+                         'location', 'participants', 'status', 'reminder_minutes', 'is_all_day',
+                         'recurrence_rule']
+        
+        for field in allowed_fields:
+            if field in event_data:
+                if field == 'participants' and isinstance(event_data[field], list):
+                    update_fields.append(f"{field} = ?")
+                    update_values.append(', '.join(event_data[field]))
+                elif field == 'is_all_day':
+                    update_fields.append(f"{field} = ?")
+                    update_values.append(1 if event_data[field] else 0)
+                elif field == 'recurrence_rule':
+                    update_fields.append(f"{field} = ?")
+                    update_values.append(event_data[field] or None)
+                else:
+                    update_fields.append(f"{field} = ?")
+                    update_values.append(event_data[field])
+        
+        # 添加更新时间
+        update_fields.append("updated_at = ?")
+        update_values.append(datetime.now().isoformat())
+        
+        return update_fields, update_values
+    
+    def find_occurrence(self, cursor, series_id, occurrence):
+        """校验某次发生是否属于重复事件系列，返回(系列行, 规范化后的发生时间)；无效时已发送错误响应"""
+        cursor.execute("SELECT * FROM events WHERE id = ? AND user_id = 1", (series_id,))
+        series = cursor.fetchone()
+        if not series:
+            self.send_error_response(f"事件ID {series_id} 不存在", 404)
+            return None, None
+        if not series['recurrence_rule']:
+            self.send_error_response(f"事件ID {series_id} 不是重复事件", 400)
+            return None, None
+        
+        try:
+            # 查询串中未编码的'+'会被解析成空格
+            occurrence_dt = parse_event_time(occurrence.replace(' ', '+'))
+        except ValueError:
+            self.send_error_response("occurrence 时间格式无效", 400)
+            return None, None
+        
+        dtstart = parse_event_time(series['start_time'])
+        target = occurrence_dt.replace(tzinfo=None)
+        for candidate in iter_occurrences(dtstart, parse_rrule(series['recurrence_rule']), target):
+            naive = candidate.replace(tzinfo=None)
+            if naive == target:
+                cursor.execute("SELECT 1 FROM event_exdates WHERE event_id = ? AND original_start = ?",
+                               (series_id, candidate.isoformat()))
+                if cursor.fetchone():
+                    break
+                return series, candidate.isoformat()
+            if naive > target:
+                break
+        self.send_error_response(f"事件ID {series_id} 在 {occurrence} 没有发生", 404)
+        return None, None
+    
+    def handle_update_occurrence(self, series_id, occurrence):
+        """修改重复事件中的某一次（创建或更新override）"""
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        try:
+            cursor = conn.cursor()
+            series, original_start = self.find_occurrence(cursor, series_id, occurrence)
+            if not series:
+                return
+            
+            event_data = self.parse_request_data()
+            event_data.pop('recurrence_rule', None)
+            errors = self.validate_event_data(event_data, is_update=True)
+            if errors:
+                self.send_error_response("; ".join(errors), 400)
+                return
+            
+            cursor.execute("SELECT id FROM events WHERE recurrence_id = ? AND recurrence_start = ? AND user_id = 1",
+                           (series_id, original_start))
+            existing = cursor.fetchone()
+            
+            if existing:
+                override_id = existing['id']
+                update_fields, update_values = self.event_update_fields(event_data)
+                update_values.append(override_id)
+                cursor.execute(f"UPDATE events SET {', '.join(update_fields)} WHERE id = ? AND user_id = 1", update_values)
+                status_code = 200
+            else:
+                # 以系列为模板复制出这一次发生
+                duration = parse_event_time(series['end_time']) - parse_event_time(series['start_time'])
+                override = {column: series[column] for column in (
+                    'user_id', 'title', 'description', 'event_type', 'location', 'participants',
+                    'status', 'reminder_minutes', 'is_all_day')}
+                override['start_time'] = original_start
+                override['end_time'] = (parse_event_time(original_start) + duration).isoformat()
+                update_fields, update_values = self.event_update_fields(event_data)
+                for field, value in zip(update_fields, update_values):
+                    override[field.split(' = ')[0]] = value
+                override['recurrence_id'] = series_id
+                override['recurrence_start'] = original_start
+                
+                columns = ', '.join(override.keys())
+                placeholders = ', '.join(['?'] * len(override))
+                cursor.execute(f"INSERT INTO events ({columns}) VALUES ({placeholders})", list(override.values()))
+                override_id = cursor.lastrowid
+                status_code = 201
+            
+            # 更新系列的updated_at，使其他进程中的展开缓存失效
+            cursor.execute("UPDATE events SET updated_at = ? WHERE id = ?", (datetime.now().isoformat(), series_id))
+            conn.commit()
+            recurrence_cache.invalidate(series_id)
+            reminder_scheduler.notify(override_id)
+            
+            cursor.execute("SELECT * FROM events WHERE id = ?", (override_id,))
+            self.send_json_response(self.format_event(cursor.fetchone()), status_code, "事件更新成功")
+            
+        except Exception as e:
+            conn.rollback()
+            self.send_error_response(f"更新事件失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_delete_occurrence(self, series_id, occurrence):
+        """删除重复事件中的某一次"""
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        try:
+            cursor = conn.cursor()
+            series, original_start = self.find_occurrence(cursor, series_id, occurrence)
+            if not series:
+                return
+            
+            cursor.execute("INSERT OR IGNORE INTO event_exdates (event_id, original_start) VALUES (?, ?)",
+                           (series_id, original_start))
+            cursor.execute("DELETE FROM events WHERE recurrence_id = ? AND recurrence_start = ? AND user_id = 1",
+                           (series_id, original_start))
+            cursor.execute("UPDATE events SET updated_at = ? WHERE id = ?", (datetime.now().isoformat(), series_id))
+            conn.commit()
+            recurrence_cache.invalidate(series_id)
+            
+            self.send_json_response({'series_id': series_id, 'occurrence_start': original_start},
+                                    message="事件删除成功")
+            
+        except Exception as e:
+            conn.rollback()
+            self.send_error_response(f"删除事件失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
     def handle_delete_event(self, event_id):
         """删除事件"""
         conn = self.get_db_connection()
@@ -784,8 +5489,23 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         
         try:
             cursor = conn.cursor()
+            cursor.execute("SELECT recurrence_id, recurrence_start FROM events WHERE id = ? AND user_id = 1", (event_id,))
+            row = cursor.fetchone()
             cursor.execute("DELETE FROM events WHERE id = ? AND user_id = 1", (event_id,))
+            
+            # 删除系列时一并删除其单次修改和例外
+            cursor.execute("DELETE FROM events WHERE recurrence_id = ? AND user_id = 1", (event_id,))
+            cursor.execute("DELETE FROM event_exdates WHERE event_id = ?", (event_id,))
+            
+            # 删除单次修改时，这一次发生也不再出现
+            if row and row['recurrence_id']:
+                cursor.execute("INSERT OR IGNORE INTO event_exdates (event_id, original_start) VALUES (?, ?)",
+                               (row['recurrence_id'], row['recurrence_start']))
+                cursor.execute("UPDATE events SET updated_at = ? WHERE id = ?",
+                               (datetime.now().isoformat(), row['recurrence_id']))
+                recurrence_cache.invalidate(row['recurrence_id'])
             conn.commit()
+            recurrence_cache.invalidate(event_id)
             
             self.send_json_response(None, message="事件删除成功")
             
@@ -795,6 +5515,222 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         finally:
             conn.close()
     
+    def handle_search_events(self, parsed_path):
+        """全文搜索：GET /api/events/search?q=&start=&end=&type=&limit=&cursor=
+
+        按bm25相关度排序（标题权重最高），每条结果带snippet（HTML转义，命中部分用<mark>标出）。
+        不少于3个字符的词走FTS5 trigram索引（子串/前缀匹配），更短的词在候选结果上用LIKE过滤；
+        可与start/end时间窗口组合（重复事件按整个系列匹配，不展开）。
+        分页：响应头X-Next-Cursor的值作为下一页的cursor参数。
+        """
+        query_params = parse_qs(parsed_path.query)
+        terms = parse_search_terms(query_params.get('q', [''])[0])
+        if not terms:
+            self.send_error_response("搜索词不能为空", 400)
+            return
+        try:
+            limit = int(query_params.get('limit', ['20'])[0])
+            if limit <= 0:
+                raise ValueError
+            limit = min(limit, SEARCH_MAX_LIMIT)
+            cursor_param = query_params.get('cursor', [None])[0]
+            after = decode_cursor(cursor_param) if cursor_param else None
+            # 搜索的cursor是(相关度, 事件ID)
+            if after is not None and not (isinstance(after[0], (int, float)) and isinstance(after[1], int)):
+                raise ValueError("无效的cursor")
+            start = query_params.get('start', [None])[0]
+            end = query_params.get('end', [None])[0]
+            from_clause, conditions, params = events_overlap_query(start, end)
+        except ValueError:
+            self.send_error_response("limit、cursor或时间参数无效", 400)
+            return
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        try:
+            conditions = ['e.user_id = 1'] + conditions
+            event_type = query_params.get('type', [None])[0]
+            if event_type:
+                conditions.append('e.event_type = ?')
+                params.append(event_type)
+            
+            long_terms = [t for t in terms if len(t) >= SEARCH_MIN_TERM] if events_fts_enabled else []
+            # 短词走events_fts_chars；只有标点等无法分词的短词，或FTS不可用时才用LIKE
+            short_terms = [t for t in terms if t not in long_terms and events_fts_enabled and re.search(r'\w', t)]
+            like_terms = [t for t in terms if t not in long_terms and t not in short_terms]
+            for term in like_terms:
+                conditions.append('(' + ' OR '.join(f"e.{c} LIKE ? ESCAPE '\\'" for c in SEARCH_COLUMNS) + ')')
+                params.extend([like_pattern(term)] * len(SEARCH_COLUMNS))
+            if short_terms:
+                # 还没同步到events_fts_chars的事件（刚写入的）在events_fts_chars_pending中，对它们用LIKE匹配；
+                # CROSS JOIN固定从队列出发，不扫描事件表
+                pending_like = ' AND '.join(
+                    '(' + ' OR '.join(f"x.{c} LIKE ? ESCAPE '\\'" for c in SEARCH_COLUMNS) + ')' for _ in short_terms)
+                conditions.append(f'''e.id IN (
+                    SELECT rowid FROM events_fts_chars WHERE events_fts_chars MATCH ?
+                        AND rowid NOT IN (SELECT event_id FROM events_fts_chars_pending)
+                    UNION
+                    SELECT x.id FROM events_fts_chars_pending p CROSS JOIN events x ON x.id = p.event_id WHERE {pending_like}
+                )''')
+                params.append(' AND '.join(search_chars_phrase(t) for t in short_terms))
+                for term in short_terms:
+                    params.extend([like_pattern(term)] * len(SEARCH_COLUMNS))
+            
+            if long_terms:
+                from_clause = f'events_fts f JOIN {from_clause}'
+                rank_sql = f'bm25(events_fts, {SEARCH_WEIGHTS})'
+                snippet_sql = f"snippet(events_fts, -1, char(2), char(3), '…', {SEARCH_SNIPPET_TOKENS})"
+                conditions = ['events_fts MATCH ?', 'e.id = f.rowid'] + conditions
+                params = [' AND '.join(fts_phrase(t) for t in long_terms)] + params
+            else:
+                rank_sql = '0.0'
+                snippet_sql = 'NULL'
+            if after is not None:
+                conditions.append(f'({rank_sql}, e.id) > (?, ?)')
+                params.extend(after[:2])
+            
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT e.*, {rank_sql} AS search_rank, {snippet_sql} AS search_snippet
+                FROM {from_clause}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY search_rank, e.id
+                LIMIT {limit + 1}
+            ''', params)
+            rows = cursor.fetchall()
+            
+            headers = {}
+            if len(rows) > limit:
+                rows = rows[:limit]
+                headers['X-Next-Cursor'] = encode_cursor([rows[-1]['search_rank'], rows[-1]['id']])
+            
+            results = []
+            for row, event in zip(rows, self.format_events(conn, rows)):
+                event.pop('search_rank')
+                event.pop('search_snippet')
+                event['rank'] = row['search_rank']
+                event['snippet'] = render_snippet(row['search_snippet'] or fallback_snippet(row, terms))
+                results.append(event)
+            self.send_json_stream(iter(results), message="搜索成功", headers=headers)
+        except sqlite3.OperationalError as e:
+            self.send_error_response(f"搜索词无效：{str(e)}", 400)
+        except Exception as e:
+            self.send_error_response(f"搜索失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def busy_intervals(self, conn, window_start: int, window_end: int, participants=()):
+        """窗口内合并后的忙碌区间（排除已取消的事件，可按参与者过滤）
+
+        查询窗口向两侧各放宽一天（不超出datetime的范围），保证按整天计算的全天事件不会被漏掉。
+        """
+        conditions = ["e.status != 'cancelled'"]
+        params = []
+        if participants:
+            condition, condition_params = participant_condition(conn, participants)
+            conditions.append(condition)
+            params.extend(condition_params)
+        events = self.iter_events_in_window(
+            conn,
+            wall_datetime(max(window_start - 86400, WALL_EPOCH_MIN)).isoformat(),
+            wall_datetime(min(window_end + 86400, WALL_EPOCH_MAX)).isoformat(),
+            conditions, params
+        )
+        return merge_intervals((busy_interval(event) for event in events), window_start, window_end)
+    
+    def parse_participants(self, query_params):
+        value = query_params.get('participants', [''])[0]
+        return tuple(sorted({name.strip() for name in value.split(',') if name.strip()}))
+    
+    def parse_window(self, start, end):
+        """校验时间窗口，返回(开始, 结束)的墙上epoch秒；无效时已发送错误响应，返回None"""
+        try:
+            window_start, window_end = event_wall_epoch(start), event_wall_epoch(end)
+        except (TypeError, ValueError):
+            self.send_error_response("时间格式无效，应为ISO格式", 400)
+            return None
+        if window_end <= window_start:
+            self.send_error_response("结束时间必须晚于开始时间", 400)
+            return None
+        if window_end - window_start > FREEBUSY_MAX_DAYS * 86400:
+            self.send_error_response(f"时间窗口不能超过{FREEBUSY_MAX_DAYS}天", 400)
+            return None
+        return window_start, window_end
+    
+    def handle_get_freebusy(self, parsed_path):
+        """忙碌时间：GET /api/freebusy?start=&end=&participants=a,b
+
+        返回合并后的忙碌区间 [[开始, 结束], ...]；结果按日历版本缓存，下次写入后失效。
+        """
+        query_params = parse_qs(parsed_path.query)
+        start = query_params.get('start', [None])[0]
+        end = query_params.get('end', [None])[0]
+        if not start or not end:
+            self.send_error_response("start和end不能为空", 400)
+            return
+        window = self.parse_window(start, end)
+        if window is None:
+            return
+        participants = self.parse_participants(query_params)
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        try:
+            self.send_cached_json(
+                conn, ('freebusy', 1, window, participants),
+                lambda: map(format_interval, self.busy_intervals(conn, *window, participants)),
+                message="获取忙碌时间成功"
+            )
+        except Exception as e:
+            self.send_error_response(f"获取忙碌时间失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_get_slots(self, parsed_path):
+        """空闲时间段：GET /api/slots?duration=30&within=开始/结束&participants=a,b&limit=20
+
+        返回能容纳duration分钟的空闲区间 [[开始, 结束], ...]；within省略时为从现在起7天。
+        """
+        query_params = parse_qs(parsed_path.query)
+        try:
+            duration = int(query_params.get('duration', [''])[0])
+            limit = int(query_params.get('limit', ['20'])[0])
+        except ValueError:
+            self.send_error_response("duration和limit必须是整数", 400)
+            return
+        if not 1 <= duration <= 7 * 24 * 60:
+            self.send_error_response("duration必须在1到10080分钟之间", 400)
+            return
+        limit = max(1, min(limit, SLOTS_MAX_LIMIT))
+        
+        within = query_params.get('within', [''])[0]
+        if within:
+            start, _, end = within.partition('/')
+        else:
+            current = datetime.now().replace(second=0, microsecond=0)
+            start, end = current.isoformat(), (current + timedelta(days=SLOTS_DEFAULT_DAYS)).isoformat()
+        window = self.parse_window(start, end)
+        if window is None:
+            return
+        participants = self.parse_participants(query_params)
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        try:
+            def build():
+                busy = self.busy_intervals(conn, *window, participants)
+                return map(format_interval, free_gaps(busy, *window, duration * 60)[:limit])
+            
+            self.send_cached_json(conn, ('slots', 1, window, duration, limit, participants), build,
+                                  message="获取空闲时间成功")
+        except Exception as e:
+            self.send_error_response(f"获取空闲时间失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
     def handle_get_today_events(self):
         """获取今天的事件"""
         conn = self.get_db_connection()
@@ -802,157 +5738,326 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
             return
         
         try:
-            today = datetime.now().date().isoformat()
-            tomorrow = (datetime.now() + timedelta(days=1)).date().isoformat()
+            today = datetime.now().date().isoformat()
+            tomorrow = (datetime.now() + timedelta(days=1)).date().isoformat()
+            
+            # 包含跨越午夜的事件和今天发生的重复事件
+            self.send_cached_json(conn, ('today', 1, today),
+                                  lambda: self.iter_events_in_window(conn, today, tomorrow),
+                                  message="获取今日事件成功")
+            
+        except Exception as e:
+            self.send_error_response(f"获取今日事件失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_get_upcoming_events(self):
+        """获取即将发生的事件"""
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        
+        try:
+            # 取整到分钟，使同一分钟内的请求可以共用缓存
+            current = datetime.now().replace(second=0, microsecond=0)
+            now = current.isoformat()
+            next_week = (current + timedelta(days=7)).isoformat()
             
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM events 
-                WHERE user_id = 1 
-                AND start_time >= ? 
-                AND start_time < ?
-                ORDER BY start_time ASC
-            ''', (today, tomorrow))
+            # 在未来7天窗口内查询（含重复事件的发生），只保留尚未开始的
+            def build():
+                events = self.iter_events_in_window(conn, now, next_week, ["e.status = 'scheduled'"])
+                now_epoch = event_wall_epoch(now)
+                return (event for event in events if event_wall_epoch(event['start_time']) >= now_epoch)
             
-            events = [self.format_event(row) for row in cursor.fetchall()]
-            
-            self.send_json_response(events, message="获取今日事件成功")
+            self.send_cached_json(conn, ('upcoming', 1, now), build, message="获取即将发生事件成功")
             
         except Exception as e:
-            self.send_error_response(f"获取今日事件失败：{str(e)}", 500)
+            self.send_error_response(f"获取即将发生事件失败：{str(e)}", 500)
         finally:
             conn.close()
     
-    def handle_get_upcoming_events(self):
-        """获取即将发生的事件"""
+    def handle_get_file_list(self, parsed_path):
+        """获取已上传文件列表（来自uploads表）
+
+        参数：type 按类型过滤；sort=modified|name|size（默认modified）；order=desc|asc（默认desc）；
+        limit 每页条数（不传返回全部）；cursor 上一页响应头X-Next-Cursor的值。
+        """
         conn = self.get_db_connection()
         if not conn:
             return
         
         try:
-            now = datetime.now().isoformat()
-            next_week = (datetime.now() + timedelta(days=7)).isoformat()
+            query_params = parse_qs(parsed_path.query)
+            file_type = query_params.get('type', [None])[0]
+            sort = query_params.get('sort', ['modified'])[0]
+            order = query_params.get('order', ['desc'])[0].lower()
+            limit = query_params.get('limit', [None])[0]
+            cursor_param = query_params.get('cursor', [None])[0]
+            
+            if sort not in UPLOAD_SORT_COLUMNS or order not in ('asc', 'desc'):
+                self.send_error_response("sort必须是modified/name/size，order必须是asc/desc", 400)
+                return
+            column = UPLOAD_SORT_COLUMNS[sort]
+            try:
+                limit = min(int(limit), UPLOAD_LIST_MAX_LIMIT) if limit else None
+                if limit is not None and limit <= 0:
+                    raise ValueError
+                after = decode_cursor(cursor_param) if cursor_param else None
+            except ValueError:
+                self.send_error_response("limit或cursor参数无效", 400)
+                return
+            
+            conditions = []
+            params = []
+            if file_type:
+                conditions.append('type = ?')
+                params.append(file_type)
+            op = '<' if order == 'desc' else '>'
+            if after is not None:
+                if column == 'name':
+                    conditions.append(f'name {op} ?')
+                    params.append(after[-1])
+                else:
+                    conditions.append(f'({column}, name) {op} (?, ?)')
+                    params.extend(after[:2])
             
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            order_by = 'name' if column == 'name' else f'{column} {order.upper()}, name'
+            sql = f"SELECT * FROM uploads {where} ORDER BY {order_by} {order.upper()}"
+            if limit is not None:
+                sql += f" LIMIT {limit + 1}"
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM events 
-                WHERE user_id = 1 
-                AND start_time >= ? 
-                AND start_time < ?
-                AND status = 'scheduled'
-                ORDER BY start_time ASC
-            ''', (now, next_week))
+            cursor.execute(sql, params)
             
-            events = [self.format_event(row) for row in cursor.fetchall()]
+            headers = {}
+            if limit is not None:
+                rows = cursor.fetchall()
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    last = rows[-1]
+                    headers['X-Next-Cursor'] = encode_cursor([last[column], last['name']])
+                files = (format_upload(row) for row in rows)
+            else:
+                files = (format_upload(row) for row in iter_rows(cursor))
             
-            self.send_json_response(events, message="获取即将发生事件成功")
+            self.send_json_stream(files, message="获取文件列表成功", headers=headers)
             
         except Exception as e:
-            self.send_error_response(f"获取即将发生事件失败：{str(e)}", 500)
+            self.send_error_response(f"获取文件列表失败：{str(e)}", 500)
         finally:
             conn.close()
     
-    def handle_get_file_list(self):
-        """获取已上传文件列表"""
+    def handle_get_generated_files(self, parsed_path):
+        """获取生成文件列表（来自/files/目录，缓存的列表；可选offset、limit分页，总数见X-Total-Count）"""
         try:
-            if not os.path.exists(UPLOAD_DIR):
-                self.send_json_response([])
+            query_params = parse_qs(parsed_path.query)
+            try:
+                offset = max(0, int(query_params.get('offset', ['0'])[0]))
+                limit = query_params.get('limit', [None])[0]
+                limit = max(1, int(limit)) if limit else None
+            except ValueError:
+                self.send_error_response("offset或limit参数无效", 400)
                 return
             
-            files = []
-            for filename in os.listdir(UPLOAD_DIR):
-                filepath = os.path.join(UPLOAD_DIR, filename)
-                if os.path.isfile(filepath):
-                    stat = os.stat(filepath)
-                    
-                    # 确定文件类型
-                    ext = filename.split('.')[-1].lower() if '.' in filename else ''
-                    file_type = 'other'
-                    if ext in ['txt', 'md', 'json', 'js', 'py', 'html', 'css', 'xml']:
-                        file_type = 'text'
-                    elif ext in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'svg']:
-                        file_type = 'image'
-                    elif ext in ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx']:
-                        file_type = 'document'
-                    
-                    # 确定文件URL：优先使用/files/uploads/，如果不存在则使用/calendar/uploads/
-                    files_uploads_path = f"/var/www/switchyomega/files/uploads/{filename}"
-                    calendar_uploads_path = f"/calendar/uploads/{filename}"
-                    files_uploads_url = f"/files/uploads/{filename}"
-                    
-                    url = files_uploads_url  # 默认使用/files/uploads/
-                    
-                    # 检查/files/uploads/中是否有符号链接或文件
-                    if not os.path.exists(files_uploads_path):
-                        # 如果/files/uploads/中不存在，创建符号链接
-                        try:
-                            source_path = os.path.join(UPLOAD_DIR, filename)
-                            os.symlink(source_path, files_uploads_path)
-                            print(f"已创建符号链接: {files_uploads_path} -> {source_path}")
-                        except Exception as e:
-                            # 如果创建符号链接失败，使用/calendar/uploads/路径
-                            print(f"创建符号链接失败，使用备选路径: {e}")
-                            url = calendar_uploads_path
-                    
-                    files.append({
-                        'name': filename,
-                        'size': stat.st_size,
-                        'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                        'type': file_type,
-                        'url': url
-                    })
-            
-            # 按修改时间倒序排列（最新文件在前）
-            files.sort(key=lambda x: x['modified'], reverse=True)
-            
-            self.send_json_response(files, message="获取文件列表成功")
+            etag, body, total = generated_files_cache.page(offset, limit)
+            headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'X-Total-Count': str(total)}
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_not_modified(headers)
+                return
+            self.send_json_bytes(body, headers)
             
         except Exception as e:
-            self.send_error_response(f"获取文件列表失败：{str(e)}", 500)
+            self.send_error_response(f"获取生成文件列表失败：{str(e)}", 500)
+    
+    def handle_get_stats(self):
+        """获取服务器运行状态（连接池、请求队列）"""
+        stats = {
+            'pid': os.getpid(),
+            'db_pools': {
+                'events': events_db_pool.stats(),
+                'sessions': session_db_pool.stats()
+            },
+            'session_cache': session_cache.stats(),
+            'recurrence_cache': recurrence_cache.stats(),
+            'response_cache': response_cache.stats(),
+            'static_cache': static_cache.stats(),
+            'preview_cache': preview_cache.stats(),
+            'reminders': reminder_scheduler.stats(),
+            'generated_files': generated_files_cache.stats()
+        }
+        if isinstance(self.server, PooledHTTPServer):
+            stats['server'] = {
+                'workers': self.server.workers,
+                'queue_depth': self.server.queue_depth(),
+                'rejected': self.server.rejected_count
+            }
+        self.send_json_response(stats, message="获取运行状态成功")
+    
+    def handle_get_metrics(self):
+        """Prometheus文本格式的请求指标（prefork模式下合并所有工作进程）"""
+        body = render_metrics(request_metrics.collect()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
-    def handle_get_generated_files(self):
-        """获取生成文件列表（来自/files/目录）"""
+    def handle_get_queries(self, parsed_path):
+        """最近窗口内耗时最多的语句（带查询计划）和最近的慢查询"""
+        query_params = parse_qs(parsed_path.query)
+        sort = query_params.get('sort', ['total'])[0]
+        database = query_params.get('db', [None])[0]
+        if sort not in ('total', 'max', 'count', 'mean'):
+            self.send_error_response("sort 只支持 total、max、count、mean", 400)
+            return
         try:
-            # 生成文件目录路径
-            GENERATED_DIR = '/var/www/switchyomega/files'
-            
-            if not os.path.exists(GENERATED_DIR):
-                self.send_json_response([])
+            limit = min(max(int(query_params.get('limit', ['20'])[0]), 1), 200)
+        except ValueError:
+            self.send_error_response("limit 必须是整数", 400)
+            return
+        self.send_json_response({
+            'pid': os.getpid(),
+            'window_seconds': query_stats.window,
+            'slow_query_ms': query_stats.slow_ms,
+            'statements': query_stats.top(sort, limit, database),
+            'recent_slow': list(query_stats.recent_slow)[::-1],
+        }, message="获取查询统计成功")
+    
+    def handle_start_profile(self):
+        """开始剖析：{"mode": "sample|cprofile", "requests": N, "seconds": M, "route": "/api/events", "interval_ms": 5}"""
+        data = self.parse_request_data()
+        try:
+            requests = int(data['requests']) if data.get('requests') else None
+            # 只给请求数时以最长时长兜底
+            seconds = float(data.get('seconds') or (PROFILE_MAX_SECONDS if requests else PROFILE_SIGNAL_SECONDS))
+            interval = float(data.get('interval_ms') or PROFILE_DEFAULT_INTERVAL * 1000) / 1000
+            if (requests is not None and requests <= 0) or seconds <= 0 or interval <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            self.send_error_response("requests、seconds、interval_ms 必须是正数", 400)
+            return
+        try:
+            request_profiler.start(data.get('mode', 'sample'), requests, seconds, data.get('route') or None,
+                                   max(interval, 0.001))
+        except ValueError as e:
+            self.send_error_response(str(e), 400)
+            return
+        except RuntimeError as e:
+            self.send_json_response(request_profiler.status(), 409, str(e))
+            return
+        self.send_json_response(request_profiler.status(), 201, "剖析已开始")
+    
+    def handle_get_profile(self, parsed_path):
+        """剖析状态；format=collapsed|pstats|text 返回最近一次剖析的结果（可选route只看一个路由）"""
+        query_params = parse_qs(parsed_path.query)
+        output_format = query_params.get('format', [None])[0]
+        route = query_params.get('route', [None])[0]
+        session = request_profiler.session
+        if output_format is None:
+            self.send_json_response(request_profiler.status(), message="获取剖析状态成功")
+            return
+        if session is None:
+            self.send_error_response("还没有剖析结果", 404)
+            return
+        if output_format == 'collapsed' and session.mode == 'sample':
+            body, content_type = request_profiler.collapsed(session, route).encode('utf-8'), 'text/plain; charset=utf-8'
+        elif output_format == 'pstats' and session.mode == 'cprofile':
+            body, content_type = request_profiler.pstats_data(session, route), 'application/octet-stream'
+        elif output_format == 'text' and session.mode == 'cprofile':
+            body, content_type = request_profiler.stats_text(session, route).encode('utf-8'), 'text/plain; charset=utf-8'
+        else:
+            self.send_error_response("sample模式支持format=collapsed，cprofile模式支持format=pstats或text", 400)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_download_file(self, name):
+        """下载上传的文件，支持Range和条件请求（与静态文件相同的处理）"""
+        filepath = upload_file_path(name)
+        if filepath is None:
+            self.send_error_response("文件不存在", 404)
+            return
+        self.serve_static_file(os.path.basename(filepath), root=UPLOAD_DIR)
+    
+    def handle_get_file_preview(self, name, parsed_path):
+        """文件预览：开头/结尾的内容、编码、行数（大文件为估算值）
+
+        只用os.pread读取需要的部分，不读取整个文件；元数据在第一次读取后缓存。
+        可选参数head、tail指定字节数（默认由CALENDAR_PREVIEW_HEAD_BYTES/TAIL_BYTES配置，上限64KB）。
+        """
+        filepath = upload_file_path(name)
+        if filepath is None:
+            self.send_error_response("文件不存在", 404)
+            return
+        query_params = parse_qs(parsed_path.query)
+        try:
+            head_bytes = int(query_params.get('head', [PREVIEW_HEAD_BYTES])[0])
+            tail_bytes = int(query_params.get('tail', [PREVIEW_TAIL_BYTES])[0])
+        except ValueError:
+            self.send_error_response("head和tail必须是整数", 400)
+            return
+        if not (0 <= head_bytes <= PREVIEW_MAX_BYTES and 0 <= tail_bytes <= PREVIEW_MAX_BYTES):
+            self.send_error_response(f"head和tail必须在0到{PREVIEW_MAX_BYTES}之间", 400)
+            return
+        
+        try:
+            st = os.stat(filepath)
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}-{head_bytes:x}-{tail_bytes:x}"'
+            headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_not_modified(headers)
                 return
             
-            files = []
-            for filename in os.listdir(GENERATED_DIR):
-                filepath = os.path.join(GENERATED_DIR, filename)
-                if os.path.isfile(filepath):
-                    stat = os.stat(filepath)
-                    
-                    # 确定文件类型
-                    ext = filename.split('.')[-1].lower() if '.' in filename else ''
-                    file_type = 'other'
-                    if ext in ['txt', 'md', 'json', 'js', 'py', 'html', 'css', 'xml']:
-                        file_type = 'text'
-                    elif ext in ['jpg', 'jpeg', 'png', 'gif', 'webp', 'svg']:
-                        file_type = 'image'
-                    elif ext in ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx']:
-                        file_type = 'document'
-                    
-                    files.append({
-                        'name': filename,
-                        'size': stat.st_size,
-                        'created': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                        'type': file_type,
-                        'url': f"/files/{filename}"  # 注意：这是nginx直接服务的路径
-                    })
-            
-            # 按修改时间倒序排列（最新文件在前）
-            files.sort(key=lambda x: x['modified'], reverse=True)
-            
-            self.send_json_response(files, message="获取生成文件列表成功")
+            meta = preview_cache.get(filepath, st)
+            size = meta['size']
+            head_bytes = min(head_bytes, size)
+            tail_bytes = min(tail_bytes, size - head_bytes)
+            # 默认大小以内直接使用缓存，更大的请求才读取文件
+            if head_bytes <= len(meta['head']) and tail_bytes <= len(meta['tail']):
+                head = meta['head'][:head_bytes]
+                tail = meta['tail'][len(meta['tail']) - tail_bytes:]
+            else:
+                fd = os.open(filepath, os.O_RDONLY)
+                try:
+                    head = read_at(fd, 0, head_bytes)
+                    tail = read_at(fd, size - tail_bytes, tail_bytes)
+                finally:
+                    os.close(fd)
+            
+            preview = {
+                'name': os.path.basename(filepath),
+                'size': size,
+                'type': file_type_for(filepath),
+                'content_type': meta['content_type'],
+                'is_text': meta['is_text'],
+                'encoding': meta['encoding'],
+                'line_count': meta['line_count'],
+                'line_count_exact': meta['line_count_exact'],
+                'head_bytes': len(head),
+                'tail_bytes': len(tail),
+                'truncated': len(head) + len(tail) < size
+            }
+            if meta['is_text']:
+                preview['head'] = decode_head(head, meta['encoding'])
+                preview['tail'] = decode_tail(tail, meta['encoding'])
+            else:
+                preview['head_base64'] = base64.b64encode(head).decode()
+                preview['tail_base64'] = base64.b64encode(tail).decode()
             
+            body = json.dumps({
+                "success": True,
+                "message": "获取文件预览成功",
+                "data": preview,
+                "timestamp": datetime.now().isoformat()
+            }, ensure_ascii=False).encode()
+            self.send_json_bytes(body, headers)
         except Exception as e:
-            self.send_error_response(f"获取生成文件列表失败：{str(e)}", 500)
+            self.send_error_response(f"获取文件预览失败：{str(e)}", 500)
     
     def handle_delete_file(self, filename):
         """删除文件"""
@@ -981,8 +6086,20 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
                 self.send_error_response("无效的文件路径", 403)
                 return
             
-            # 删除文件
-            os.remove(filepath)
+            # 删除记录和文件在同一事务中完成，删除文件失败时回滚
+            conn = self.get_db_connection()
+            if not conn:
+                return
+            try:
+                with conn:
+                    orphan = remove_upload_record(conn, safe_filename)
+                    os.remove(filepath)
+            finally:
+                conn.close()
+            unlink_public_upload(safe_filename)
+            # 最后一个引用被删除时才删除去重存储的内容
+            if orphan:
+                blob_store.remove(orphan)
             
             self.send_json_response({
                 'filename': decoded_filename,
@@ -1009,112 +6126,478 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
         else:
             self.send_error_response("不支持的Content-Type，请使用multipart/form-data或application/json", 400)
     
+    def record_uploads(self, entries) -> bool:
+        """在一个事务中登记上传文件；失败时已发送错误响应并返回False"""
+        conn = self.get_db_connection()
+        if not conn:
+            return False
+        try:
+            with conn:
+                record_uploads(conn, entries)
+            return True
+        except sqlite3.Error as e:
+            self.send_error_response(f"登记上传文件失败：{str(e)}", 500)
+            return False
+        finally:
+            conn.close()
+    
     def handle_multipart_upload(self, content_type):
-        """处理multipart/form-data上传"""
+        """处理multipart/form-data上传
+
+        流式解析请求体，每个文件按块直接写入目标路径并计算SHA-256；
+        Content-Length超限时不读取请求体直接拒绝，写入过程中超过单文件上限立即中止。
+        一个请求可以包含多个文件，响应的顶层字段描述第一个文件，files列出全部文件。
+        """
+        saved = []
+        blobs = []  # 与saved对应，去重存储时引用的内容
+        writer = None
+        completed = False
         try:
-            # 解析multipart数据
-            environ = {
-                'REQUEST_METHOD': 'POST',
-                'CONTENT_TYPE': content_type,
-                'CONTENT_LENGTH': self.headers.get('Content-Length', 0)
-            }
+            match = re.search(r'boundary=(?:"([^"]+)"|([^;\s]+))', content_type)
+            if not match:
+                self.send_error_response("缺少multipart boundary", 400)
+                return
+            boundary = (match.group(1) or match.group(2)).encode('latin-1')
             
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ=environ
-            )
+            content_length = int(self.headers.get('Content-Length', 0) or 0)
+            if not content_length:
+                self.send_error_response("请求体为空", 400)
+                return
+            if content_length > UPLOAD_MAX_REQUEST_SIZE:
+                # 请求体未读取，不能复用连接
+                self.close_connection = True
+                self.send_error_response(f"请求体超过{UPLOAD_MAX_REQUEST_SIZE // (1024 * 1024)}MB限制", 413)
+                return
+            
+            reader = MultipartReader(self.rfile, boundary, content_length)
+            for headers, data in reader.parts():
+                original_filename = parse_header_params(headers.get('content-disposition', '')).get('filename')
+                if not original_filename or original_filename.strip() == '':
+                    continue
+                
+                safe_filename, filepath = reserve_upload_path(original_filename)
+                writer = UploadWriter(filepath)
+                for chunk in data:
+                    writer.write(chunk)
+                writer.close()
+                
+                saved.append({
+                    'filename': safe_filename,
+                    'original_filename': original_filename,
+                    'size': writer.size,
+                    'sha256': writer.sha256,
+                    'deduplicated': writer.deduplicated,
+                    'url': f"/uploads/{safe_filename}",
+                    'uploaded_at': datetime.now().isoformat()
+                })
+                blobs.append(writer.blob)
+                writer = None
             
-            # 获取文件字段
-            if 'file' not in form:
+            if not saved:
                 self.send_error_response("没有提供文件字段'file'", 400)
                 return
             
-            file_item = form['file']
+            # 同一事务登记本次上传的全部文件
+            if not self.record_uploads([
+                upload_catalog_entry(info['filename'], info['original_filename'], info['sha256'], blob)
+                for info, blob in zip(saved, blobs)
+            ]):
+                return
+            
+            # 返回响应
+            file_info = {
+                'success': True,
+                'message': '文件上传成功',
+                **saved[0],
+                'files': saved
+            }
+            completed = True
+            self.send_json_response(file_info, 201)
+            
+        except UploadTooLarge as e:
+            self.close_connection = True
+            self.send_error_response(str(e), 413)
+        except ValueError as e:
+            self.close_connection = True
+            self.send_error_response(f"multipart格式错误：{str(e)}", 400)
+        except Exception as e:
+            self.send_error_response(f"multipart上传失败：{str(e)}", 500)
+        finally:
+            if not completed:
+                # 请求失败时不保留任何文件
+                if writer is not None:
+                    writer.abort()
+                for info, blob in zip(saved, blobs):
+                    unlink_public_upload(info['filename'])
+                    try:
+                        os.remove(os.path.join(UPLOAD_DIR, info['filename']))
+                    except OSError:
+                        pass
+                    if blob:
+                        blob_store.unref(blob)
+    
+    # ==================== 断点续传 ====================
+    
+    def load_upload_session(self, conn, session_id):
+        """读取未过期的上传会话，不存在时发送404并返回None"""
+        row = conn.execute('SELECT * FROM upload_sessions WHERE id = ? AND expires_at >= ?',
+                           (session_id, time.time())).fetchone()
+        if row is None:
+            self.send_error_response("上传会话不存在或已过期", 404)
+        return row
+    
+    def upload_session_info(self, row, received=None):
+        received = json.loads(row['received']) if received is None else received
+        return {
+            'id': row['id'],
+            'filename': row['filename'],
+            'size': row['size'],
+            'offset': contiguous_offset(received),
+            'received': received,
+            'chunk_size': UPLOAD_RESUMABLE_CHUNK_SIZE,
+            'upload_url': f"/api/upload/resumable/{row['id']}",
+            'expires_at': datetime.fromtimestamp(row['expires_at']).isoformat()
+        }
+    
+    def send_upload_session(self, info, message):
+        """返回上传进度，同时带上tus风格的Upload-Offset/Upload-Length头"""
+        body = json.dumps({
+            "success": True,
+            "message": message,
+            "data": info,
+            "timestamp": datetime.now().isoformat()
+        }, ensure_ascii=False).encode()
+        self.send_json_bytes(body, {
+            'Upload-Offset': str(info['offset']),
+            'Upload-Length': str(info['size']),
+            'Cache-Control': 'no-store'
+        })
+    
+    def handle_create_resumable_upload(self):
+        """创建断点续传会话：{"filename", "size", "sha256"(可选)}，预先分配稀疏临时文件"""
+        data = self.parse_request_data()
+        filename = data.get('filename')
+        size = data.get('size')
+        sha256 = data.get('sha256')
+        if not isinstance(filename, str) or not filename.strip():
+            self.send_error_response("文件名不能为空", 400)
+            return
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            self.send_error_response("size必须是正整数", 400)
+            return
+        if size > UPLOAD_RESUMABLE_MAX_SIZE:
+            self.send_error_response(f"文件大小超过{UPLOAD_RESUMABLE_MAX_SIZE // (1024 * 1024)}MB限制", 413)
+            return
+        if sha256 is not None and not (isinstance(sha256, str) and re.fullmatch(r'[0-9a-fA-F]{64}', sha256)):
+            self.send_error_response("sha256格式无效", 400)
+            return
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        session_id = secrets.token_urlsafe(16)
+        filepath = upload_session_path(session_id)
+        try:
+            os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+            with open(filepath, 'wb') as f:
+                f.truncate(size)  # 稀疏文件，不实际占用磁盘
+            now = time.time()
+            with conn:
+                expire_upload_sessions(conn)
+                conn.execute('''
+                    INSERT INTO upload_sessions (id, filename, size, sha256, received, created_at, expires_at)
+                    VALUES (?, ?, ?, ?, '[]', ?, ?)
+                ''', (session_id, filename, size, sha256.lower() if sha256 else None, now, now + UPLOAD_SESSION_TTL))
+            row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+            self.send_json_response(self.upload_session_info(row), 201, message="上传会话已创建")
+        except Exception as e:
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            self.send_error_response(f"创建上传会话失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_get_resumable_upload(self, session_id):
+        """查询上传进度（offset为从头连续收到的字节数，received为全部已收到的区间）"""
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        try:
+            row = self.load_upload_session(conn, session_id)
+            if row is not None:
+                self.send_upload_session(self.upload_session_info(row), "获取上传进度成功")
+        except Exception as e:
+            self.send_error_response(f"获取上传进度失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_patch_resumable_upload(self, session_id):
+        """在Upload-Offset处写入一个分块
+
+        分块可以乱序、并行到达，用os.pwrite写入稀疏文件的对应位置；
+        带Upload-Checksum（sha256 <base64或十六进制>）时校验失败不记录该分块。
+        """
+        try:
+            offset = int(self.headers.get('Upload-Offset', ''))
+            length = int(self.headers.get('Content-Length', 0) or 0)
+        except ValueError:
+            self.send_error_response("缺少有效的Upload-Offset", 400)
+            return
+        if length <= 0:
+            self.send_error_response("请求体为空", 400)
+            return
+        if length > UPLOAD_RESUMABLE_CHUNK_SIZE:
+            self.close_connection = True
+            self.send_error_response(f"分块超过{UPLOAD_RESUMABLE_CHUNK_SIZE // (1024 * 1024)}MB限制", 413)
+            return
+        
+        expected_digest = None
+        checksum = self.headers.get('Upload-Checksum')
+        if checksum:
+            algorithm, _, value = checksum.strip().partition(' ')
+            if algorithm.lower() != 'sha256':
+                self.send_error_response("Upload-Checksum只支持sha256", 400)
+                return
+            try:
+                expected_digest = bytes.fromhex(value) if len(value) == 64 else base64.b64decode(value)
+            except ValueError:
+                self.send_error_response("Upload-Checksum格式无效", 400)
+                return
+        
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        try:
+            row = self.load_upload_session(conn, session_id)
+            if row is None:
+                self.close_connection = True
+                return
+            if offset < 0 or offset + length > row['size']:
+                self.close_connection = True
+                self.send_error_response("分块超出文件范围", 400)
+                return
             
-            # 处理多个文件的情况
-            if isinstance(file_item, list):
-                file_item = file_item[0]
+            # 写入期间不持有数据库事务，不同分块可以并行写入
+            hasher = hashlib.sha256()
+            position = offset
+            fd = os.open(upload_session_path(session_id), os.O_WRONLY)
+            try:
+                remaining = length
+                while remaining > 0:
+                    data = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not data:
+                        break
+                    os.pwrite(fd, data, position)
+                    hasher.update(data)
+                    position += len(data)
+                    remaining -= len(data)
+            finally:
+                os.close(fd)
             
-            if not hasattr(file_item, 'filename'):
-                self.send_error_response("无效的文件字段", 400)
+            if expected_digest is not None and (position != offset + length or hasher.digest() != expected_digest):
+                self.send_error_response("分块校验和不匹配", 400)
                 return
             
-            filename = file_item.filename
-            if not filename or filename.strip() == '':
-                self.send_error_response("文件名不能为空", 400)
+            # 合并区间需要串行化（并行分块、多进程）
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = conn.execute('SELECT received FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+                if current is None:
+                    conn.rollback()
+                    self.send_error_response("上传会话不存在或已过期", 404)
+                    return
+                received = json.loads(current['received'])
+                if position > offset:
+                    received = merge_ranges(received, offset, position)
+                conn.execute('UPDATE upload_sessions SET received = ?, expires_at = ? WHERE id = ?',
+                             (json.dumps(received), time.time() + UPLOAD_SESSION_TTL, session_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            self.send_upload_session(self.upload_session_info(row, received), "分块上传成功")
+        except Exception as e:
+            self.send_error_response(f"分块上传失败：{str(e)}", 500)
+        finally:
+            conn.close()
+    
+    def handle_complete_resumable_upload(self, session_id):
+        """完成上传：检查所有字节都已收到、校验SHA-256，然后移入上传目录并登记
+
+        登记提交之前任何一步失败，组装好的文件都移回会话的临时文件，会话可以重新完成。
+        """
+        data = self.parse_request_data()
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        alias = None
+        blob = None
+        deduplicated = False
+        source = None  # 提交之前保存着完整内容的文件
+        try:
+            row = self.load_upload_session(conn, session_id)
+            if row is None:
+                return
+            received = json.loads(row['received'])
+            if received != [[0, row['size']]]:
+                self.send_json_response(self.upload_session_info(row, received), 409, message="文件尚未上传完整", success=False)
                 return
+            expected = (data.get('sha256') or row['sha256'] or '').lower() or None
             
-            # 获取文件大小
-            file_item.file.seek(0, 2)
-            file_size = file_item.file.tell()
-            file_item.file.seek(0)
+            # 改名占有临时文件，防止重复完成
+            finalizing = upload_session_path(session_id) + '.finalizing'
+            try:
+                os.rename(upload_session_path(session_id), finalizing)
+            except FileNotFoundError:
+                self.send_error_response("上传会话正在完成或已完成", 409)
+                return
+            source = finalizing
             
-            if file_size > 30 * 1024 * 1024:
-                self.send_error_response("文件大小超过30MB限制", 400)
+            hasher = hashlib.sha256()
+            with open(finalizing, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+            sha256 = hasher.hexdigest()
+            if expected and sha256 != expected:
+                self.send_error_response("文件校验和不匹配", 400)
                 return
             
-            # 生成安全文件名
-            original_filename = filename
-            safe_filename = os.path.basename(original_filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            safe_filename = f"{timestamp}_{safe_filename}"
-            filepath = os.path.join(UPLOAD_DIR, safe_filename)
+            safe_filename, alias = reserve_upload_path(row['filename'])
+            if UPLOAD_DEDUP:
+                # 存入去重存储的是finalizing的硬链接（不支持时复制），提交前finalizing一直保留
+                staged = blob_store.temp_path()
+                try:
+                    os.link(finalizing, staged)
+                except OSError:
+                    shutil.copyfile(finalizing, staged)
+                deduplicated = blob_store.store(staged, sha256, alias, row['size'])
+                blob = sha256
+            else:
+                os.replace(finalizing, alias)
+                source = alias
             
-            # 保存文件
-            with open(filepath, 'wb') as f:
-                shutil.copyfileobj(file_item.file, f)
+            with conn:
+                record_uploads(conn, [upload_catalog_entry(safe_filename, row['filename'], sha256, blob)])
+                conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+            source = None
+            if UPLOAD_DEDUP:
+                try:
+                    os.remove(finalizing)
+                except OSError:
+                    pass
+            alias = None
             
-            # 返回响应
-            file_url = f"/uploads/{safe_filename}"
-            file_info = {
+            self.send_json_response({
                 'success': True,
-                'message': '文件上传成功',
+                'message': '文件上传成功（断点续传）',
                 'filename': safe_filename,
-                'original_filename': original_filename,
-                'size': file_size,
-                'url': file_url,
+                'original_filename': row['filename'],
+                'size': row['size'],
+                'sha256': sha256,
+                'deduplicated': deduplicated,
+                'url': f"/uploads/{safe_filename}",
                 'uploaded_at': datetime.now().isoformat()
-            }
-            
-            self.send_json_response(file_info, 201)
-            
+            }, 201)
         except Exception as e:
-            self.send_error_response(f"multipart上传失败：{str(e)}", 500)
+            self.send_error_response(f"完成上传失败：{str(e)}", 500)
+        finally:
+            if source is not None:
+                try:
+                    os.replace(source, upload_session_path(session_id))
+                except OSError as e:
+                    print(f"上传会话 {session_id} 的文件无法移回：{e}")
+            if alias is not None:
+                unlink_public_upload(os.path.basename(alias))
+                try:
+                    os.remove(alias)
+                except OSError:
+                    pass
+                if blob is not None:
+                    blob_store.unref(blob)
+            conn.close()
+    
+    def handle_cancel_resumable_upload(self, session_id):
+        """取消上传会话并删除临时文件"""
+        conn = self.get_db_connection()
+        if not conn:
+            return
+        try:
+            with conn:
+                deleted = conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,)).rowcount
+            if not deleted:
+                self.send_error_response("上传会话不存在或已过期", 404)
+                return
+            try:
+                os.remove(upload_session_path(session_id))
+            except OSError:
+                pass
+            self.send_json_response({'id': session_id, 'cancelled': True}, message="上传已取消")
+        except Exception as e:
+            self.send_error_response(f"取消上传失败：{str(e)}", 500)
+        finally:
+            conn.close()
     
     def handle_base64_upload(self):
-        """处理base64编码的文件上传"""
+        """处理base64编码的文件上传
+
+        从rfile流式解析JSON，content边读边解码写入文件，内存占用与文件大小无关；
+        filename出现在content之前时直接写入目标文件，否则先写入临时文件再重命名。
+        """
+        writer = None
+        completed = False
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
+            content_length = int(self.headers.get('Content-Length', 0) or 0)
             if not content_length:
                 self.send_error_response("请求体为空", 400)
                 return
+            # base64编码后约为原始大小的4/3，另留一些JSON字段的余量
+            max_length = min(UPLOAD_MAX_REQUEST_SIZE, (UPLOAD_MAX_SIZE + 2) // 3 * 4 + JSONUploadReader.MAX_FIELD_SIZE)
+            if content_length > max_length:
+                self.close_connection = True
+                self.send_error_response(f"文件大小超过{UPLOAD_MAX_SIZE // (1024 * 1024)}MB限制", 413)
+                return
             
-            raw_data = self.rfile.read(content_length).decode('utf-8')
-            data = json.loads(raw_data)
+            target = {}
+            
+            def on_stream_start(fields):
+                nonlocal writer
+                filename = fields.get('filename')
+                if isinstance(filename, str) and filename.strip():
+                    target['safe_filename'], filepath = reserve_upload_path(filename)
+                else:
+                    filepath = os.path.join(UPLOAD_DIR, f".upload-{secrets.token_hex(8)}.part")
+                writer = UploadWriter(filepath)
+                target['decoder'] = Base64StreamDecoder(writer.write)
+            
+            reader = JSONUploadReader(self.rfile, content_length)
+            data = reader.parse('content', on_stream_start, lambda chunk: target['decoder'].feed(chunk))
             
             if 'filename' not in data or 'content' not in data:
                 self.send_error_response("缺少filename或content字段", 400)
                 return
-            
-            # 解码base64内容
-            file_content = base64.b64decode(data['content'])
-            
-            # 验证文件大小
-            if len(file_content) > 30 * 1024 * 1024:
-                self.send_error_response("文件大小超过30MB限制", 400)
+            if not isinstance(data['filename'], str) or not data['filename'].strip():
+                self.send_error_response("文件名不能为空", 400)
                 return
+            if data['content'] is not True:
+                self.send_error_response("content必须是base64字符串", 400)
+                return
+            
+            target['decoder'].close()
+            writer.close()
             
-            # 生成安全文件名
             original_filename = data['filename']
-            safe_filename = os.path.basename(original_filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            safe_filename = f"{timestamp}_{safe_filename}"
-            filepath = os.path.join(UPLOAD_DIR, safe_filename)
+            safe_filename = target.get('safe_filename')
+            if safe_filename is None:
+                # content先于filename到达，写完后再移动到目标文件名
+                safe_filename, filepath = reserve_upload_path(original_filename)
+                os.replace(writer.filepath, filepath)
+                writer.filepath = filepath
             
-            # 保存文件
-            with open(filepath, 'wb') as f:
-                f.write(file_content)
+            if not self.record_uploads([upload_catalog_entry(safe_filename, original_filename, writer.sha256, writer.blob)]):
+                return
             
             # 构建响应
             file_url = f"/uploads/{safe_filename}"
@@ -1123,31 +6606,225 @@ class CalendarRequestHandler(BaseHTTPRequestHandler):
                 'message': '文件上传成功（base64）',
                 'filename': safe_filename,
                 'original_filename': original_filename,
-                'size': len(file_content),
+                'size': writer.size,
+                'sha256': writer.sha256,
+                'deduplicated': writer.deduplicated,
                 'url': file_url,
                 'uploaded_at': datetime.now().isoformat()
             }
             
+            completed = True
             self.send_json_response(file_info, 201)
             
+        except UploadTooLarge as e:
+            self.close_connection = True
+            self.send_error_response(str(e), 413)
         except json.JSONDecodeError:
+            self.close_connection = True
             self.send_error_response("无效的JSON数据", 400)
+        except binascii.Error:
+            self.send_error_response("无效的base64数据", 400)
+        except ValueError as e:
+            self.send_error_response(str(e), 400)
         except Exception as e:
             self.send_error_response(f"base64上传失败：{str(e)}", 500)
+        finally:
+            if not completed and writer is not None:
+                writer.abort()
+                unlink_public_upload(os.path.basename(writer.filepath))
+
+# ==================== 服务器实现 ====================
+
+class PooledHTTPServer(HTTPServer):
+    """线程池HTTP服务器
+
+    accept线程只负责把连接放入有界队列，由固定数量的工作线程处理；
+    队列已满时直接返回503，避免慢上传拖垮其他请求。
+    """
+    allow_reuse_address = True
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True,
+                 workers=WORKER_THREADS, queue_size=REQUEST_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.request_queue_size = max(5, queue_size)  # listen backlog
+        self._pending = queue.Queue(maxsize=max(1, queue_size))
+        self.rejected_count = 0
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'calendar-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """将连接放入队列，队列满则拒绝"""
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected_count += 1
+            request_metrics.record_rejected()
+            self.reject_request(request)
+
+    def _worker_loop(self):
+        """工作线程主循环"""
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject_request(self, request):
+        """队列已满时直接在accept线程中返回503"""
+        body = json.dumps({
+            'success': False,
+            'message': '服务器繁忙，请稍后重试',
+            'data': None,
+            'timestamp': datetime.now().isoformat()
+        }, ensure_ascii=False).encode()
+        head = (
+            'HTTP/1.1 503 Service Unavailable\r\n'
+            'Content-Type: application/json; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Retry-After: 1\r\n'
+            'Connection: close\r\n\r\n'
+        )
+        try:
+            request.settimeout(1.0)
+            request.sendall(head.encode() + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def queue_depth(self):
+        """当前排队等待处理的连接数"""
+        return self._pending.qsize()
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._threads:
+            self._pending.put(None)
+
+
+def create_server(server_address=None, mode=None):
+    """根据服务模式创建服务器实例（prefork模式下为每个子进程使用的实例）"""
+    if server_address is None:
+        server_address = (SERVER_HOST, SERVER_PORT)
+    mode = mode or SERVE_MODE
+    if mode == 'single':
+        return HTTPServer(server_address, CalendarRequestHandler)
+    return PooledHTTPServer(server_address, CalendarRequestHandler)
+
+
+def _run_prefork_child(listener):
+    """prefork子进程：复用父进程的监听socket运行线程池服务器"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    install_profile_signal()
+    server = PooledHTTPServer(listener.server_address, CalendarRequestHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = listener.socket
+    server.server_name = listener.server_name
+    server.server_port = listener.server_port
+    reminder_scheduler.start()
+    participants_migration.start()
+    search_chars_indexer.start()
+    request_metrics.share(METRICS_DIR)
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def run_prefork(server_address=None, processes=WORKER_PROCESSES):
+    """prefork模式：父进程监听端口并维护固定数量的工作进程"""
+    if server_address is None:
+        server_address = (SERVER_HOST, SERVER_PORT)
+
+    # 父进程只负责绑定和监听，非阻塞避免多个子进程争抢accept时卡住
+    listener = HTTPServer(server_address, CalendarRequestHandler)
+    listener.socket.setblocking(False)
+
+    # 上次运行留下的指标快照不再计入
+    if os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_prefork_child(listener)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # SIGUSR2由各工作进程各自处理（systemctl kill默认发给服务的所有进程）
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+    for _ in range(max(1, processes)):
+        spawn()
+
+    while children:
+        try:
+            pid, _status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        # 工作进程异常退出时自动补齐
+        if not stopping:
+            print(f"工作进程 {pid} 退出，重新启动")
+            spawn()
+
+    listener.server_close()
+
 
 def main():
     """主函数"""
     # 确保数据目录存在
     os.makedirs(DATA_DIR, exist_ok=True)
     
-    # 启动服务器
-    server_address = ('', 8001)
-    httpd = HTTPServer(server_address, CalendarRequestHandler)
+    mode = SERVE_MODE
+    if mode == 'prefork' and not hasattr(os, 'fork'):
+        mode = 'threaded'
     
-    print(f"日程管理服务器启动在 http://localhost:8001")
-    print(f"访问地址: http://localhost:8001/")
-    print(f"API地址: http://localhost:8001/api/events")
+    print(f"日程管理服务器启动在 http://localhost:{SERVER_PORT}")
+    print(f"访问地址: http://localhost:{SERVER_PORT}/")
+    print(f"API地址: http://localhost:{SERVER_PORT}/api/events")
     print(f"认证用户: {AUTH_USER} / {AUTH_PASS}")
+    print(f"服务模式: {mode}（线程数 {WORKER_THREADS}，进程数 {WORKER_PROCESSES if mode == 'prefork' else 1}，队列上限 {REQUEST_QUEUE_SIZE}）")
+    
+    if mode == 'prefork':
+        run_prefork()
+        print("\n服务器已停止")
+        return
+    
+    # 启动服务器
+    httpd = create_server(mode=mode)
+    reminder_scheduler.start()
+    participants_migration.start()
+    search_chars_indexer.start()
+    install_profile_signal()
     
     try:
         httpd.serve_forever()
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+"""
+日程管理系统性能基准测试
+生成合成事件数据，在进程内启动app.py服务器（或压测已运行的服务器），
+按配置的并发数和请求比例驱动混合负载，输出各操作的延迟分位数、吞吐量和内存占用，
+结果保存为JSON，可与之前的结果比较以发现性能回退
+"""
+
+import argparse
+import contextlib
+import http.client
+import importlib.util
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, 'data', 'benchmarks')
+
+# 默认请求比例：以时间范围查询为主，读多写少
+DEFAULT_MIX = 'range=30,range_type=10,today=10,upcoming=10,get=10,create=8,update=8,delete=6,login=4,upload=4'
+
+# 合成数据
+EVENT_TYPES = ['meeting', 'work', 'personal', 'other']
+EVENT_TYPE_WEIGHTS = [40, 35, 15, 10]
+DURATIONS = [15, 30, 30, 45, 60, 60, 60, 90, 120, 180]  # 分钟
+START_MINUTES = [0, 0, 0, 15, 30, 30, 45]
+RECURRENCE_RULES = [
+    'FREQ=WEEKLY',
+    'FREQ=WEEKLY;BYDAY=MO,WE,FR;COUNT=30',
+    'FREQ=DAILY;COUNT=10',
+    'FREQ=MONTHLY;COUNT=12',
+]
+TITLES = ['周会', '项目评审', '需求讨论', '代码评审', '一对一', '客户拜访', '培训', '面试',
+          '复盘', '午餐', '健身', '出差', '版本发布', '预算会议', '技术分享']
+LOCATIONS = ['', '', '会议室A', '会议室B', '大会议室', '线上', '客户现场', '咖啡厅']
+PARTICIPANTS = [f'成员{i:03d}' for i in range(200)]
+
+SEED_BATCH_SIZE = 10000  # 生成数据时每个事务插入的事件数
+RSS_SAMPLE_INTERVAL = 0.5  # 压测期间采样内存占用的间隔（秒）
+COMPARE_MIN_SAMPLES = 30  # 比较结果时，样本数少于此值的操作不参与比较
+
+
+def parse_mix(text):
+    """解析"操作=权重,..."格式的请求比例"""
+    mix = []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"未知操作：{name}（可选：{', '.join(OPERATIONS)}）")
+        weight = float(weight or 1)
+        if weight > 0:
+            mix.append((name, weight))
+    if not mix:
+        raise ValueError("请求比例为空")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    """最近秩分位数（输入已排序）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values), max(1, math.ceil(fraction * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+def read_rss(pid='self'):
+    """读取进程当前和峰值常驻内存（KB），不可用时返回(None, 峰值)"""
+    if pid is None:
+        return None, None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]), int(fields['VmHWM'].split()[0])
+    except (OSError, KeyError, ValueError):
+        if pid != 'self':
+            return None, None
+        import resource
+        return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ==================== 合成数据 ====================
+
+def synthetic_events(count, span_start, span_days, recurring_ratio, seed, recurrence_end_for):
+    """生成符合日常分布的事件行：工作日为主、白天集中在午后、时长以半小时到一小时为主"""
+    rng = random.Random(seed)
+    now = datetime.now().isoformat()
+    for _ in range(count):
+        day = span_start + timedelta(days=rng.randrange(span_days))
+        # 周末事件约为工作日的五分之一
+        while day.weekday() >= 5 and rng.random() < 0.8:
+            day = span_start + timedelta(days=rng.randrange(span_days))
+
+        is_all_day = rng.random() < 0.05
+        if is_all_day:
+            start = day
+            end = start + timedelta(days=rng.choice([1, 1, 1, 2, 3]))
+        else:
+            hour = min(20, max(7, int(rng.gauss(13, 2.5))))
+            start = day.replace(hour=hour, minute=rng.choice(START_MINUTES))
+            end = start + timedelta(minutes=rng.choice(DURATIONS))
+        start_time, end_time = start.isoformat(), end.isoformat()
+
+        recurrence_rule = recurrence_end = None
+        if rng.random() < recurring_ratio:
+            recurrence_rule = rng.choice(RECURRENCE_RULES)
+            recurrence_end = recurrence_end_for(start_time, end_time, recurrence_rule)
+
+        event_type = rng.choices(EVENT_TYPES, EVENT_TYPE_WEIGHTS)[0]
+        participants = ', '.join(rng.sample(PARTICIPANTS, rng.choice([0, 0, 1, 2, 2, 3, 4, 6])))
+        status = 'completed' if start < datetime.now() and rng.random() < 0.7 else \
+            rng.choices(['scheduled', 'cancelled'], [95, 5])[0]
+        yield (1, f'{rng.choice(TITLES)} {rng.randrange(10000)}', '', event_type, start_time, end_time,
+               rng.choice(LOCATIONS), participants, status, rng.choice([0, 5, 10, 15, 15, 30]),
+               1 if is_all_day else 0, recurrence_rule, recurrence_end, now)
+
+
+def seed_database(db_path, args, recurrence_end_for):
+    """向calendar.db写入args.events个合成事件（所有触发器维护的索引同步生成）"""
+    span_start = (datetime.now() - timedelta(days=args.span_days * 2 // 3)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    rows = synthetic_events(args.events, span_start, args.span_days, args.recurring_ratio,
+                            args.seed, recurrence_end_for)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    started = time.monotonic()
+    inserted = 0
+    try:
+        while inserted < args.events:
+            batch = [row for _, row in zip(range(SEED_BATCH_SIZE), rows)]
+            if not batch:
+                break
+            with conn:
+                conn.executemany('''
+                    INSERT INTO events (user_id, title, description, event_type, start_time, end_time,
+                                        location, participants, status, reminder_minutes, is_all_day,
+                                        recurrence_rule, recurrence_end, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+            inserted += len(batch)
+            elapsed = time.monotonic() - started
+            print(f"\r  已生成 {inserted}/{args.events} 个事件（{inserted / max(elapsed, 1e-6):.0f}/秒）",
+                  end='', flush=True)
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+    print()
+
+
+def prepare_data_dir(args):
+    """准备独立的数据目录并生成数据；返回数据目录和是否为临时目录"""
+    temporary = args.data_dir is None
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='calendar-bench-')
+    db_path = os.path.join(data_dir, 'calendar.db')
+    if args.reseed:
+        for suffix in ('', '-wal', '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(db_path + suffix)
+    seed = not os.path.exists(db_path)
+    os.makedirs(os.path.join(data_dir, 'uploads'), exist_ok=True)
+    os.makedirs(os.path.join(data_dir, 'public'), exist_ok=True)
+
+    # app.py和init_db.py在导入时读取这些配置
+    os.environ['CALENDAR_DATA_DIR'] = data_dir
+    os.environ['CALENDAR_UPLOAD_DIR'] = os.path.join(data_dir, 'uploads')
+    os.environ['CALENDAR_PUBLIC_UPLOAD_DIR'] = os.path.join(data_dir, 'public')
+    os.environ['CALENDAR_USER'] = args.user
+    os.environ['CALENDAR_PASS'] = args.password
+    os.environ['CALENDAR_REMINDER_SINK'] = 'none'
+    if args.threads:
+        os.environ['CALENDAR_WORKER_THREADS'] = str(args.threads)
+
+    if seed:
+        spec = importlib.util.spec_from_file_location('init_db', os.path.join(BASE_DIR, 'cgi-bin', 'init_db.py'))
+        init_db = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(init_db)
+        with contextlib.redirect_stdout(io.StringIO()):
+            init_db.init_database()
+    return data_dir, temporary, seed
+
+
+def start_server(args):
+    """在进程内启动app.py服务器，返回(服务器, 地址)"""
+    sys.path.insert(0, BASE_DIR)
+    import app
+    if args.seed_only:
+        return app, None, None
+    server = app.create_server(('127.0.0.1', 0), mode=args.mode)
+    thread = threading.Thread(target=server.serve_forever, name='calendar-bench-server', daemon=True)
+    thread.start()
+    return app, server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+# ==================== 负载 ====================
+
+class BenchmarkClient:
+    """单个压测线程使用的持久连接客户端"""
+
+    def __init__(self, base_url, token, state):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.token = token
+        self.state = state
+        self.rng = random.Random()
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """发送请求并读完响应，返回(状态码, 响应体)；连接断开时重连一次"""
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response.status, data
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def request_json(self, method, path, payload):
+        return self.request(method, path, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                            {'Content-Type': 'application/json'})
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def random_window(self):
+        state = self.state
+        span = max(0, int((state.span_end - state.span_start).total_seconds()) - state.range_days * 86400)
+        start = state.span_start + timedelta(seconds=self.rng.randrange(span + 1))
+        return start.replace(minute=0, second=0, microsecond=0), \
+            (start + timedelta(days=state.range_days)).replace(minute=0, second=0, microsecond=0)
+
+    def new_event(self):
+        start = datetime.now().replace(second=0, microsecond=0) + timedelta(
+            days=self.rng.randrange(60), hours=self.rng.randrange(-6, 6))
+        return {
+            'title': f'压测事件 {self.rng.randrange(100000)}',
+            'event_type': self.rng.choices(EVENT_TYPES, EVENT_TYPE_WEIGHTS)[0],
+            'start_time': start.isoformat(),
+            'end_time': (start + timedelta(minutes=self.rng.choice(DURATIONS))).isoformat(),
+            'location': self.rng.choice(LOCATIONS),
+            'participants': self.rng.sample(PARTICIPANTS, 2),
+        }
+
+
+def op_range(client):
+    start, end = client.random_window()
+    return client.request('GET', '/api/events?' + urlencode({'start': start.isoformat(), 'end': end.isoformat()})), (200,)
+
+
+def op_range_type(client):
+    start, end = client.random_window()
+    query = {'start': start.isoformat(), 'end': end.isoformat(), 'type': client.rng.choice(EVENT_TYPES)}
+    return client.request('GET', '/api/events?' + urlencode(query)), (200,)
+
+
+def op_today(client):
+    return client.request('GET', '/api/events/today'), (200,)
+
+
+def op_upcoming(client):
+    return client.request('GET', '/api/events/upcoming'), (200,)
+
+
+def op_get(client):
+    event_id = client.rng.randint(1, max(1, client.state.max_id))
+    return client.request('GET', f'/api/events/{event_id}'), (200, 404)
+
+
+def op_create(client):
+    status, body = client.request_json('POST', '/api/events', client.new_event())
+    if status == 201:
+        client.state.push_event(json.loads(body)['data']['id'])
+    return (status, body), (201,)
+
+
+def op_update(client):
+    event_id = client.state.pick_event(client.rng)
+    if event_id is None:
+        return op_create(client)
+    return client.request_json('PUT', f'/api/events/{event_id}', {'title': f'已修改 {client.rng.randrange(100000)}'}), (200, 404)
+
+
+def op_delete(client):
+    event_id = client.state.pop_event(client.rng)
+    if event_id is None:
+        return op_create(client)
+    return client.request('DELETE', f'/api/events/{event_id}'), (200, 404)
+
+
+def op_login(client):
+    return client.request_json('POST', '/api/login', {'username': client.state.user, 'password': client.state.password}), (200,)
+
+
+def op_upload(client):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.bin"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + \
+        os.urandom(client.state.upload_size) + f'\r\n--{boundary}--\r\n'.encode()
+    status, data = client.request('POST', '/api/upload', body,
+                                  {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    if status == 201:
+        client.state.push_upload(json.loads(data)['data']['filename'])
+    return (status, data), (201,)
+
+
+OPERATIONS = {
+    'range': op_range,
+    'range_type': op_range_type,
+    'today': op_today,
+    'upcoming': op_upcoming,
+    'get': op_get,
+    'create': op_create,
+    'update': op_update,
+    'delete': op_delete,
+    'login': op_login,
+    'upload': op_upload,
+}
+
+
+class WorkloadState:
+    """压测线程共享的状态：数据时间范围、压测中创建的事件和上传文件"""
+
+    def __init__(self, args, span_start, span_end, max_id):
+        self.user = args.user
+        self.password = args.password
+        self.range_days = args.range_days
+        self.upload_size = args.upload_size
+        self.span_start = span_start
+        self.span_end = span_end
+        self.max_id = max_id
+        self.created = []
+        self.uploads = []
+        self._lock = threading.Lock()
+
+    def push_event(self, event_id):
+        with self._lock:
+            self.created.append(event_id)
+
+    def pick_event(self, rng):
+        with self._lock:
+            return rng.choice(self.created) if self.created else None
+
+    def pop_event(self, rng):
+        with self._lock:
+            if not self.created:
+                return None
+            index = rng.randrange(len(self.created))
+            self.created[index], self.created[-1] = self.created[-1], self.created[index]
+            return self.created.pop()
+
+    def push_upload(self, filename):
+        with self._lock:
+            self.uploads.append(filename)
+
+
+def data_span(db_path):
+    """压测使用的时间范围和最大事件ID：进程内直接读库，外部服务器使用最近一年半"""
+    if db_path:
+        conn = sqlite3.connect(db_path)
+        try:
+            first, last, max_id = conn.execute('SELECT MIN(start_time), MAX(start_time), MAX(id) FROM events').fetchone()
+        finally:
+            conn.close()
+        if first:
+            return datetime.fromisoformat(first[:19]), datetime.fromisoformat(last[:19]), max_id
+    now = datetime.now().replace(microsecond=0)
+    return now - timedelta(days=365), now + timedelta(days=180), 1000
+
+
+def run_level(base_url, token, state, mix, concurrency, duration, warmup, pid):
+    """以给定并发运行一轮压测，返回该轮的统计结果"""
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    statuses = {}
+    rss = {'max_kb': None, 'end_kb': None}
+    stop = threading.Event()
+    measuring = threading.Event()
+    lock = threading.Lock()
+
+    def worker():
+        client = BenchmarkClient(base_url, token, state)
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        local_statuses = {}
+        try:
+            while not stop.is_set():
+                name = client.rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    (status, _), expected = OPERATIONS[name](client)
+                    ok = status in expected
+                except Exception:
+                    status, ok = 'exception', False
+                    client.close()
+                elapsed = time.perf_counter() - started
+                if measuring.is_set():
+                    local[name].append(elapsed)
+                    local_statuses[str(status)] = local_statuses.get(str(status), 0) + 1
+                    if not ok:
+                        local_errors[name] += 1
+        finally:
+            client.close()
+            with lock:
+                for name in names:
+                    samples[name].extend(local[name])
+                    errors[name] += local_errors[name]
+                for status, count in local_statuses.items():
+                    statuses[status] = statuses.get(status, 0) + count
+
+    def monitor():
+        while not stop.wait(RSS_SAMPLE_INTERVAL):
+            current, _peak = read_rss(pid)
+            if current is not None:
+                rss['end_kb'] = current
+                rss['max_kb'] = max(rss['max_kb'] or 0, current)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    threads.append(threading.Thread(target=monitor, daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    measuring.set()
+    measure_started = time.perf_counter()
+    time.sleep(duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - measure_started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    current, peak = read_rss(pid)
+    rss['end_kb'] = current if current is not None else rss['end_kb']
+    rss['peak_kb'] = peak
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    def summarize(values, error_count):
+        values.sort()
+        return {
+            'count': len(values),
+            'errors': error_count,
+            'throughput': round(len(values) / elapsed, 2),
+            'mean_ms': ms(sum(values) / len(values)) if values else None,
+            'p50_ms': ms(percentile(values, 0.50)),
+            'p95_ms': ms(percentile(values, 0.95)),
+            'p99_ms': ms(percentile(values, 0.99)),
+            'max_ms': ms(values[-1]) if values else None,
+        }
+
+    operations = {name: summarize(samples[name], errors[name]) for name in names}
+    overall = summarize([value for name in names for value in samples[name]], sum(errors.values()))
+    return {
+        'concurrency': concurrency,
+        'duration': round(elapsed, 3),
+        'total': overall,
+        'operations': operations,
+        'statuses': statuses,
+        'rss': rss,
+    }
+
+
+def print_level(result):
+    print(f"\n并发 {result['concurrency']}：{result['total']['throughput']:.1f} 请求/秒，"
+          f"错误 {result['total']['errors']}，RSS {result['rss'].get('end_kb')}KB（峰值 {result['rss'].get('peak_kb')}KB）")
+    print(f"  {'操作':<12}{'次数':>8}{'请求/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'错误':>6}")
+    for name, stats in list(result['operations'].items()) + [('全部', result['total'])]:
+        if not stats['count']:
+            continue
+        print(f"  {name:<12}{stats['count']:>8}{stats['throughput']:>10.1f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['errors']:>6}")
+
+
+def compare_results(current, baseline_path, threshold):
+    """与之前保存的结果比较，返回发现的回退项
+
+    各操作的吞吐量取决于请求比例中的随机抽样，只比较p95；总体同时比较吞吐量和p95。
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {level['concurrency']: level for level in baseline.get('results', [])}
+    regressions = []
+    print(f"\n与 {baseline_path}（{baseline.get('meta', {}).get('git_revision')}）比较：")
+    for level in current['results']:
+        old_level = previous.get(level['concurrency'])
+        if not old_level:
+            continue
+        for name, stats in list(level['operations'].items()) + [('total', level['total'])]:
+            old = old_level['total'] if name == 'total' else old_level['operations'].get(name)
+            if not old or min(old['count'], stats['count']) < COMPARE_MIN_SAMPLES:
+                continue
+            throughput_change = stats['throughput'] / old['throughput'] - 1 if name == 'total' else 0
+            p95_change = stats['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0
+            flag = ''
+            if throughput_change < -threshold or p95_change > threshold:
+                flag = '  <- 回退'
+                regressions.append({'concurrency': level['concurrency'], 'operation': name,
+                                    'throughput_change': round(throughput_change, 4),
+                                    'p95_change': round(p95_change, 4)})
+            throughput = f"吞吐 {throughput_change:+7.1%}  " if name == 'total' else ' ' * 15
+            print(f"  并发 {level['concurrency']:<4}{name:<12}{throughput}p95 {p95_change:+7.1%}{flag}")
+    return regressions
+
+
+def cleanup_remote(base_url, token, state):
+    """压测外部服务器时删除压测中创建的事件和上传文件"""
+    client = BenchmarkClient(base_url, token, state)
+    try:
+        for event_id in state.created:
+            client.request('DELETE', f'/api/events/{event_id}')
+        for filename in state.uploads:
+            client.request('DELETE', f'/api/uploads/{filename}')
+    finally:
+        client.close()
+
+
+def login(base_url, user, password):
+    client = BenchmarkClient(base_url, None, None)
+    try:
+        status, body = client.request_json('POST', '/api/login', {'username': user, 'password': password})
+    finally:
+        client.close()
+    if status != 200:
+        raise SystemExit(f"登录失败（HTTP {status}）：{body[:200].decode('utf-8', 'replace')}")
+    return json.loads(body)['data']['session_token']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='日程管理系统性能基准测试')
+    data = parser.add_argument_group('数据')
+    data.add_argument('--events', type=int, default=10000, help='生成的事件数（默认10000）')
+    data.add_argument('--span-days', type=int, default=730, help='事件分布的天数，约三分之二在过去（默认730）')
+    data.add_argument('--recurring-ratio', type=float, default=0.02, help='重复事件比例（默认0.02）')
+    data.add_argument('--seed', type=int, default=42, help='随机种子')
+    data.add_argument('--data-dir', help='数据目录；已有calendar.db时直接复用（默认使用临时目录）')
+    data.add_argument('--reseed', action='store_true', help='删除数据目录中已有的数据库重新生成')
+    data.add_argument('--seed-only', action='store_true', help='只生成数据，不压测')
+
+    server = parser.add_argument_group('服务器')
+    server.add_argument('--url', help='压测已运行的服务器（如 http://127.0.0.1:8001），不生成数据')
+    server.add_argument('--pid', help='--url 模式下服务器进程的PID，用于读取内存占用')
+    server.add_argument('--mode', choices=['threaded', 'single'], default='threaded', help='进程内服务器的服务模式')
+    server.add_argument('--threads', type=int, help='进程内服务器的工作线程数（CALENDAR_WORKER_THREADS）')
+    server.add_argument('--user', default=os.getenv('CALENDAR_USER', 'admin'))
+    server.add_argument('--password', default=os.getenv('CALENDAR_PASS', 'benchmark'))
+
+    load = parser.add_argument_group('负载')
+    load.add_argument('--concurrency', default='1,8,32', help='逗号分隔的并发数，每个并发数运行一轮（默认1,8,32）')
+    load.add_argument('--duration', type=float, default=10, help='每轮计入统计的秒数（默认10）')
+    load.add_argument('--warmup', type=float, default=2, help='每轮开始前不计入统计的预热秒数（默认2）')
+    load.add_argument('--mix', default=DEFAULT_MIX, help=f'请求比例（默认 {DEFAULT_MIX}）')
+    load.add_argument('--range-days', type=int, default=7, help='时间范围查询的窗口天数（默认7）')
+    load.add_argument('--upload-size', type=int, default=64 * 1024, help='上传文件大小（字节，默认65536）')
+
+    output = parser.add_argument_group('结果')
+    output.add_argument('--output', help=f'结果JSON路径（默认 {os.path.relpath(RESULTS_DIR, BASE_DIR)}/时间戳.json）')
+    output.add_argument('--compare', help='与之前保存的结果JSON比较')
+    output.add_argument('--threshold', type=float, default=0.10,
+                        help='吞吐下降或p95上升超过此比例视为回退，比较时有回退则以状态码1退出（默认0.10）')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        levels = [int(value) for value in args.concurrency.split(',') if value.strip()]
+    except ValueError as e:
+        parser.error(str(e))
+
+    data_dir = temporary = None
+    server_instance = None
+    seeded = False
+    try:
+        if args.url:
+            base_url, db_path, pid = args.url.rstrip('/'), None, args.pid
+        else:
+            data_dir, temporary, seeded = prepare_data_dir(args)
+            app, server_instance, base_url = start_server(args)
+            db_path = app.DB_PATH
+            pid = 'self'
+            if seeded:
+                print(f"生成合成数据：{args.events} 个事件 -> {db_path}")
+                seed_database(db_path, args, app.recurrence_end_for)
+            if args.seed_only:
+                print(f"数据已生成：{data_dir}")
+                return 0
+            print(f"进程内服务器：{base_url}（{args.mode}，数据目录 {data_dir}）")
+
+        token = login(base_url, args.user, args.password)
+        span_start, span_end, max_id = data_span(db_path)
+        state = WorkloadState(args, span_start, span_end, max_id)
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'target': args.url or f'in-process ({args.mode})',
+                'events': max_id,
+                'span': [span_start.isoformat(), span_end.isoformat()],
+                'mix': dict(mix),
+                'args': vars(args),
+            },
+            'results': [],
+        }
+        for concurrency in levels:
+            result = run_level(base_url, token, state, mix, concurrency, args.duration, args.warmup, pid)
+            report['results'].append(result)
+            print_level(result)
+
+        if args.url:
+            cleanup_remote(base_url, token, state)
+
+        output_path = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d_%H%M%S') + '.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存：{output_path}")
+
+        if args.compare and compare_results(report, args.compare, args.threshold):
+            return 1
+        return 0
+    finally:
+        if server_instance is not None:
+            server_instance.shutdown()
+            server_instance.server_close()
+        if temporary and data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 日程管理数据库初始化脚本
+
+只创建基础表；重复事件、区间索引、全文索引、提醒、参与者和上传目录等
+派生的表和触发器由app.py启动时创建和迁移，不在这里重复。
 """
 import os
 import sqlite3
@@ -8,7 +11,7 @@ import sys
 
 # 数据库路径
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+DATA_DIR = os.getenv('CALENDAR_DATA_DIR', os.path.join(BASE_DIR, 'data'))
 DB_PATH = os.path.join(DATA_DIR, 'calendar.db')
 
 def init_database():
@@ -45,6 +45,12 @@ def get_file_list():
     response = requests.get(url, auth=(USERNAME, PASSWORD))
     return response.json()
 
+def preview_file(filename, head=500):
+    """获取文件预览（开头/结尾内容、编码、行数），不下载整个文件"""
+    url = f"{BASE_URL}/api/uploads/{filename}/preview"
+    response = requests.get(url, params={'head': head}, auth=(USERNAME, PASSWORD))
+    return response.json()
+
 def download_file(file_url):
     """下载文件"""
     url = f"{BASE_URL}{file_url}"
@@ -124,17 +130,18 @@ def main():
             break
     
     if target_file:
-        content = download_file(target_file['url'])
+        # 只需要片段时使用预览接口，服务器只读取文件开头和结尾
+        preview = preview_file(target_file['name'], head=4096)['data']
+        content = preview['head']
         print(f"   文件内容预览:")
         print(f"   {'='*50}")
         print(content[:500] + "..." if len(content) > 500 else content)
         print(f"   {'='*50}")
         
         # 简单的分析示例
-        lines = content.split('\n')
         print(f"   分析结果:")
-        print(f"   - 文件大小: {len(content)} 字符")
-        print(f"   - 行数: {len(lines)} 行")
+        print(f"   - 文件大小: {preview['size']} 字节（编码 {preview['encoding']}）")
+        print(f"   - 行数: {preview['line_count']} 行{'' if preview['line_count_exact'] else '（估算）'}")
         print(f"   - 包含'项目'关键词: {'项目' in content}")
         print(f"   - 包含'问题'关键词: {'问题' in content}")
     else: